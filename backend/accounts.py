@@ -0,0 +1,161 @@
+"""账户缓存
+
+在内存中缓存用户的余额和持仓，get_user_info命中缓存时不访问数据库。
+第一次读取某个用户时从数据库加载；之后写线程在交易所在的批次提交后把
+余额和持仓的变化应用到缓存上（写穿），缓存中的内容始终是已提交的状态。
+按估算的内存占用设置上限，超出后淘汰最久未访问的用户。
+
+读取方加载期间如果该用户有新的提交，加载到的数据可能早于这次提交，
+这种情况下不放入缓存，下次读取时重新加载。
+
+COMMIT之后、提交回调执行之前加载到的数据已经包含这次修改，放入缓存后回调会再应用一次。
+因此写操作在提交前用begin_change()标记用户，直到修改应用到缓存或回滚，
+期间加载到的数据都不放入缓存。
+"""
+import threading
+from collections import OrderedDict
+
+# 估算的内存占用：每个用户的固定开销和每条持仓的开销
+ACCOUNT_BYTES = 240
+HOLDING_BYTES = 120
+
+
+def cache_key(user_id):
+    """统一用户ID的类型，无法转换为整数时返回None"""
+    if isinstance(user_id, int):
+        return int(user_id)
+    if isinstance(user_id, str) and user_id.isdigit():
+        return int(user_id)
+    return None
+
+
+class Account:
+    __slots__ = ('balance', 'holdings')
+
+    def __init__(self, balance, holdings):
+        self.balance = balance
+        self.holdings = holdings  # 股票代码 -> 数量
+
+    def size(self):
+        return ACCOUNT_BYTES + HOLDING_BYTES * len(self.holdings)
+
+
+class AccountCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes  # 0表示不缓存
+        self.lock = threading.Lock()
+        self.accounts = OrderedDict()  # 用户ID -> Account，按最近访问排序
+        self.bytes = 0
+        self.loading = {}  # 正在加载的用户ID -> 加载期间是否有新的提交
+        self.changing = {}  # 有未应用到缓存的修改的用户ID -> 修改数，None表示无法确定用户的修改
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id, load):
+        """返回(余额, [(股票代码, 数量)])，未缓存时调用load()从数据库加载，用户不存在时返回None"""
+        key = cache_key(user_id)
+        if key is None or self.max_bytes <= 0:
+            return load()
+        with self.lock:
+            account = self.accounts.get(key)
+            if account is not None:
+                self.accounts.move_to_end(key)
+                self.hits += 1
+                return account.balance, list(account.holdings.items())
+            self.misses += 1
+            self.loading[key] = key in self.changing or None in self.changing
+        try:
+            loaded = load()
+        except BaseException:
+            with self.lock:
+                self.loading.pop(key, None)
+            raise
+        with self.lock:
+            stale = self.loading.pop(key, True)
+            if loaded is not None and not stale and key not in self.accounts:
+                balance, holdings = loaded
+                self._insert(key, Account(balance, dict(holdings)))
+        return loaded
+
+    def _insert(self, key, account):
+        self.accounts[key] = account
+        self.bytes += account.size()
+        while self.bytes > self.max_bytes and self.accounts:
+            _, evicted = self.accounts.popitem(last=False)
+            self.bytes -= evicted.size()
+            self.evictions += 1
+
+    def begin_change(self, user_id):
+        """写操作修改了用户的余额或持仓、还没有提交时在写线程中调用，之后必须调用change_*或abort_change"""
+        key = cache_key(user_id)
+        with self.lock:
+            self.changing[key] = self.changing.get(key, 0) + 1
+            if key is None:
+                for pending in self.loading:
+                    self.loading[pending] = True
+            elif key in self.loading:
+                self.loading[key] = True
+
+    def abort_change(self, user_id):
+        """begin_change标记的修改被回滚"""
+        with self.lock:
+            self._finish(cache_key(user_id))
+
+    def _finish(self, key):
+        count = self.changing.get(key)
+        if count is None:
+            return
+        if count > 1:
+            self.changing[key] = count - 1
+        else:
+            del self.changing[key]
+
+    def _changed(self, user_id):
+        """返回需要更新的缓存项，没有缓存时返回None"""
+        key = cache_key(user_id)
+        self._finish(key)
+        if key is None:
+            # 无法确定对应哪个缓存项，全部丢弃
+            self.accounts.clear()
+            self.bytes = 0
+            for pending in self.loading:
+                self.loading[pending] = True
+            return None
+        if key in self.loading:
+            self.loading[key] = True
+        return self.accounts.get(key)
+
+    def change_balance(self, user_id, delta):
+        """已提交的余额变化，在写线程中调用"""
+        with self.lock:
+            account = self._changed(user_id)
+            if account is not None:
+                account.balance += delta
+
+    def change_holding(self, user_id, stock_code, delta):
+        """已提交的持仓变化，在写线程中调用"""
+        with self.lock:
+            account = self._changed(user_id)
+            if account is None:
+                return
+            quantity = account.holdings.get(stock_code, 0) + delta
+            before = account.size()
+            if quantity > 0:
+                account.holdings[stock_code] = quantity
+            else:
+                account.holdings.pop(stock_code, None)
+            self.bytes += account.size() - before
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'accounts': len(self.accounts),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'evictions': self.evictions,
+            }
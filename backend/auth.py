@@ -0,0 +1,115 @@
+"""用户认证
+
+密码用加盐的PBKDF2-HMAC-SHA256哈希保存，格式为"pbkdf2_sha256$迭代次数$盐$哈希"。
+旧版本保存的明文密码、以及迭代次数低于当前设置的哈希，在用户下次登录成功时换成新的哈希；
+明文密码还会在服务器启动后由后台线程批量换成哈希。
+
+用户不存在或保存的是明文时也计算一次同样开销的哈希，登录的响应时间不暴露用户名是否存在。
+
+登录成功后发放随机令牌，令牌对应的用户只保存在内存中，服务器重启后需要重新登录。
+之后的请求凭令牌查表确定用户，不访问数据库，也不再计算密码哈希。
+"""
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+HASH_SCHEME = 'pbkdf2_sha256'
+PASSWORD_ITERATIONS = 100000
+SALT_BYTES = 16
+TOKEN_BYTES = 32
+# 用户不存在时用来计算哈希的固定盐，结果不使用
+DUMMY_SALT = bytes(SALT_BYTES)
+
+
+def hash_password(password, iterations=PASSWORD_ITERATIONS):
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return f'{HASH_SCHEME}${iterations}${salt.hex()}${digest.hex()}'
+
+
+def is_hashed(stored):
+    return isinstance(stored, str) and stored.startswith(HASH_SCHEME + '$')
+
+
+def dummy_hash(password, iterations=PASSWORD_ITERATIONS):
+    """计算一次与校验密码开销相同的哈希，用于用户不存在的情况"""
+    if isinstance(password, str):
+        hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), DUMMY_SALT, iterations)
+
+
+def verify_password(stored, password, iterations=PASSWORD_ITERATIONS):
+    """校验密码，stored可以是哈希或旧版本的明文；明文时按iterations多计算一次哈希"""
+    if not isinstance(stored, str) or not isinstance(password, str):
+        return False
+    if not is_hashed(stored):
+        dummy_hash(password, iterations)
+        return hmac.compare_digest(stored.encode('utf-8'), password.encode('utf-8'))
+    try:
+        _, iterations, salt, digest = stored.split('$')
+        expected = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), bytes.fromhex(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(expected.hex(), digest)
+
+
+def needs_rehash(stored, iterations=PASSWORD_ITERATIONS):
+    """明文或迭代次数低于当前设置时返回True"""
+    if not is_hashed(stored):
+        return True
+    try:
+        return int(stored.split('$')[1]) < iterations
+    except (IndexError, ValueError):
+        return True
+
+
+class SessionTable:
+    """令牌 -> 用户ID，超过ttl秒没有使用的令牌失效"""
+
+    def __init__(self, ttl=3600.0):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # 令牌 -> [用户ID, 过期时间]，按最近使用排序，ttl固定时最先过期的在最前面
+        self.sessions = OrderedDict()
+
+    def create(self, user_id):
+        token = secrets.token_urlsafe(TOKEN_BYTES)
+        now = time.monotonic()
+        with self.lock:
+            self.purge(now)
+            self.sessions[token] = [user_id, now + self.ttl]
+        return token
+
+    def get(self, token):
+        """返回令牌对应的用户ID并延长有效期，令牌无效或已过期时返回None"""
+        if not isinstance(token, str):
+            return None
+        now = time.monotonic()
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            if session[1] <= now:
+                del self.sessions[token]
+                return None
+            session[1] = now + self.ttl
+            self.sessions.move_to_end(token)
+            return session[0]
+
+    def revoke(self, token):
+        with self.lock:
+            return self.sessions.pop(token, None) is not None
+
+    def purge(self, now):
+        """从最早过期的一端删除过期的令牌，调用时需持有self.lock"""
+        sessions = self.sessions
+        while sessions:
+            token, session = next(iter(sessions.items()))
+            if session[1] > now:
+                break
+            del sessions[token]
+
+    def __len__(self):
+        return len(self.sessions)
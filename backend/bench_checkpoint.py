@@ -0,0 +1,74 @@
+"""价格检查点基准测试
+
+大量股票时对比两种把内存中的价格写回数据库的方式：
+- 旧实现: 退出时每只股票单独开一个事务写回（行情每次tick还要写回全部股票）
+- 检查点: 只写回上次检查点之后价格变化过的股票，一个事务完成
+
+分别测量全部、10%、1%的股票价格发生变化时检查点的耗时，以及退出时没有变化需要写回的情况。
+
+用法: python bench_checkpoint.py [--symbols 50000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_support import close_server, make_server
+
+
+def legacy_shutdown(server):
+    """旧的shutdown：每只股票一个事务"""
+    for stock_code in server.stocks:
+        stock_info = server.stocks[stock_code]
+        with server.db.transaction() as conn:
+            conn.execute('UPDATE stocks SET price = ?, change = ? WHERE stock_code = ?',
+                         (stock_info['price'], stock_info['change'], stock_code))
+
+
+def change_prices(server, fraction, rng):
+    codes = rng.sample(list(server.stocks), int(len(server.stocks) * fraction))
+    updates = {}
+    for stock_code in codes:
+        stock_info = server.stocks[stock_code]
+        stock_info['price'] = round(stock_info['price'] * rng.uniform(0.95, 1.05), 2)
+        updates[stock_code] = {'price': stock_info['price'], 'change': stock_info['change']}
+    server.notify_market_change(updates)
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='价格检查点基准测试')
+    parser.add_argument('--symbols', type=int, default=50000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        server = make_server(workdir, args.symbols, tick_interval=1.0)
+        server.checkpoint()
+        legacy, _ = timed(lambda: legacy_shutdown(server))
+        results.append(('旧实现退出时写回', args.symbols, legacy))
+        for fraction in (1.0, 0.1, 0.01):
+            change_prices(server, fraction, rng)
+            elapsed, written = timed(server.checkpoint)
+            results.append((f'检查点（{fraction:.0%}变化）', written, elapsed))
+        elapsed, written = timed(server.checkpoint)
+        results.append(('检查点（无变化，退出时）', written, elapsed))
+        close_server(server)
+
+    print(f'股票数: {args.symbols}')
+    for name, written, elapsed in results:
+        print(f'{name:<24}写回{written:>7}只  {elapsed:>10.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
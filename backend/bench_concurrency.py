@@ -0,0 +1,153 @@
+"""并发交易压力测试
+
+多个线程同时以不同用户的身份买卖、下限价单和市价单、撤单、查询盘口，
+行情线程同时不断刷新价格。分别用不同的线程数运行，输出每秒完成的操作数，
+并核对每个用户的余额和持仓：
+
+    余额 = 初始资金 - 买入成交额 + 卖出成交额 - 未成交买单冻结的资金
+    持仓 = 买入数量 - 卖出数量 - 未成交卖单冻结的股票
+
+右边完全由交易记录和委托单表算出，任何丢失更新都会表现为偏差。
+同时核对账户缓存与数据库是否一致。
+
+用法: python bench_concurrency.py [--threads 1,2,4,8,16] [--operations 300]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_support import close_server, make_server
+
+INITIAL_BALANCE = 20000
+STOCKS = [f'BENCH{i}' for i in range(8)]
+USERS_PER_THREAD = 4
+
+
+def trader(server, user_ids, operations, seed):
+    rng = random.Random(seed)
+    open_orders = []
+    for _ in range(operations):
+        user_id = rng.choice(user_ids)
+        stock_code = rng.choice(STOCKS)
+        price = server.stocks[stock_code]['price']
+        action = rng.random()
+        if action < 0.2:
+            server.buy_stock({'user_id': user_id, 'stock_code': stock_code, 'quantity': rng.randint(1, 5)})
+        elif action < 0.35:
+            server.sell_stock({'user_id': user_id, 'stock_code': stock_code, 'quantity': rng.randint(1, 5)})
+        elif action < 0.75:
+            response = server.place_order({
+                'user_id': user_id, 'stock_code': stock_code, 'side': rng.choice(('buy', 'sell')),
+                'price': round(price * rng.uniform(0.98, 1.02), 2), 'quantity': rng.randint(1, 5)})
+            if response.get('status') == 'open':
+                open_orders.append((user_id, response['order_id']))
+        elif action < 0.85:
+            server.place_order({'user_id': user_id, 'stock_code': stock_code, 'side': rng.choice(('buy', 'sell')),
+                                'order_type': 'market', 'quantity': rng.randint(1, 5)})
+        elif action < 0.95 and open_orders:
+            user_id, order_id = open_orders.pop(rng.randrange(len(open_orders)))
+            server.cancel_order({'user_id': user_id, 'order_id': order_id})
+        else:
+            server.get_depth({'stock_code': stock_code})
+
+
+def check_ledger(server):
+    """返回(最大余额偏差, 持仓不一致的数量, 账户缓存不一致的数量)"""
+    with server.db.connection() as conn:
+        balances = dict(conn.execute('SELECT id, balance FROM users'))
+        expected = {user_id: float(INITIAL_BALANCE) for user_id in balances}
+        holdings = {(u, s): q for u, s, q in conn.execute('SELECT user_id, stock_code, quantity FROM holdings')}
+        expected_holdings = {}
+        for user_id, stock_code, side, price, quantity in conn.execute(
+                'SELECT user_id, stock_code, type, price, quantity FROM transactions'):
+            sign = 1 if side == 'buy' else -1
+            expected[user_id] -= sign * price * quantity
+            key = (user_id, stock_code)
+            expected_holdings[key] = expected_holdings.get(key, 0) + sign * quantity
+        for user_id, stock_code, side, price, remaining in conn.execute(
+                "SELECT user_id, stock_code, side, price, remaining FROM orders WHERE status = 'open'"):
+            if side == 'buy':
+                expected[user_id] -= price * remaining
+            else:
+                key = (user_id, stock_code)
+                expected_holdings[key] = expected_holdings.get(key, 0) - remaining
+    drift = max(abs(balances[user_id] - expected[user_id]) for user_id in balances)
+    expected_holdings = {key: quantity for key, quantity in expected_holdings.items() if quantity != 0}
+    holding_errors = len(set(holdings.items()) ^ set(expected_holdings.items()))
+    cache_errors = 0
+    for user_id in balances:
+        cached = server.get_user_info({'user_id': user_id})
+        stored = server.load_account(user_id)
+        if abs(cached['balance'] - stored[0]) > 1e-6 or \
+                {h['stock_code']: h['quantity'] for h in cached['holdings']} != dict(stored[1]):
+            cache_errors += 1
+    return drift, holding_errors, cache_errors
+
+
+def run(workdir, threads, operations):
+    server = make_server(os.path.join(workdir, f'threads{threads}'), tick_interval=0.01)
+    for i, stock_code in enumerate(STOCKS):
+        server.add_stock({'stock_code': stock_code, 'company_name': stock_code, 'price': 10.0 + i})
+    users = threads * USERS_PER_THREAD
+    for i in range(users):
+        server.register_user({'username': f'user{i}', 'password': 'pw'})
+        for stock_code in STOCKS:
+            server.buy_stock({'user_id': i + 1, 'stock_code': stock_code, 'quantity': 20})
+
+    # 行情线程与交易同时修改价格
+    stopped = threading.Event()
+
+    def market():
+        while not stopped.is_set():
+            server.market_tick()
+            time.sleep(server.tick_interval)
+
+    market_thread = threading.Thread(target=market)
+    market_thread.start()
+    workers = [threading.Thread(target=trader, args=(
+        server, list(range(i * USERS_PER_THREAD + 1, (i + 1) * USERS_PER_THREAD + 1)), operations, i))
+        for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    stopped.set()
+    market_thread.join()
+
+    drift, holding_errors, cache_errors = check_ledger(server)
+    stats = server.writer.stats()
+    close_server(server)
+    return {
+        'threads': threads,
+        'operations_per_sec': round(threads * operations / elapsed),
+        'avg_batch_size': round(stats['avg_batch_size'], 1),
+        'max_balance_drift': drift,
+        'holding_mismatches': holding_errors,
+        'cache_mismatches': cache_errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='并发交易压力测试')
+    parser.add_argument('--threads', default='1,2,4,8,16', help='逗号分隔的线程数')
+    parser.add_argument('--operations', type=int, default=300, help='每个线程的操作数')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for threads in (int(n) for n in args.threads.split(',')):
+            results.append(run(workdir, threads, args.operations))
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
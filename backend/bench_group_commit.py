@@ -0,0 +1,64 @@
+"""成组提交吞吐量基准测试
+
+多个线程并发买卖，对比每笔交易单独提交（--commit-batch 1）与成组提交时
+每秒完成的交易数，并输出写线程的批大小和提交耗时统计。
+用法: python bench_group_commit.py [--threads 32] [--trades 200]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_support import close_server, make_server
+
+
+def run(workdir, name, threads, trades, commit_batch, commit_delay):
+    server = make_server(os.path.join(workdir, name), commit_batch=commit_batch, commit_delay=commit_delay)
+    server.add_stock({'stock_code': 'BENCH', 'company_name': '基准公司', 'price': 10.0})
+    for i in range(threads):
+        server.register_user({'username': f'user{i}', 'password': 'pw'})
+
+    def trader(user_id):
+        for i in range(trades):
+            request = {'user_id': user_id, 'stock_code': 'BENCH', 'quantity': 1}
+            if i % 2 == 0:
+                server.buy_stock(request)
+            else:
+                server.sell_stock(request)
+
+    workers = [threading.Thread(target=trader, args=(i + 1,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    stats = server.writer.stats()
+    close_server(server)
+    return {'trades_per_sec': round(threads * trades / elapsed), **stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='成组提交吞吐量基准测试')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--trades', type=int, default=200, help='每个线程的交易笔数')
+    parser.add_argument('--commit-batch', type=int, default=256)
+    parser.add_argument('--commit-delay', type=float, default=0.0, help='毫秒')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = {
+            'single_commit': run(workdir, 'single', args.threads, args.trades, 1, 0.0),
+            'group_commit': run(workdir, 'group', args.threads, args.trades,
+                                args.commit_batch, args.commit_delay / 1000),
+        }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
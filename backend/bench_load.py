@@ -0,0 +1,268 @@
+"""服务器负载测试
+
+在临时目录中用一个新的数据库启动server.py子进程，模拟N个并发客户端，
+每个客户端保持一条分帧连接，按配置的比例循环发送register、login、get_stocks、
+get_user_info、buy、sell请求，结束后以JSON输出总吞吐量和每种请求的
+吞吐量、p50/p95/p99延迟，便于对比不同版本。
+
+买卖和查询持仓使用登录时发放的令牌。register和login要计算加盐的密码哈希，
+每次耗时几十毫秒，它们的比例对总吞吐量影响很大。
+
+客户端分布在多个进程中，每个进程用asyncio驱动自己的连接，避免压测端成为瓶颈。
+也可以用--connect压测已经在运行的服务器（需要默认的管理员密码以添加测试股票）。
+
+用法: python bench_load.py [--clients 32] [--duration 10]
+      [--mix get_stocks=30,get_user_info=25,buy=15,sell=15,login=10,register=5]
+      [--mode thread|asyncio] [--readers N] [--output result.json]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import protocol
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+ADMIN_PASSWORD = 'admin123'
+ACTIONS = ('register', 'login', 'get_stocks', 'get_user_info', 'buy', 'sell')
+DEFAULT_MIX = 'get_stocks=30,get_user_info=25,buy=15,sell=15,login=10,register=5'
+STOCK_PRICE = 10.0
+INITIAL_SHARES = 100
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        action, _, weight = item.partition('=')
+        action = action.strip()
+        if action not in ACTIONS:
+            raise ValueError(f'未知的请求类型: {action}')
+        mix[action] = float(weight or 1)
+    return mix
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir, port, args):
+    # 服务器会在上级目录生成前端文件，放在临时目录的backend子目录中运行
+    backend_dir = os.path.join(workdir, 'backend')
+    os.makedirs(backend_dir)
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    process = subprocess.Popen(
+        [sys.executable, SERVER, '--host', '127.0.0.1', '--port', str(port), '--db', 'bench.db',
+         '--mode', args.mode, '--workers', str(args.workers), '--tick-interval', str(args.tick_interval),
+         '--readers', str(args.readers)],
+        cwd=backend_dir, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    log.close()
+    with open(os.path.join(workdir, 'server.log'), 'rb') as f:
+        sys.stderr.write(f.read().decode('utf-8', 'replace')[-2000:])
+    raise RuntimeError('服务器启动失败')
+
+
+class Client:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, message):
+        self.writer.write(protocol.encode_message(message))
+        await self.writer.drain()
+        flags, length = protocol.parse_header(await self.reader.readexactly(protocol.HEADER_SIZE))
+        return json.loads(await self.reader.readexactly(length))
+
+    def close(self):
+        self.writer.close()
+
+
+async def run_client(host, port, name, stocks, mix, start_at, stop_at, rng):
+    client = await Client.connect(host, port)
+    username = f'load_{name}'
+    await client.request({'action': 'register', 'username': username, 'password': 'pw'})
+    token = (await client.request({'action': 'login', 'username': username, 'password': 'pw'}))['token']
+    # 每只股票先买入一些，保证卖出请求有持仓可卖
+    for stock_code in stocks:
+        await client.request({'action': 'buy', 'token': token, 'stock_code': stock_code,
+                              'quantity': INITIAL_SHARES // len(stocks) or 1})
+
+    actions = list(mix)
+    weights = [mix[action] for action in actions]
+    samples = {action: [] for action in actions}
+    errors = {action: 0 for action in actions}
+    registered = 0
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    while time.time() < stop_at:
+        action = rng.choices(actions, weights)[0]
+        if action == 'register':
+            registered += 1
+            request = {'action': 'register', 'username': f'{username}_{registered}', 'password': 'pw'}
+        elif action == 'login':
+            request = {'action': 'login', 'username': username, 'password': 'pw'}
+        elif action == 'get_stocks':
+            request = {'action': 'get_stocks'}
+        elif action == 'get_user_info':
+            request = {'action': 'get_user_info', 'token': token}
+        else:
+            request = {'action': action, 'token': token, 'stock_code': rng.choice(stocks), 'quantity': 1}
+        started = time.perf_counter()
+        try:
+            response = await client.request(request)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            errors[action] += 1
+            client.close()
+            client = await Client.connect(host, port)
+            continue
+        samples[action].append((time.perf_counter() - started) * 1000)
+        # 卖出时持仓不足属于正常的业务结果，不计为错误
+        if 'error' in response or (not response.get('success', True) and action != 'sell'):
+            errors[action] += 1
+        elif action == 'login':
+            token = response['token']
+    client.close()
+    return samples, errors
+
+
+async def run_clients(host, port, names, stocks, mix, start_at, stop_at, seed):
+    rng = random.Random(seed)
+    results = await asyncio.gather(*(
+        run_client(host, port, name, stocks, mix, start_at, stop_at, random.Random(rng.random()))
+        for name in names))
+    samples = {action: [] for action in mix}
+    errors = {action: 0 for action in mix}
+    for client_samples, client_errors in results:
+        for action in mix:
+            samples[action].extend(client_samples[action])
+            errors[action] += client_errors[action]
+    return samples, errors
+
+
+def client_process(host, port, names, stocks, mix, start_at, stop_at, seed):
+    return asyncio.run(run_clients(host, port, names, stocks, mix, start_at, stop_at, seed))
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def summarize(samples, errors, duration):
+    actions = {}
+    total = 0
+    for action, values in samples.items():
+        values.sort()
+        total += len(values)
+        actions[action] = {
+            'requests': len(values),
+            'errors': errors[action],
+            'throughput': round(len(values) / duration, 1),
+            'mean_ms': round(statistics.fmean(values), 3) if values else None,
+            'p50_ms': round(percentile(values, 0.50), 3) if values else None,
+            'p95_ms': round(percentile(values, 0.95), 3) if values else None,
+            'p99_ms': round(percentile(values, 0.99), 3) if values else None,
+            'max_ms': round(values[-1], 3) if values else None,
+        }
+    return {'requests': total, 'throughput': round(total / duration, 1)}, actions
+
+
+def run(args, host, port):
+    mix = parse_mix(args.mix)
+    stocks = [f'LOAD{i:03d}' for i in range(args.stocks)]
+
+    async def setup():
+        client = await Client.connect(host, port)
+        for stock_code in stocks:
+            await client.request({'action': 'add_stock', 'admin_password': ADMIN_PASSWORD,
+                                  'stock_code': stock_code, 'company_name': stock_code, 'price': STOCK_PRICE})
+        client.close()
+
+    asyncio.run(setup())
+    processes = max(1, min(args.processes, args.clients))
+    tag = f'{os.getpid()}_{int(time.time())}'
+    names = [f'{tag}_{i}' for i in range(args.clients)]
+    # 所有进程的客户端完成注册和建仓后同时开始计时
+    start_at = time.time() + 2 + args.clients * 0.01
+    stop_at = start_at + args.duration
+    with multiprocessing.Pool(processes) as pool:
+        parts = pool.starmap(client_process, [
+            (host, port, names[i::processes], stocks, mix, start_at, stop_at, args.seed + i)
+            for i in range(processes)])
+    samples = {action: [] for action in mix}
+    errors = {action: 0 for action in mix}
+    for part_samples, part_errors in parts:
+        for action in mix:
+            samples[action].extend(part_samples[action])
+            errors[action] += part_errors[action]
+    total, actions = summarize(samples, errors, args.duration)
+    return {
+        'config': {'clients': args.clients, 'processes': processes, 'duration': args.duration,
+                   'mode': args.mode, 'workers': args.workers, 'readers': args.readers, 'stocks': args.stocks, 'mix': mix},
+        'total': total,
+        'actions': actions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='服务器负载测试')
+    parser.add_argument('--clients', type=int, default=32, help='并发客户端数')
+    parser.add_argument('--duration', type=float, default=10, help='计时的时长（秒）')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='各请求的比例，如get_stocks=30,buy=10')
+    parser.add_argument('--stocks', type=int, default=20, help='测试用的股票数')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='客户端进程数')
+    parser.add_argument('--mode', choices=['thread', 'asyncio'], default='thread', help='服务器的运行模式')
+    parser.add_argument('--workers', type=int, default=32, help='服务器的线程池大小')
+    parser.add_argument('--readers', type=int, default=0, help='服务器的行情读取进程数')
+    parser.add_argument('--tick-interval', type=float, default=1.0, help='服务器的行情更新间隔（秒）')
+    parser.add_argument('--connect', help='压测已在运行的服务器，格式为host:port，不启动子进程')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='结果同时写入该文件')
+    args = parser.parse_args()
+
+    if args.connect:
+        host, _, port = args.connect.rpartition(':')
+        result = run(args, host, int(port))
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            port = free_port()
+            process = start_server(workdir, port, args)
+            try:
+                result = run(args, '127.0.0.1', port)
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""行情模拟单次tick耗时基准测试
+
+对比旧实现（逐只股票随机波动并单独提交）与MarketSimulator批量生成价格、
+由检查点一条executemany写回的耗时。用法: python bench_market_sim.py [--symbols 10000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_support import close_server, make_server
+
+
+def legacy_tick(server):
+    for stock_code in server.stocks:
+        change = random.uniform(-0.05, 0.05)
+        new_price = round(server.stocks[stock_code]['price'] * (1 + change), 2)
+        server.stocks[stock_code]['price'] = new_price
+        server.stocks[stock_code]['change'] = round(change * 100, 2)
+        with server.db.transaction() as conn:
+            conn.execute('UPDATE stocks SET price = ?, change = ? WHERE stock_code = ?',
+                         (new_price, server.stocks[stock_code]['change'], stock_code))
+
+
+def timed(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='行情模拟tick耗时基准测试')
+    parser.add_argument('--symbols', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        server = make_server(workdir, args.symbols, tick_interval=1.0)
+        legacy = timed(lambda: legacy_tick(server), 1)
+        # 每次tick的股票都全部变化，检查点写回全部股票
+        vectorized = timed(lambda: (server.market_tick(), server.checkpoint()), args.repeat)
+        close_server(server)
+
+    print(f'股票数: {args.symbols}')
+    print(f'旧实现: {legacy:.1f} ms/tick')
+    print(f'批量实现: {vectorized:.1f} ms/tick')
+
+
+if __name__ == '__main__':
+    main()
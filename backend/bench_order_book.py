@@ -0,0 +1,64 @@
+"""撮合引擎吞吐量基准测试
+
+在单个订单簿上回放随机订单流（限价单、市价单和撤单混合），
+统计每秒处理的订单数。用法: python bench_order_book.py [--orders 500000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from order_book import BUY, SELL, Order, OrderBook
+
+
+def generate_flow(count, seed):
+    rng = random.Random(seed)
+    flow = []
+    live = []
+    for order_id in range(1, count + 1):
+        roll = rng.random()
+        if roll < 0.15 and live:
+            # 撤销一笔较早的订单
+            flow.append(('cancel', live.pop(rng.randrange(len(live)))))
+            continue
+        side = BUY if rng.random() < 0.5 else SELL
+        if roll < 0.25:
+            price = None
+        else:
+            # 买单价格略低于中间价，卖单略高，保证订单簿有一定深度
+            offset = rng.randint(-20, 40) / 100
+            price = round(100 - offset if side == BUY else 100 + offset, 2)
+            live.append(order_id)
+        flow.append(('submit', Order(order_id, order_id % 1000, side, price, rng.randint(1, 10) * 100)))
+    return flow
+
+
+def main():
+    parser = argparse.ArgumentParser(description='撮合引擎吞吐量基准测试')
+    parser.add_argument('--orders', type=int, default=500000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    flow = generate_flow(args.orders, args.seed)
+    book = OrderBook('BENCH')
+    fills = 0
+    start = time.perf_counter()
+    for kind, item in flow:
+        if kind == 'submit':
+            fills += len(book.submit(item))
+        else:
+            book.cancel(item)
+    elapsed = time.perf_counter() - start
+
+    print(f'订单数: {len(flow)}')
+    print(f'成交笔数: {fills}')
+    print(f'挂单数: {len(book.orders)}')
+    print(f'耗时: {elapsed:.3f}s')
+    print(f'吞吐量: {len(flow) / elapsed:,.0f} 订单/秒')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""数据库索引与UPSERT基准测试
+
+生成一个有大量用户、持仓和交易记录的数据库，对比两种结构下各操作的单次延迟：
+- before: 只有初始表结构（迁移1），买卖时先查询持仓再决定UPDATE或INSERT
+- after:  执行全部迁移，持仓有唯一索引，买卖用单条UPSERT，交易记录按用户、股票建索引
+
+同时报告在这个数据量上执行迁移的耗时。
+
+用法: python bench_schema.py [--users 100000] [--transactions 1000000] [--iterations 200]
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import migrations
+from bench_support import close_server, make_server
+from storage import ConnectionPool
+
+STOCKS = [f'BENCH{i:03d}' for i in range(50)]
+HOLDINGS_PER_USER = 3
+
+
+def populate(path, users, transactions, seed=1):
+    rng = random.Random(seed)
+    pool = ConnectionPool(path, size=1)
+    migrations.migrate(pool, target=1)
+    with pool.transaction() as conn:
+        conn.executemany('INSERT INTO stocks (stock_code, company_name, price, change) VALUES (?, ?, ?, 0)',
+                         [(code, code, 10.0 + i) for i, code in enumerate(STOCKS)])
+        conn.executemany('INSERT INTO users (username, password, balance) VALUES (?, ?, ?)',
+                         ((f'user{i}', 'pw', 1e9) for i in range(users)))
+        conn.executemany('INSERT INTO holdings (user_id, stock_code, quantity) VALUES (?, ?, ?)',
+                         ((user_id, code, 1000) for user_id in range(1, users + 1)
+                          for code in rng.sample(STOCKS, HOLDINGS_PER_USER)))
+        conn.executemany('INSERT INTO transactions (user_id, stock_code, type, price, quantity, timestamp) '
+                         'VALUES (?, ?, ?, ?, ?, ?)',
+                         ((rng.randint(1, users), rng.choice(STOCKS), rng.choice(('buy', 'sell')),
+                           10.0, rng.randint(1, 100), '2024-01-01 09:30:00') for _ in range(transactions)))
+    pool.close()
+
+
+def legacy_buy(c, user_id, stock_code, quantity, stock_price):
+    """迁移前的买入：先查持仓，再UPDATE或INSERT"""
+    c.execute('SELECT balance FROM users WHERE id = ?', (user_id,))
+    balance = c.fetchone()[0]
+    c.execute('UPDATE users SET balance = ? WHERE id = ?', (balance - stock_price * quantity, user_id))
+    c.execute('SELECT quantity FROM holdings WHERE user_id = ? AND stock_code = ?', (user_id, stock_code))
+    existing = c.fetchone()
+    if existing:
+        c.execute('UPDATE holdings SET quantity = ? WHERE user_id = ? AND stock_code = ?',
+                  (existing[0] + quantity, user_id, stock_code))
+    else:
+        c.execute('INSERT INTO holdings (user_id, stock_code, quantity) VALUES (?, ?, ?)',
+                  (user_id, stock_code, quantity))
+    c.execute('INSERT INTO transactions (user_id, stock_code, type, price, quantity, timestamp) VALUES (?, ?, ?, ?, ?, ?)',
+              (user_id, stock_code, 'buy', stock_price, quantity, time.strftime('%Y-%m-%d %H:%M:%S')))
+
+
+def legacy_sell(c, user_id, stock_code, quantity, stock_price):
+    """迁移前的卖出：先查持仓，再UPDATE或DELETE"""
+    c.execute('SELECT quantity FROM holdings WHERE user_id = ? AND stock_code = ?', (user_id, stock_code))
+    existing = c.fetchone()
+    if not existing or existing[0] < quantity:
+        return
+    c.execute('SELECT balance FROM users WHERE id = ?', (user_id,))
+    balance = c.fetchone()[0]
+    c.execute('UPDATE users SET balance = ? WHERE id = ?', (balance + stock_price * quantity, user_id))
+    if existing[0] > quantity:
+        c.execute('UPDATE holdings SET quantity = ? WHERE user_id = ? AND stock_code = ?',
+                  (existing[0] - quantity, user_id, stock_code))
+    else:
+        c.execute('DELETE FROM holdings WHERE user_id = ? AND stock_code = ?', (user_id, stock_code))
+    c.execute('INSERT INTO transactions (user_id, stock_code, type, price, quantity, timestamp) VALUES (?, ?, ?, ?, ?, ?)',
+              (user_id, stock_code, 'sell', stock_price, quantity, time.strftime('%Y-%m-%d %H:%M:%S')))
+
+
+def delete_checks(c, stock_code):
+    c.execute('SELECT COUNT(*) FROM holdings WHERE stock_code = ?', (stock_code,))
+    c.fetchone()
+    c.execute("SELECT COUNT(*) FROM orders WHERE stock_code = ? AND status = 'open'", (stock_code,))
+    c.fetchone()
+
+
+def user_holdings(c, user_id):
+    c.execute('SELECT stock_code, quantity FROM holdings WHERE user_id = ?', (user_id,))
+    c.fetchall()
+
+
+def user_transactions(c, user_id, stock_code):
+    """get_transactions的第一页：某用户某只股票最新的100条记录"""
+    c.execute('SELECT id, user_id, stock_code, type, price, quantity, timestamp FROM transactions '
+              'WHERE user_id = ? AND stock_code = ? ORDER BY id DESC LIMIT 101', (user_id, stock_code))
+    c.fetchall()
+
+
+def measure(pool, func, iterations):
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        with pool.transaction() as conn:
+            func(conn.cursor(), i)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return {'mean': statistics.fmean(samples), 'p99': samples[int(len(samples) * 0.99)]}
+
+
+def run_actions(pool, buy, sell, users, iterations):
+    rng = random.Random(2)
+    user_ids = [rng.randint(1, users) for _ in range(iterations)]
+    codes = [rng.choice(STOCKS) for _ in range(iterations)]
+    return {
+        'buy': measure(pool, lambda c, i: buy(c, user_ids[i], codes[i], 10, 10.0), iterations),
+        'sell': measure(pool, lambda c, i: sell(c, user_ids[i], codes[i], 5, 10.0), iterations),
+        'get_user_info': measure(pool, lambda c, i: user_holdings(c, user_ids[i]), iterations),
+        'delete_stock': measure(pool, lambda c, i: delete_checks(c, codes[i]), iterations),
+        'get_transactions': measure(pool, lambda c, i: user_transactions(c, user_ids[i], codes[i]), iterations),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='数据库索引与UPSERT基准测试')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--transactions', type=int, default=1000000)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        before_db = os.path.join(workdir, 'before.db')
+        after_db = os.path.join(workdir, 'after.db')
+        start = time.perf_counter()
+        populate(before_db, args.users, args.transactions)
+        print(f'生成数据: {args.users}个用户, {args.users * HOLDINGS_PER_USER}条持仓, '
+              f'{args.transactions}条交易记录, 耗时{time.perf_counter() - start:.1f}s')
+        shutil.copy(before_db, after_db)
+
+        pool = ConnectionPool(before_db, size=1)
+        before = run_actions(pool, legacy_buy, legacy_sell, args.users, args.iterations)
+        pool.close()
+
+        pool = ConnectionPool(after_db, size=1)
+        start = time.perf_counter()
+        migrations.migrate(pool)
+        print(f'迁移到版本{len(migrations.MIGRATIONS)}耗时{time.perf_counter() - start:.1f}s')
+        # 在基准线程中直接调用execute_buy/execute_sell，不在写线程中时提交后回调立即执行
+        server = make_server(os.path.join(workdir, 'server'), db_path=after_db)
+        after = run_actions(pool, server.execute_buy, server.execute_sell, args.users, args.iterations)
+        pool.close()
+        close_server(server)
+
+    print(f"{'操作':<18}{'before均值(us)':>16}{'after均值(us)':>16}{'before p99':>12}{'after p99':>12}{'加速比':>8}")
+    for action in before:
+        b, a = before[action], after[action]
+        print(f"{action:<18}{b['mean']:>16.1f}{a['mean']:>16.1f}{b['p99']:>12.1f}{a['p99']:>12.1f}"
+              f"{b['mean'] / a['mean']:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
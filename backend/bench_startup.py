@@ -0,0 +1,121 @@
+"""服务器启动时间基准测试
+
+生成一个有大量股票的数据库，分别以默认方式和--lazy-load方式多次启动server.py，
+测量从启动进程到端口可以连接、到get_stocks返回全部股票各需要多久。
+默认方式在绑定端口之前加载全部股票；--lazy-load先绑定端口，股票在后台分批加载，
+加载期间不需要股票数据的请求（注册、登录等）可以立即处理。
+
+第一次启动会生成前端文件，之后的启动内容没有变化，不再重写。
+
+用法: python bench_startup.py [--stocks 200000] [--runs 3]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import migrations
+from storage import ConnectionPool
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+FRAME_HEADER = struct.Struct('>BI')
+
+
+def populate(path, stocks):
+    pool = ConnectionPool(path, size=1)
+    migrations.migrate(pool)
+    with pool.transaction() as conn:
+        conn.executemany('INSERT INTO stocks (stock_code, company_name, price, change) VALUES (?, ?, ?, 0)',
+                         ((f'S{i:07d}', f'公司{i}', 10.0 + i % 100) for i in range(stocks)))
+    pool.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError('连接已关闭')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def request(sock, message):
+    payload = json.dumps(message).encode('utf-8')
+    sock.sendall(FRAME_HEADER.pack(0, len(payload)) + payload)
+    _, length = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))
+    return json.loads(recv_exactly(sock, length))
+
+
+def boot(backend_dir, lazy):
+    """启动一次服务器，返回(端口可连接的耗时, get_stocks返回的耗时, 返回的股票数)"""
+    port = free_port()
+    command = [sys.executable, SERVER, '--host', '127.0.0.1', '--port', str(port), '--db', 'bench.db']
+    if lazy:
+        command.append('--lazy-load')
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=backend_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError('服务器启动失败')
+            try:
+                sock = socket.create_connection(('127.0.0.1', port), timeout=60)
+                break
+            except OSError:
+                time.sleep(0.005)
+        bound = time.perf_counter() - started
+        with sock:
+            stocks = request(sock, {'action': 'get_stocks'})['stocks']
+        ready = time.perf_counter() - started
+    finally:
+        # 只测量启动，不等待正常退出时写回行情
+        process.kill()
+        process.wait()
+    return bound, ready, len(stocks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='服务器启动时间基准测试')
+    parser.add_argument('--stocks', type=int, default=200000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # 服务器会在上级目录生成前端文件，放在临时目录的backend子目录中运行
+        backend_dir = os.path.join(workdir, 'backend')
+        os.makedirs(backend_dir)
+        start = time.perf_counter()
+        populate(os.path.join(backend_dir, 'bench.db'), args.stocks)
+        print(f'生成数据: {args.stocks}只股票, 耗时{time.perf_counter() - start:.1f}s')
+
+        results = {}
+        for lazy in (False, True):
+            samples = [boot(backend_dir, lazy) for _ in range(args.runs)]
+            assert all(n == args.stocks for _, _, n in samples)
+            results['lazy' if lazy else 'eager'] = samples
+
+    print(f"{'模式':<10}{'端口可连接(s)':>16}{'全部行情可用(s)':>18}")
+    for mode, samples in results.items():
+        bound = statistics.median(b for b, _, _ in samples)
+        ready = statistics.median(r for _, r, _ in samples)
+        print(f'{mode:<10}{bound:>16.3f}{ready:>18.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""数据库访问延迟基准测试
+
+对比两种数据库访问方式下各个操作的单次延迟：
+- before: 连接池引入之前的处理方法，每次操作sqlite3.connect打开数据库（默认回滚日志），
+          执行与旧实现相同的SQL并自己提交
+- after:  服务器当前的处理方法，ConnectionPool长连接 + WAL + 语句缓存，写操作由写线程成组提交
+
+用法: python bench_storage.py [--iterations 2000]
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bench_support
+import migrations
+
+
+class LegacyActions:
+    """旧实现的各操作：每次操作用sqlite3.connect打开数据库（默认回滚日志），自己提交后关闭"""
+
+    def __init__(self, path):
+        self.path = path
+        self.stocks = {}
+        conn = sqlite3.connect(path)
+        migrations.create_baseline(conn.cursor())
+        conn.commit()
+        conn.close()
+
+    def add_stock(self, request):
+        conn = sqlite3.connect(self.path)
+        conn.execute('INSERT INTO stocks (stock_code, company_name, price, change) VALUES (?, ?, ?, ?)',
+                     (request['stock_code'], request['company_name'], request['price'], 0))
+        conn.commit()
+        conn.close()
+        self.stocks[request['stock_code']] = {'company_name': request['company_name'],
+                                              'price': request['price'], 'change': 0}
+
+    def register_user(self, request):
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.execute('INSERT INTO users (username, password) VALUES (?, ?)',
+                         (request['username'], request['password']))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def login_user(self, request):
+        conn = sqlite3.connect(self.path)
+        conn.execute('SELECT id, balance FROM users WHERE username = ? AND password = ?',
+                     (request['username'], request['password'])).fetchone()
+        conn.close()
+
+    def get_user_info(self, request):
+        conn = sqlite3.connect(self.path)
+        c = conn.cursor()
+        c.execute('SELECT balance FROM users WHERE id = ?', (request['user_id'],))
+        c.fetchone()
+        c.execute('SELECT stock_code, quantity FROM holdings WHERE user_id = ?', (request['user_id'],))
+        holdings = [{'stock_code': stock_code, 'quantity': quantity,
+                     'value': quantity * self.stocks[stock_code]['price']}
+                    for stock_code, quantity in c.fetchall()]
+        conn.close()
+        return holdings
+
+    def buy_stock(self, request):
+        user_id, stock_code, quantity = request['user_id'], request['stock_code'], request['quantity']
+        stock_price = self.stocks[stock_code]['price']
+        conn = sqlite3.connect(self.path)
+        c = conn.cursor()
+        c.execute('SELECT balance FROM users WHERE id = ?', (user_id,))
+        balance = c.fetchone()[0]
+        if balance < stock_price * quantity:
+            conn.close()
+            return
+        c.execute('UPDATE users SET balance = ? WHERE id = ?', (balance - stock_price * quantity, user_id))
+        c.execute('SELECT quantity FROM holdings WHERE user_id = ? AND stock_code = ?', (user_id, stock_code))
+        existing = c.fetchone()
+        if existing:
+            c.execute('UPDATE holdings SET quantity = ? WHERE user_id = ? AND stock_code = ?',
+                      (existing[0] + quantity, user_id, stock_code))
+        else:
+            c.execute('INSERT INTO holdings (user_id, stock_code, quantity) VALUES (?, ?, ?)',
+                      (user_id, stock_code, quantity))
+        c.execute('INSERT INTO transactions (user_id, stock_code, type, price, quantity, timestamp) '
+                  'VALUES (?, ?, ?, ?, ?, ?)',
+                  (user_id, stock_code, 'buy', stock_price, quantity, time.strftime('%Y-%m-%d %H:%M:%S')))
+        conn.commit()
+        conn.close()
+
+    def sell_stock(self, request):
+        user_id, stock_code, quantity = request['user_id'], request['stock_code'], request['quantity']
+        stock_price = self.stocks[stock_code]['price']
+        conn = sqlite3.connect(self.path)
+        c = conn.cursor()
+        c.execute('SELECT quantity FROM holdings WHERE user_id = ? AND stock_code = ?', (user_id, stock_code))
+        existing = c.fetchone()
+        if not existing or existing[0] < quantity:
+            conn.close()
+            return
+        c.execute('SELECT balance FROM users WHERE id = ?', (user_id,))
+        balance = c.fetchone()[0]
+        c.execute('UPDATE users SET balance = ? WHERE id = ?', (balance + stock_price * quantity, user_id))
+        if existing[0] > quantity:
+            c.execute('UPDATE holdings SET quantity = ? WHERE user_id = ? AND stock_code = ?',
+                      (existing[0] - quantity, user_id, stock_code))
+        else:
+            c.execute('DELETE FROM holdings WHERE user_id = ? AND stock_code = ?', (user_id, stock_code))
+        c.execute('INSERT INTO transactions (user_id, stock_code, type, price, quantity, timestamp) '
+                  'VALUES (?, ?, ?, ?, ?, ?)',
+                  (user_id, stock_code, 'sell', stock_price, quantity, time.strftime('%Y-%m-%d %H:%M:%S')))
+        conn.commit()
+        conn.close()
+
+    def get_users(self, request=None):
+        conn = sqlite3.connect(self.path)
+        users = [{'id': row[0], 'username': row[1], 'balance': row[2]}
+                 for row in conn.execute('SELECT id, username, balance FROM users')]
+        conn.close()
+        return users
+
+
+def add_stocks(target):
+    for i in range(50):
+        target.add_stock({'stock_code': f'BENCH{i:03d}', 'company_name': f'基准公司{i}', 'price': 10.0 + i})
+
+
+def measure(func, iterations):
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return {
+        'mean': statistics.fmean(samples),
+        'p50': samples[len(samples) // 2],
+        'p99': samples[int(len(samples) * 0.99)],
+    }
+
+
+def run_actions(server, iterations, tag):
+    results = {}
+    results['register'] = measure(
+        lambda i: server.register_user({'username': f'{tag}_user{i}', 'password': 'pw'}), iterations)
+    results['login'] = measure(
+        lambda i: server.login_user({'username': f'{tag}_user{i}', 'password': 'pw'}), iterations)
+    results['get_user_info'] = measure(
+        lambda i: server.get_user_info({'user_id': i % iterations + 1}), iterations)
+    results['buy'] = measure(
+        lambda i: server.buy_stock({'user_id': i % iterations + 1, 'stock_code': f'BENCH{i % 50:03d}',
+                                    'quantity': 1}), iterations)
+    results['sell'] = measure(
+        lambda i: server.sell_stock({'user_id': i % iterations + 1, 'stock_code': f'BENCH{i % 50:03d}',
+                                     'quantity': 1}), iterations)
+    results['get_users'] = measure(lambda i: server.get_users(), max(iterations // 20, 10))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='数据库访问延迟基准测试')
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        legacy = LegacyActions(os.path.join(workdir, 'before.db'))
+        add_stocks(legacy)
+        before = run_actions(legacy, args.iterations, 'before')
+        server = bench_support.make_server(os.path.join(workdir, 'after'))
+        add_stocks(server)
+        after = run_actions(server, args.iterations, 'after')
+        bench_support.close_server(server)
+
+    print(f"{'操作':<14}{'before均值(us)':>16}{'after均值(us)':>16}{'before p99':>12}{'after p99':>12}{'加速比':>8}")
+    for action in before:
+        b, a = before[action], after[action]
+        print(f"{action:<14}{b['mean']:>16.1f}{a['mean']:>16.1f}{b['p99']:>12.1f}{a['p99']:>12.1f}"
+              f"{b['mean'] / a['mean']:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""基准测试共用的服务器构造
+
+基准测试在进程内直接调用服务器的处理方法，不监听端口，也不生成前端文件。
+数据库、逐笔行情和性能分析文件都放在给定的临时目录中。
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from server import StockTradingServer
+
+# 基准测试不测量密码哈希，注册和登录用较少的迭代次数，避免哈希计算掩盖其他开销
+BENCH_PASSWORD_ITERATIONS = 1000
+
+
+class BenchServer(StockTradingServer):
+    """只在进程内调用处理方法的服务器，不改写仓库中的前端文件"""
+
+    def generate_html_files(self):
+        pass
+
+
+def make_server(workdir, symbols=0, **options):
+    """在workdir中创建服务器并加载股票，symbols大于0时先写入symbols只股票（S000000起）"""
+    os.makedirs(workdir, exist_ok=True)
+    options.setdefault('db_path', os.path.join(workdir, 'bench.db'))
+    options.setdefault('tick_dir', os.path.join(workdir, 'ticks'))
+    options.setdefault('profile_dir', os.path.join(workdir, 'profiles'))
+    server = BenchServer(lazy_load=True, **options)
+    server.password_iterations = BENCH_PASSWORD_ITERATIONS
+    if symbols:
+        with server.db.transaction() as conn:
+            conn.executemany('INSERT INTO stocks (stock_code, company_name, price, change) VALUES (?, ?, ?, 0)',
+                             [(f'S{i:06d}', f'公司{i}', 10.0 + i % 100) for i in range(symbols)])
+    server.load_universe()
+    return server
+
+
+def close_server(server):
+    """停止写线程，关闭数据库、逐笔行情存储和未使用的监听套接字"""
+    server.writer.stop()
+    server.db.close()
+    server.ticks.close()
+    server.server_socket.close()
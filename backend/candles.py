@@ -0,0 +1,119 @@
+"""K线聚合
+
+每次行情更新和成交都增量地合并进各个周期的当前K线，每个周期只比较一次起始时间，
+开销与历史长度无关。K线按列存放在array中，查询时用二分查找定位时间范围，
+不需要扫描原始行情。
+
+只有出现过行情或成交的时间段才有K线，没有更新的时间段不补齐。
+每个周期保留的K线数量有上限，超出后成块删除最早的部分。
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+# 周期名称 -> 秒数
+RESOLUTIONS = {'1s': 1, '1m': 60, '5m': 300, '1h': 3600, '1d': 86400}
+# 每个周期最多保留的K线数量
+DEFAULT_MAX_BARS = {'1s': 3600, '1m': 1440, '5m': 2016, '1h': 2160, '1d': 3650}
+
+
+class CandleSeries:
+    """一只股票在一个周期上的K线，按列存储"""
+    __slots__ = ('seconds', 'max_bars', 'utc_offset', 'starts', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, seconds, max_bars, utc_offset=0):
+        self.seconds = seconds
+        self.max_bars = max_bars
+        self.utc_offset = utc_offset  # 日线按本地时间的零点切分
+        self.starts = array('q')
+        self.open = array('d')
+        self.high = array('d')
+        self.low = array('d')
+        self.close = array('d')
+        self.volume = array('q')
+
+    def bar_start(self, timestamp):
+        return int((timestamp + self.utc_offset) // self.seconds) * self.seconds - self.utc_offset
+
+    def update(self, timestamp, price, volume=0):
+        start = self.bar_start(timestamp)
+        starts = self.starts
+        # 时间回退（例如系统时钟调整）时合并进最新的K线，保持起始时间有序
+        if starts and start <= starts[-1]:
+            if price > self.high[-1]:
+                self.high[-1] = price
+            if price < self.low[-1]:
+                self.low[-1] = price
+            self.close[-1] = price
+            self.volume[-1] += volume
+            return
+        starts.append(start)
+        self.open.append(price)
+        self.high.append(price)
+        self.low.append(price)
+        self.close.append(price)
+        self.volume.append(volume)
+        # 超出上限1/4后一次删除，删除的开销均摊到每根新K线上
+        excess = len(starts) - self.max_bars
+        if excess > self.max_bars // 4:
+            for column in (starts, self.open, self.high, self.low, self.close, self.volume):
+                del column[:excess]
+
+    def bars(self, start=None, end=None, limit=None):
+        """返回起始时间在[start, end]内的K线，超过limit时保留最新的limit根"""
+        starts = self.starts
+        lo = 0 if start is None else bisect_left(starts, self.bar_start(start))
+        hi = len(starts) if end is None else bisect_right(starts, end)
+        if limit is not None and hi - lo > limit:
+            lo = hi - limit
+        return [[starts[i], self.open[i], self.high[i], self.low[i], self.close[i], self.volume[i]]
+                for i in range(lo, hi)]
+
+
+class CandleStore:
+    """所有股票、所有周期的K线"""
+
+    def __init__(self, max_bars=None):
+        self.max_bars = dict(DEFAULT_MAX_BARS, **(max_bars or {}))
+        self.utc_offset = time.localtime().tm_gmtoff
+        self.lock = threading.Lock()
+        self.series = {}  # 股票代码 -> {周期名称: CandleSeries}
+
+    def _series_for(self, stock_code):
+        series = self.series.get(stock_code)
+        if series is None:
+            series = {name: CandleSeries(seconds, self.max_bars[name], self.utc_offset)
+                      for name, seconds in RESOLUTIONS.items()}
+            self.series[stock_code] = series
+        return series
+
+    def record(self, changes, timestamp=None):
+        """合并一批行情变化，changes与notify_market_change的参数相同"""
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            for stock_code, stock_info in changes.items():
+                if stock_info is None:
+                    self.series.pop(stock_code, None)
+                elif 'price' in stock_info:
+                    for series in self._series_for(stock_code).values():
+                        series.update(timestamp, stock_info['price'])
+
+    def record_trades(self, stock_code, trades, timestamp=None):
+        """合并成交，trades为[(成交价, 成交数量)]"""
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            all_series = self._series_for(stock_code).values()
+            for price, quantity in trades:
+                for series in all_series:
+                    series.update(timestamp, price, quantity)
+
+    def bars(self, stock_code, resolution, start=None, end=None, limit=None):
+        """返回[[起始时间, 开, 高, 低, 收, 成交量]]，没有该股票的K线时返回None"""
+        with self.lock:
+            series = self.series.get(stock_code)
+            if series is None:
+                return None
+            return series[resolution].bars(start, end, limit)
@@ -1,16 +1,32 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 import socket
+import struct
 import json
 
 app = Flask(__name__)
 
+# 分帧协议的消息头：1字节标志位 + 4字节大端消息长度
+FRAME_HEADER = struct.Struct('>BI')
+
+def recv_exactly(client_socket, size):
+    chunks = []
+    while size > 0:
+        chunk = client_socket.recv(min(size, 65536))
+        if not chunk:
+            raise ConnectionError('连接已关闭')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
 # 连接到后端服务器
 def send_request_to_server(request_data):
     try:
         client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         client_socket.connect(('localhost', 10024))
-        client_socket.send(json.dumps(request_data).encode('utf-8'))
-        response = client_socket.recv(1024).decode('utf-8')
+        payload = json.dumps(request_data).encode('utf-8')
+        client_socket.sendall(FRAME_HEADER.pack(0, len(payload)) + payload)
+        flags, length = FRAME_HEADER.unpack(recv_exactly(client_socket, FRAME_HEADER.size))
+        response = recv_exactly(client_socket, length).decode('utf-8')
         client_socket.close()
         return json.loads(response)
     except Exception as e:
@@ -54,14 +70,52 @@ def delete_stock():
     
     return jsonify(response)
 
+@app.route('/kline/<stock_code>')
+def kline(stock_code):
+    response = send_request_to_server({
+        'action': 'get_kline',
+        'stock_code': stock_code,
+        'resolution': request.args.get('resolution', '1m')
+    })
+    
+    return jsonify(response)
+
 @app.route('/users')
 def users():
-    response = send_request_to_server({
+    # 每次只取一页，用户很多时页面和内存占用都不随用户数增长
+    sort = request.args.get('sort', 'id')
+    order = request.args.get('order', 'asc')
+    username_prefix = request.args.get('username_prefix', '')
+    request_data = {
         'action': 'get_users',
+        'admin_password': 'admin123',
+        'sort': sort,
+        'order': order,
+        'limit': 100
+    }
+    if username_prefix:
+        request_data['username_prefix'] = username_prefix
+    if request.args.get('cursor'):
+        request_data['cursor'] = request.args['cursor']
+    
+    response = send_request_to_server(request_data)
+    users = response.get('users', [])
+    message = response.get('message') or response.get('error')
+    return render_template('users.html', users=users, next_cursor=response.get('next_cursor'),
+                           sort=sort, order=order, username_prefix=username_prefix, message=message)
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus抓取的文本格式指标
+    response = send_request_to_server({
+        'action': 'get_metrics',
+        'format': 'prometheus',
         'admin_password': 'admin123'
     })
-    users = response.get('users', [])
-    return render_template('users.html', users=users)
+    if 'text' not in response:
+        return Response(response.get('message') or response.get('error', ''), status=502, mimetype='text/plain')
+    
+    return Response(response['text'], mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=10027, debug=True)
\ No newline at end of file
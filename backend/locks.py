@@ -0,0 +1,38 @@
+"""分段锁
+
+固定数量的锁按键的哈希分段，任意多的股票共用这组锁：锁的数量和内存不随股票数增长，
+不同段上的操作互不阻塞。同时需要多个键时按段号从小到大加锁，不会死锁。
+"""
+import threading
+from contextlib import contextmanager
+
+
+class LockStripes:
+    def __init__(self, count=64):
+        self.locks = [threading.Lock() for _ in range(count)]
+
+    def index(self, key):
+        return hash(key) % len(self.locks)
+
+    @contextmanager
+    def holding(self, *keys):
+        """持有这些键所在的段"""
+        indexes = sorted({self.index(key) for key in keys})
+        for i in indexes:
+            self.locks[i].acquire()
+        try:
+            yield
+        finally:
+            for i in reversed(indexes):
+                self.locks[i].release()
+
+    @contextmanager
+    def holding_all(self):
+        """持有全部段，用于一次修改所有股票"""
+        for lock in self.locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(self.locks):
+                lock.release()
@@ -0,0 +1,192 @@
+"""行情推送
+
+客户端通过subscribe订阅行情后，服务器在每次行情更新或成交后只推送发生变化的股票。
+订阅者按股票代码建立索引，一次发布的开销与变化的股票数成正比，与连接数无关。
+
+每个订阅只保留每只股票最新的一条待推送数据：消费慢的客户端不会积压消息，
+发送完一批后直接拿到合并后的最新行情。
+
+MarketVersions给每次行情变化分配递增的版本号，客户端带上已知的版本号
+轮询时只返回之后变化过的股票。SnapshotCache按版本号缓存序列化好的全量行情，
+同一版本的所有请求共享同一份字节。
+"""
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+import protocol
+
+
+class Subscription:
+    def __init__(self, subscription_id, symbols, notify):
+        self.subscription_id = subscription_id
+        self.symbols = set(symbols) if symbols else None  # None表示订阅全部股票
+        self.notify = notify  # 待推送数据从无到有时调用，唤醒推送线程或协程
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.coalesced = 0  # 被后续更新覆盖、没有单独发送的数据条数
+        self.closed = False
+
+    def offer(self, updates):
+        with self.lock:
+            was_empty = not self.pending
+            before = len(self.pending)
+            self.pending.update(updates)
+            self.coalesced += before + len(updates) - len(self.pending)
+        if was_empty:
+            self.notify()
+
+    def drain(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+        return pending
+
+
+class MarketDataHub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_symbol = {}  # 股票代码 -> 订阅该股票的Subscription集合
+        self.wildcard = set()  # 订阅全部股票的Subscription
+        self.ids = itertools.count(1)
+
+    def subscribe(self, symbols, notify):
+        subscription = Subscription(next(self.ids), symbols, notify)
+        with self.lock:
+            if subscription.symbols is None:
+                self.wildcard.add(subscription)
+            else:
+                for stock_code in subscription.symbols:
+                    self.by_symbol.setdefault(stock_code, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            if subscription.symbols is None:
+                self.wildcard.discard(subscription)
+            else:
+                for stock_code in subscription.symbols:
+                    subscribers = self.by_symbol.get(stock_code)
+                    if subscribers is not None:
+                        subscribers.discard(subscription)
+                        if not subscribers:
+                            del self.by_symbol[stock_code]
+        # 唤醒推送方，让它发现订阅已关闭后退出
+        subscription.closed = True
+        subscription.notify()
+
+    def subscriber_count(self):
+        with self.lock:
+            return len(self.wildcard) + len({s for subs in self.by_symbol.values() for s in subs})
+
+    def publish(self, changes):
+        """发布变化的行情，changes为{股票代码: 行情字典}，值为None表示股票已删除"""
+        with self.lock:
+            wildcard = list(self.wildcard)
+            targets = {}
+            if self.by_symbol:
+                for stock_code, stock_info in changes.items():
+                    for subscription in self.by_symbol.get(stock_code, ()):
+                        targets.setdefault(subscription, {})[stock_code] = stock_info
+        for subscription in wildcard:
+            subscription.offer(changes)
+        for subscription, updates in targets.items():
+            subscription.offer(updates)
+
+
+class MarketVersions:
+    """全局行情版本号和最近的变化记录"""
+
+    def __init__(self, max_logged=200000):
+        self.version = 0
+        # 服务器每次启动生成新的epoch，客户端带着旧epoch的版本号时返回全量
+        self.epoch = format(time.time_ns(), 'x')
+        self.max_logged = max_logged  # 变化记录中最多保留的股票代码数
+        self.log = deque()  # (版本号, 该版本变化的股票代码)
+        self.logged = 0
+        self.floor = 0  # 早于该版本的变化已从记录中清除
+        self.lock = threading.Lock()
+
+    def record(self, codes):
+        codes = tuple(codes)
+        with self.lock:
+            self.version += 1
+            self.log.append((self.version, codes))
+            self.logged += len(codes)
+            while self.logged > self.max_logged and len(self.log) > 1:
+                version, dropped = self.log.popleft()
+                self.logged -= len(dropped)
+                self.floor = version
+            return self.version
+
+    def changed_since(self, since):
+        """返回版本since之后变化过的股票代码集合，记录已不完整时返回None"""
+        with self.lock:
+            if since < self.floor or since > self.version:
+                return None
+            changed = set()
+            for version, codes in reversed(self.log):
+                if version <= since:
+                    break
+                changed.update(codes)
+            return changed
+
+
+class SnapshotCache:
+    """按行情版本缓存序列化后的全量行情响应（以及压缩后的版本）"""
+
+    def __init__(self, compress_level=6):
+        self.compress_level = compress_level
+        self.lock = threading.Lock()
+        self.version = None
+        self.response = None
+        self.encode_seconds = 0.0  # 当前版本序列化的耗时
+        self.compress_seconds = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.compressed_hits = 0
+        self.compressed_misses = 0
+        self.saved_seconds = 0.0  # 命中缓存省下的序列化和压缩时间
+
+    def get(self, version, build, compress=False):
+        """返回version对应的EncodedResponse，未缓存时调用build()生成响应字典"""
+        # 持锁序列化，同一版本只有一个线程做编码，其他线程等待后直接复用
+        with self.lock:
+            if self.version != version:
+                start = time.perf_counter()
+                response = protocol.EncodedResponse(json.dumps(build()).encode('utf-8'))
+                self.encode_seconds = time.perf_counter() - start
+                self.version = version
+                self.response = response
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.saved_seconds += self.encode_seconds
+            response = self.response
+            if compress:
+                if response.deflated is None:
+                    start = time.perf_counter()
+                    response.deflated = protocol.deflate(response.body[1:], self.compress_level)
+                    self.compress_seconds = time.perf_counter() - start
+                    self.compressed_misses += 1
+                else:
+                    self.compressed_hits += 1
+                    self.saved_seconds += self.compress_seconds
+            return response
+
+    def stats(self):
+        with self.lock:
+            response = self.response
+            return {
+                'version': self.version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'compressed_hits': self.compressed_hits,
+                'compressed_misses': self.compressed_misses,
+                'snapshot_bytes': len(response.body) if response else 0,
+                'compressed_bytes': len(response.deflated) if response and response.deflated else 0,
+                'encode_ms': self.encode_seconds * 1000,
+                'saved_ms': self.saved_seconds * 1000,
+            }
@@ -0,0 +1,73 @@
+"""市场行情模拟
+
+用几何布朗运动生成价格：每只股票有自己的波动率，一次tick对整个股票池
+做一次向量化计算。安装了NumPy时使用数组运算，否则退回逐个计算。
+"""
+import math
+import random
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 原模拟每30秒在±5%内均匀波动，标准差为0.05/sqrt(3)，折算为每秒的波动率
+DEFAULT_VOLATILITY = 0.05 / math.sqrt(3) / math.sqrt(30)
+MIN_PRICE = 0.01
+
+
+def percent_change(old, new):
+    """从old到new的涨跌幅百分比，保留两位小数"""
+    return round((new / old - 1) * 100, 2) if old > 0 else 0.0
+
+
+class MarketSimulator:
+    def __init__(self, volatility=DEFAULT_VOLATILITY, drift=0.0, seed=None):
+        self.default_volatility = volatility
+        self.drift = drift
+        self.volatilities = {}  # 单独设置过波动率的股票
+        self.generation = 0  # 每次设置波动率加1，模拟线程据此重建波动率数组
+        self.codes = []
+        self.sigma = None
+        self.sigma_generation = 0
+        self.random = random.Random(seed)
+        self.rng = np.random.default_rng(seed) if np is not None else None
+
+    def set_volatility(self, stock_code, volatility):
+        """设置一只股票每秒的波动率，None表示恢复默认值"""
+        if volatility is None:
+            self.volatilities.pop(stock_code, None)
+        else:
+            self.volatilities[stock_code] = volatility
+        self.generation += 1
+
+    def _sigma_for(self, codes):
+        # 股票池和波动率设置都不变时复用上次的波动率数组
+        generation = self.generation
+        if codes != self.codes or generation != self.sigma_generation:
+            sigma = [self.volatilities.get(code, self.default_volatility) for code in codes]
+            self.sigma = np.array(sigma) if np is not None else sigma
+            self.codes = list(codes)
+            self.sigma_generation = generation
+        return self.sigma
+
+    def step(self, codes, prices, dt):
+        """推进dt秒，返回(新价格列表, 涨跌幅百分比列表)，价格保留两位小数"""
+        sigma = self._sigma_for(codes)
+        if np is not None:
+            old = np.asarray(prices, dtype=float)
+            shock = self.rng.standard_normal(len(old))
+            ratio = np.exp((self.drift - 0.5 * sigma ** 2) * dt + sigma * math.sqrt(dt) * shock)
+            new = np.maximum(np.round(old * ratio, 2), MIN_PRICE)
+            changes = np.round(np.divide(new - old, old, out=np.zeros_like(old), where=old > 0) * 100, 2)
+            return new.tolist(), changes.tolist()
+
+        new_prices = []
+        changes = []
+        sqrt_dt = math.sqrt(dt)
+        for old, s in zip(prices, sigma):
+            ratio = math.exp((self.drift - 0.5 * s * s) * dt + s * sqrt_dt * self.random.gauss(0.0, 1.0))
+            new = max(round(old * ratio, 2), MIN_PRICE)
+            new_prices.append(new)
+            changes.append(percent_change(old, new))
+        return new_prices, changes
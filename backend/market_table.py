@@ -0,0 +1,166 @@
+"""共享内存行情表
+
+主进程把全部股票的行情写入一块multiprocessing.shared_memory，其他进程直接映射读取，
+不经过主进程，也不争用主进程的GIL。表的布局固定：
+
+    48字节头（魔数、容量、已用行数、标志、序号、版本号、epoch）| 行[容量]
+    每行144字节：股票代码32字节 | 公司名称96字节（UTF-8，不足补0）| 价格float64 | 涨跌幅float64
+
+每只股票占一行，删除后该行清零并在之后新增股票时复用。
+
+写入使用seqlock：写之前把序号加1（变成奇数），写完再加1（变成偶数）。
+读取方先读序号，为奇数时等待；复制全部行之后再读一次序号，两次相同说明读到的是完整的一版，
+否则重新读取。写入方从不等待读取方。
+
+行数超过容量、股票代码超过32字节或价格不是数字时设置溢出标志，读取方看到后不再使用这张表。
+"""
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+HEADER = struct.Struct('<4sIIIQQ16s')
+MAGIC = b'MKT1'
+SEQ = struct.Struct('<Q')
+SEQ_OFFSET = 16
+VERSION_OFFSET = 24
+ROW = struct.Struct('<32s96sdd')
+PRICE = struct.Struct('<dd')
+PRICE_OFFSET = 128
+CODE_SIZE = 32
+NAME_SIZE = 96
+FLAG_OVERFLOW = 0x01
+
+
+def encode_name(name):
+    """编码公司名称，超长时在字符边界处截断"""
+    data = str(name or '').encode('utf-8')
+    if len(data) > NAME_SIZE:
+        data = data[:NAME_SIZE].decode('utf-8', 'ignore').encode('utf-8')
+    return data
+
+
+class MarketTable:
+    """写入方，只在主进程中使用"""
+
+    def __init__(self, capacity, epoch):
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(create=True, size=HEADER.size + capacity * ROW.size)
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        self.lock = threading.Lock()  # 写入方之间互斥，读取方不加锁
+        self.slots = {}  # 股票代码 -> 行号
+        self.free = []
+        self.count = 0
+        self.flags = 0
+        self.seq = 0
+        self.version = 0
+        HEADER.pack_into(self.buf, 0, MAGIC, capacity, 0, 0, 0, 0, epoch.encode('ascii')[:16])
+
+    def publish(self, changes, version):
+        """写入一批行情变化，changes与notify_market_change的参数相同
+
+        调用方保证version按顺序递增：读取方看到版本V时，V及之前的变化都已写入。
+        """
+        with self.lock:
+            buf = self.buf
+            if buf is None:
+                return
+            self.seq += 1
+            SEQ.pack_into(buf, SEQ_OFFSET, self.seq)
+            try:
+                for stock_code, stock_info in changes.items():
+                    slot = self.slots.get(stock_code)
+                    if stock_info is None:
+                        if slot is not None:
+                            del self.slots[stock_code]
+                            ROW.pack_into(buf, HEADER.size + slot * ROW.size, b'', b'', 0.0, 0.0)
+                            self.free.append(slot)
+                        continue
+                    try:
+                        if slot is None:
+                            slot = self.allocate(stock_code)
+                            if slot is None:
+                                continue
+                            ROW.pack_into(buf, HEADER.size + slot * ROW.size, stock_code.encode('utf-8'),
+                                          encode_name(stock_info.get('company_name')),
+                                          stock_info.get('price', 0.0), stock_info.get('change', 0.0))
+                            continue
+                        offset = HEADER.size + slot * ROW.size
+                        if 'company_name' in stock_info:
+                            struct.pack_into(f'{NAME_SIZE}s', buf, offset + CODE_SIZE,
+                                             encode_name(stock_info['company_name']))
+                        price, change = PRICE.unpack_from(buf, offset + PRICE_OFFSET)
+                        PRICE.pack_into(buf, offset + PRICE_OFFSET, stock_info.get('price', price),
+                                        stock_info.get('change', change))
+                    except struct.error:
+                        # 价格不是数字（添加股票时没有校验），这张表无法表示，交给主进程处理
+                        self.flags |= FLAG_OVERFLOW
+                # 调用方按版本号顺序发布，行数据写完之后才更新版本号
+                self.version = version
+                struct.pack_into('<II', buf, 8, self.count, self.flags)
+                SEQ.pack_into(buf, VERSION_OFFSET, self.version)
+            finally:
+                self.seq += 1
+                SEQ.pack_into(buf, SEQ_OFFSET, self.seq)
+
+    def allocate(self, stock_code):
+        if len(stock_code.encode('utf-8')) > CODE_SIZE or (not self.free and self.count >= self.capacity):
+            self.flags |= FLAG_OVERFLOW
+            return None
+        slot = self.free.pop() if self.free else self.count
+        if slot == self.count:
+            self.count += 1
+        self.slots[stock_code] = slot
+        return slot
+
+    def close(self):
+        with self.lock:
+            self.buf = None
+            self.shm.close()
+            self.shm.unlink()
+
+
+class MarketTableReader:
+    """读取方，在其他进程中按名称映射同一块共享内存"""
+
+    def __init__(self, name):
+        self.shm = shared_memory.SharedMemory(name=name)
+        self.buf = self.shm.buf
+        magic, self.capacity, _, _, _, _, epoch = HEADER.unpack_from(self.buf)
+        if magic != MAGIC:
+            raise ValueError(f'无效的行情表: {name}')
+        self.epoch = epoch.rstrip(b'\0').decode('ascii')
+
+    def version(self):
+        """当前版本号和表是否可用，不复制行数据"""
+        _, flags = struct.unpack_from('<II', self.buf, 8)
+        return SEQ.unpack_from(self.buf, VERSION_OFFSET)[0], not flags & FLAG_OVERFLOW
+
+    def read(self):
+        """返回(版本号, {股票代码: {'company_name', 'price', 'change'}})，总是一致的一版"""
+        buf = self.buf
+        while True:
+            seq = SEQ.unpack_from(buf, SEQ_OFFSET)[0]
+            if seq & 1:
+                time.sleep(0)
+                continue
+            count = struct.unpack_from('<I', buf, 8)[0]
+            version = SEQ.unpack_from(buf, VERSION_OFFSET)[0]
+            rows = bytes(buf[HEADER.size:HEADER.size + count * ROW.size])
+            if SEQ.unpack_from(buf, SEQ_OFFSET)[0] == seq:
+                break
+        stocks = {}
+        for code, name, price, change in ROW.iter_unpack(rows):
+            code = code.rstrip(b'\0')
+            if code:
+                stocks[code.decode('utf-8')] = {
+                    'company_name': name.rstrip(b'\0').decode('utf-8', 'ignore'),
+                    'price': price,
+                    'change': change
+                }
+        return version, stocks
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
@@ -0,0 +1,151 @@
+"""运行指标
+
+按请求类型统计请求数、出错数和延迟分布，另有行情更新耗时和成组提交耗时的分布，
+以及在读取时才计算的当前值（连接数、写队列长度等）。
+
+直方图使用固定的桶，记录一次只需要一次二分查找和几次加法，请求路径上的开销
+在几微秒以内。可以导出为JSON或Prometheus文本格式。
+"""
+import bisect
+import threading
+
+# 延迟直方图的桶上界，单位秒
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+# 未知或格式错误的请求统一记在这个名字下，避免请求类型的数量无限增长
+UNKNOWN_ACTION = 'unknown'
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个桶对应+Inf
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """返回(累计的各桶计数, 总数, 总和)，累计计数与Prometheus的le语义相同"""
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+            total = self.sum
+        cumulative = []
+        running = 0
+        for n in counts:
+            running += n
+            cumulative.append(running)
+        return cumulative, count, total
+
+    def quantile(self, q, cumulative=None, count=None):
+        """按桶上界估计分位数，落在+Inf桶时返回最大的有限上界"""
+        if cumulative is None:
+            cumulative, count, _ = self.snapshot()
+        if not count:
+            return None
+        rank = q * count
+        for bound, n in zip(self.buckets, cumulative):
+            if n >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def to_dict(self):
+        cumulative, count, total = self.snapshot()
+        return {
+            'count': count,
+            'sum': total,
+            'p50': self.quantile(0.5, cumulative, count),
+            'p95': self.quantile(0.95, cumulative, count),
+            'p99': self.quantile(0.99, cumulative, count),
+            'buckets': {str(bound): n for bound, n in zip(self.buckets, cumulative)},
+        }
+
+
+class ActionStats:
+    __slots__ = ('latency', 'errors')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+
+
+class Metrics:
+    def __init__(self):
+        self.actions = {}
+        self.lock = threading.Lock()
+        self.tick_latency = Histogram()
+        self.commit_latency = Histogram()
+        self.gauges = {}  # 名称 -> (说明, 读取当前值的函数)
+
+    def gauge(self, name, help_text, func):
+        self.gauges[name] = (help_text, func)
+
+    def observe_request(self, action, seconds, failed):
+        stats = self.actions.get(action)
+        if stats is None:
+            with self.lock:
+                stats = self.actions.setdefault(action, ActionStats())
+        stats.latency.observe(seconds)
+        if failed:
+            with stats.latency.lock:
+                stats.errors += 1
+
+    def to_dict(self):
+        requests = {}
+        for action, stats in sorted(self.actions.items()):
+            requests[action] = dict(stats.latency.to_dict(), errors=stats.errors)
+        return {
+            'requests': requests,
+            'gauges': {name: func() for name, (_, func) in self.gauges.items()},
+            'market_tick_seconds': self.tick_latency.to_dict(),
+            'commit_seconds': self.commit_latency.to_dict(),
+        }
+
+    def prometheus(self):
+        """Prometheus文本格式（0.0.4）"""
+        lines = []
+        actions = sorted(self.actions.items())
+        lines.append('# HELP stock_requests_total 按请求类型统计的请求数')
+        lines.append('# TYPE stock_requests_total counter')
+        snapshots = [(action, stats.latency.snapshot(), stats.errors) for action, stats in actions]
+        for action, (_, count, _), _ in snapshots:
+            lines.append(f'stock_requests_total{{action="{action}"}} {count}')
+        lines.append('# HELP stock_request_errors_total 返回失败或出现异常的请求数')
+        lines.append('# TYPE stock_request_errors_total counter')
+        for action, _, errors in snapshots:
+            lines.append(f'stock_request_errors_total{{action="{action}"}} {errors}')
+        lines.append('# HELP stock_request_duration_seconds 请求处理耗时')
+        lines.append('# TYPE stock_request_duration_seconds histogram')
+        for action, snapshot, _ in snapshots:
+            self.histogram_lines(lines, 'stock_request_duration_seconds', LATENCY_BUCKETS, snapshot,
+                                 f'action="{action}"')
+        for name, help_text, histogram in (
+                ('stock_market_tick_duration_seconds', '一次行情更新的耗时', self.tick_latency),
+                ('stock_commit_duration_seconds', '一次成组提交的耗时', self.commit_latency)):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            self.histogram_lines(lines, name, histogram.buckets, histogram.snapshot())
+        for name, (help_text, func) in self.gauges.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {func()}')
+        lines.append('')
+        return '\n'.join(lines)
+
+    @staticmethod
+    def histogram_lines(lines, name, buckets, snapshot, labels=''):
+        cumulative, count, total = snapshot
+        prefix = labels + ',' if labels else ''
+        for bound, n in zip(buckets, cumulative):
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {n}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {count}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {total}')
+        lines.append(f'{name}_count{suffix} {count}')
@@ -0,0 +1,141 @@
+"""数据库结构迁移
+
+数据库当前的结构版本记录在PRAGMA user_version中。服务器启动时按顺序执行
+版本号之后的迁移，每个迁移和版本号的更新在同一个事务中完成，中途失败不会留下
+执行了一半的迁移。
+
+新增迁移时在MIGRATIONS末尾追加函数，已经发布的迁移不要再修改。
+"""
+
+
+def create_baseline(c):
+    """1: 初始表结构，之前版本的数据库已有这些表时保持不变"""
+    # 创建用户表
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE,
+        password TEXT,
+        balance REAL DEFAULT 20000
+    )
+    ''')
+
+    # 创建股票表
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS stocks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        stock_code TEXT UNIQUE,
+        company_name TEXT,
+        price REAL,
+        change REAL
+    )
+    ''')
+
+    # 创建持仓表
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS holdings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        stock_code TEXT,
+        quantity INTEGER,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''')
+
+    # 创建交易记录表
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        stock_code TEXT,
+        type TEXT,
+        price REAL,
+        quantity INTEGER,
+        timestamp TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''')
+
+    # 创建委托单表，挂单冻结的资金或股票已从余额、持仓中扣除
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        stock_code TEXT,
+        side TEXT,
+        order_type TEXT,
+        price REAL,
+        quantity INTEGER,
+        remaining INTEGER,
+        status TEXT,
+        timestamp TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''')
+
+
+def add_holding_indexes(c):
+    """2: 每个用户每只股票只有一条持仓，并为按股票、按状态的查询建索引"""
+    # 旧代码在并发下可能插入重复持仓，合并到id最小的一条
+    c.execute('''
+    UPDATE holdings SET quantity = (
+        SELECT SUM(h.quantity) FROM holdings h
+        WHERE h.user_id = holdings.user_id AND h.stock_code = holdings.stock_code
+    )
+    WHERE id IN (SELECT MIN(id) FROM holdings GROUP BY user_id, stock_code HAVING COUNT(*) > 1)
+    ''')
+    c.execute('DELETE FROM holdings WHERE id NOT IN (SELECT MIN(id) FROM holdings GROUP BY user_id, stock_code)')
+    c.execute('DELETE FROM holdings WHERE quantity <= 0')
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_holdings_user_stock ON holdings (user_id, stock_code)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_holdings_stock ON holdings (stock_code)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_orders_stock_status ON orders (stock_code, status)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status)')
+
+
+def add_user_balance_index(c):
+    """3: 用户列表按余额排序分页（索引项本身按rowid即id排序，相同余额时顺序确定）"""
+    c.execute('CREATE INDEX IF NOT EXISTS idx_users_balance ON users (balance)')
+
+
+def add_transaction_indexes(c):
+    """4: 交易记录按用户、股票查询（索引项按id排序，可以直接按id倒序分页），按时间范围查询
+
+    (user_id)不能省略：(user_id, stock_code)中同一用户的记录先按股票排序，
+    只按用户查询时无法按id倒序直接取前几条，需要把该用户的全部记录排序。
+    """
+    c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (user_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_stock ON transactions (user_id, stock_code)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_stock ON transactions (stock_code)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions (timestamp)')
+
+
+MIGRATIONS = [
+    create_baseline,
+    add_holding_indexes,
+    add_user_balance_index,
+    add_transaction_indexes,
+]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(pool, target=None):
+    """把数据库迁移到target版本（默认最新），返回(迁移前的版本, 迁移后的版本)"""
+    target = len(MIGRATIONS) if target is None else target
+    with pool.connection() as conn:
+        start = schema_version(conn)
+    if start > len(MIGRATIONS):
+        raise RuntimeError(f'数据库版本{start}高于程序支持的版本{len(MIGRATIONS)}')
+    version = start
+    while version < target:
+        with pool.transaction() as conn:
+            # 事务开始后重新读取，多个进程同时启动时只有一个执行迁移
+            version = schema_version(conn)
+            if version >= target:
+                break
+            MIGRATIONS[version](conn.cursor())
+            version += 1
+            conn.execute(f'PRAGMA user_version = {version}')
+    return start, version
@@ -0,0 +1,266 @@
+"""限价订单簿与撮合引擎
+
+每只股票一个OrderBook，按价格优先、时间优先撮合：
+- 买卖两侧各用一个堆保存价位，价位内的订单按到达顺序排在deque中
+- 新价位入堆O(log n)，同价位挂单O(1)
+- 撤单只把订单剩余数量清零并扣减价位总量，价位清空后从字典删除，
+  堆中残留的价格在撮合时惰性跳过，因此撤单是O(1)
+- 堆中失效的价格超过一半、或价位中已撤销的订单超过一半时压缩，
+  远离盘口的反复挂撤单不会让堆和队列无限增长，撤单仍是均摊O(1)
+- 新订单遇到同一用户的挂单时停止撮合，剩余部分撤销，不会与自己成交
+
+订单簿只负责内存中的撮合，资金、持仓的冻结与结算由服务器完成。
+撮合和撤单时可以传入一个列表记录修改，数据库事务回滚时用undo()按相反顺序撤销，
+订单簿与orders表保持一致。
+"""
+import heapq
+from collections import deque
+
+BUY = 'buy'
+SELL = 'sell'
+
+
+class Order:
+    __slots__ = ('order_id', 'user_id', 'side', 'price', 'remaining')
+
+    def __init__(self, order_id, user_id, side, price, remaining):
+        self.order_id = order_id
+        self.user_id = user_id
+        self.side = side
+        self.price = price
+        self.remaining = remaining
+
+
+class PriceLevel:
+    __slots__ = ('orders', 'volume', 'dead')
+
+    def __init__(self):
+        self.orders = deque()
+        self.volume = 0
+        self.dead = 0  # orders中已撤销、还没有移出的订单数
+
+
+class OrderBook:
+    def __init__(self, stock_code):
+        self.stock_code = stock_code
+        self.bids = {}  # 价格 -> PriceLevel
+        self.asks = {}
+        self.bid_heap = []  # 存负价格，堆顶是最高买价
+        self.ask_heap = []
+        self.orders = {}  # 挂单中的订单 order_id -> Order
+
+    def _side(self, side):
+        """返回一侧的(价位字典, 堆, 符号)，堆中保存价格乘以符号"""
+        if side == BUY:
+            return self.bids, self.bid_heap, -1
+        return self.asks, self.ask_heap, 1
+
+    def _best(self, side):
+        """返回一侧的最优价位，顺便清理堆顶已失效的价格"""
+        levels, heap, sign = self._side(side)
+        while heap:
+            price = heap[0] * sign
+            if price in levels:
+                return price
+            heapq.heappop(heap)
+        return None
+
+    def best_bid(self):
+        return self._best(BUY)
+
+    def best_ask(self):
+        return self._best(SELL)
+
+    def rest(self, order):
+        """把订单直接挂到簿上，不撮合（用于启动时恢复挂单）"""
+        if order.side == BUY:
+            levels, heap, key = self.bids, self.bid_heap, -order.price
+        else:
+            levels, heap, key = self.asks, self.ask_heap, order.price
+        level = levels.get(order.price)
+        if level is None:
+            level = levels[order.price] = PriceLevel()
+            heapq.heappush(heap, key)
+        level.orders.append(order)
+        level.volume += order.remaining
+        self.orders[order.order_id] = order
+
+    def submit(self, order, changes=None):
+        """撮合新订单，price为None表示市价单
+
+        返回成交列表[(对手订单, 成交价, 成交量)]，限价单未成交部分挂在簿上，
+        市价单未成交部分丢弃，由调用方根据order.remaining处理。
+        排在前面的对手订单属于同一用户时停止撮合，限价单的剩余部分也不再挂单。
+        给定changes时把对订单簿的修改追加到其中，供undo()撤销。
+        """
+        fills = []
+        self_match = False
+        maker_side = SELL if order.side == BUY else BUY
+        levels, heap, sign = self._side(maker_side)
+        limit = order.price
+        while order.remaining > 0 and heap and not self_match:
+            price = heap[0] * sign
+            level = levels.get(price)
+            if level is None:
+                heapq.heappop(heap)
+                continue
+            if limit is not None and (price > limit if order.side == BUY else price < limit):
+                break
+            queue = level.orders
+            while order.remaining > 0 and queue:
+                maker = queue[0]
+                if maker.remaining == 0:
+                    queue.popleft()  # 已撤销
+                    level.dead -= 1
+                    if changes is not None:
+                        changes.append(('dead', level, maker))
+                    continue
+                if maker.user_id == order.user_id:
+                    self_match = True
+                    break
+                quantity = maker.remaining if maker.remaining < order.remaining else order.remaining
+                maker.remaining -= quantity
+                order.remaining -= quantity
+                level.volume -= quantity
+                fills.append((maker, price, quantity))
+                if changes is not None:
+                    changes.append(('fill', level, maker, quantity))
+                if maker.remaining == 0:
+                    queue.popleft()
+                    del self.orders[maker.order_id]
+                    if changes is not None:
+                        changes.append(('filled', level, maker))
+            if level.volume == 0:
+                del levels[price]
+                heapq.heappop(heap)
+                if changes is not None:
+                    changes.append(('level', maker_side, price, level))
+        if order.remaining > 0 and limit is not None and not self_match:
+            self.rest(order)
+            if changes is not None:
+                changes.append(('rest', order))
+        return fills
+
+    def cancel(self, order_id, changes=None):
+        """撤销挂单，返回被撤销的订单（含撤单前的剩余数量），不存在时返回None"""
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return None
+        levels, heap, sign = self._side(order.side)
+        level = levels[order.price]
+        level.volume -= order.remaining
+        cancelled = Order(order.order_id, order.user_id, order.side, order.price, order.remaining)
+        order.remaining = 0
+        level.dead += 1
+        if changes is not None:
+            changes.append(('cancel', order, cancelled.remaining, level))
+        if level.volume == 0:
+            del levels[order.price]
+            if len(heap) > 2 * len(levels):
+                # 堆的内容不需要撤销：undo恢复价位时会重新入堆
+                heap[:] = [price * sign for price in levels]
+                heapq.heapify(heap)
+        elif level.dead > len(level.orders) // 2:
+            if changes is not None:
+                changes.append(('compact', level, level.orders, level.dead))
+            level.orders = deque(o for o in level.orders if o.remaining)
+            level.dead = 0
+        return cancelled
+
+    def undo(self, changes):
+        """按相反顺序撤销submit和cancel记录的修改"""
+        for change in reversed(changes):
+            kind = change[0]
+            if kind == 'fill':
+                _, level, maker, quantity = change
+                maker.remaining += quantity
+                level.volume += quantity
+            elif kind == 'filled':
+                _, level, maker = change
+                level.orders.appendleft(maker)
+                self.orders[maker.order_id] = maker
+            elif kind == 'dead':
+                change[1].orders.appendleft(change[2])
+                change[1].dead += 1
+            elif kind == 'compact':
+                _, level, orders, dead = change
+                level.orders = orders
+                level.dead = dead
+            elif kind == 'level':
+                _, side, price, level = change
+                levels, heap, sign = self._side(side)
+                levels[price] = level
+                heapq.heappush(heap, price * sign)
+            elif kind == 'rest':
+                order = change[1]
+                levels = self._side(order.side)[0]
+                level = levels[order.price]
+                level.orders.pop()
+                level.volume -= order.remaining
+                del self.orders[order.order_id]
+                if level.volume == 0:
+                    del levels[order.price]
+            elif kind == 'cancel':
+                _, order, remaining, level = change
+                order.remaining = remaining
+                level.dead -= 1
+                self.orders[order.order_id] = order
+                level.volume += remaining
+                levels, heap, sign = self._side(order.side)
+                if order.price not in levels:
+                    levels[order.price] = level
+                    heapq.heappush(heap, order.price * sign)
+
+    def sweep(self, side, quantity, budget=None, user_id=None):
+        """估算市价单吃掉对手盘的结果，不修改订单簿
+
+        返回(可成交数量, 成交金额)；给定budget时买单只成交资金够用的部分，
+        给定user_id时与submit一样在该用户自己的挂单处停止。
+        """
+        levels = self.asks if side == BUY else self.bids
+        filled = 0
+        cost = 0.0
+        for price in sorted(levels, reverse=(side == SELL)):
+            available = levels[price].volume
+            self_match = False
+            if user_id is not None:
+                available = 0
+                for order in levels[price].orders:
+                    if order.remaining and order.user_id == user_id:
+                        self_match = True
+                        break
+                    available += order.remaining
+                    if available >= quantity - filled:
+                        break
+            take = min(available, quantity - filled)
+            if budget is not None:
+                take = min(take, int((budget - cost) // price))
+            if take <= 0:
+                break
+            filled += take
+            cost += take * price
+            if filled >= quantity or self_match:
+                break
+        return filled, cost
+
+    def depth(self, count=5):
+        """返回买卖各count档的[价格, 总量]"""
+        bids = [[price, self.bids[price].volume] for price in heapq.nlargest(count, self.bids)]
+        asks = [[price, self.asks[price].volume] for price in heapq.nsmallest(count, self.asks)]
+        return {'bids': bids, 'asks': asks}
+
+
+class MatchingEngine:
+    """按股票代码管理订单簿"""
+
+    def __init__(self):
+        self.books = {}
+
+    def book(self, stock_code):
+        book = self.books.get(stock_code)
+        if book is None:
+            book = self.books.setdefault(stock_code, OrderBook(stock_code))
+        return book
+
+    def remove(self, stock_code):
+        self.books.pop(stock_code, None)
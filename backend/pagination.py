@@ -0,0 +1,56 @@
+"""键集分页
+
+列表接口按(排序列, id)排序，游标记录上一页最后一行的排序值，下一页从该位置
+之后继续查询。每一页都是索引上的一次范围扫描，与翻到第几页无关，
+也不会因为翻页期间插入新行而重复或遗漏。
+
+游标对客户端是不透明的字符串，内部是base64编码的JSON，包含生成它的查询条件，
+换了排序方式后旧游标失效。
+"""
+import base64
+import binascii
+import json
+
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(*values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, *expected):
+    """解码游标，开头几项需要与expected一致，返回其余的排序值；无效时返回None"""
+    if not isinstance(cursor, str):
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, binascii.Error, UnicodeError):
+        return None
+    if not isinstance(values, list) or values[:len(expected)] != list(expected):
+        return None
+    return values[len(expected):]
+
+
+def keyset_condition(columns, order, position):
+    """返回(列1, 列2) > (?, ?)形式的条件和参数，降序时比较符为<"""
+    operator = '>' if order == 'asc' else '<'
+    if len(columns) == 1:
+        return f'{columns[0]} {operator} ?', list(position)
+    placeholders = ', '.join('?' for _ in columns)
+    return f"({', '.join(columns)}) {operator} ({placeholders})", list(position)
+
+
+def order_clause(columns, order):
+    direction = 'ASC' if order == 'asc' else 'DESC'
+    return ', '.join(f'{column} {direction}' for column in columns)
+
+
+def prefix_range(prefix):
+    """前缀匹配转换为范围条件的上下界，可以使用索引；没有上界时第二项为None"""
+    stem = prefix.rstrip('\U0010ffff')
+    if not stem:
+        return prefix, None
+    code = ord(stem[-1]) + 1
+    if 0xd800 <= code <= 0xdfff:
+        code = 0xe000  # 跳过代理区，SQLite只接受合法的UTF-8
+    return prefix, stem[:-1] + chr(code)
@@ -0,0 +1,213 @@
+"""按需性能分析
+
+管理员可以在服务器运行时开启一次性能分析，在限定的时长或请求数之后自动结束，
+也可以只分析指定类型的请求：
+
+- deterministic: 用cProfile分析每个请求，合并后保存为pstats文件，
+  可以用pstats、snakeviz或flameprof查看
+- sampling: 后台线程按固定间隔读取所有线程的调用栈，保存为collapsed stack格式
+  （每行"栈帧;栈帧;... 次数"），可以直接交给flamegraph.pl或speedscope生成火焰图
+
+没有开启分析时，请求路径上只多一次属性判断。
+"""
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+MODES = ('deterministic', 'sampling')
+DEFAULT_SECONDS = 30
+MAX_SECONDS = 600
+MIN_INTERVAL = 0.001
+TOP_FUNCTIONS = 20
+
+
+def frame_label(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class ProfileSession:
+    def __init__(self, mode, seconds, max_requests, actions, interval):
+        self.mode = mode
+        self.seconds = seconds
+        self.max_requests = max_requests
+        self.actions = actions  # None表示分析所有请求
+        self.interval = interval
+        self.started = time.time()
+        self.requests = 0
+        self.stats = None  # deterministic: 合并后的pstats.Stats
+        self.samples = Counter()  # sampling: 调用栈 -> 采样次数
+        self.threads = {}  # sampling: 正在处理请求的线程 -> 请求类型
+        self.stopped = threading.Event()
+        self.sampler = None
+        self.timer = None
+
+
+class Profiler:
+    def __init__(self, output_dir='profiles'):
+        self.output_dir = output_dir
+        self.session = None  # 没有进行中的分析时为None
+        self.last = None  # 上一次分析的结果
+        self.lock = threading.Lock()
+
+    def start(self, mode='sampling', seconds=None, requests=None, actions=None, interval=0.005):
+        """开始分析，参数错误或已有分析在进行时抛出ValueError"""
+        if mode not in MODES:
+            raise ValueError('分析模式错误')
+        if requests is not None and (not isinstance(requests, int) or requests <= 0):
+            raise ValueError('请求数错误')
+        if seconds is None:
+            seconds = MAX_SECONDS if requests is not None else DEFAULT_SECONDS
+        if not isinstance(seconds, (int, float)) or not 0 < seconds <= MAX_SECONDS:
+            raise ValueError(f'分析时长需要在0到{MAX_SECONDS}秒之间')
+        if not isinstance(interval, (int, float)) or interval < MIN_INTERVAL:
+            raise ValueError('采样间隔错误')
+        if actions is not None:
+            if not isinstance(actions, list) or not all(isinstance(action, str) for action in actions):
+                raise ValueError('请求类型列表错误')
+            actions = frozenset(actions)
+
+        with self.lock:
+            if self.session is not None:
+                raise ValueError('已有分析正在进行')
+            session = ProfileSession(mode, seconds, requests, actions, interval)
+            session.timer = threading.Timer(seconds, self.expire, args=(session,))
+            session.timer.daemon = True
+            session.timer.start()
+            if mode == 'sampling':
+                session.sampler = threading.Thread(target=self.sample, args=(session,), name='profiler',
+                                                   daemon=True)
+                session.sampler.start()
+            self.session = session
+        return self.status()
+
+    def stop(self):
+        """结束分析并保存结果，返回结果；没有进行中的分析时返回None"""
+        with self.lock:
+            if self.session is None:
+                return None
+            return self.finish(self.session)
+
+    def expire(self, session):
+        with self.lock:
+            if self.session is session:
+                self.finish(session)
+
+    def status(self):
+        session = self.session
+        if session is None:
+            return {'active': False, 'last': self.last}
+        return {
+            'active': True,
+            'mode': session.mode,
+            'actions': sorted(session.actions) if session.actions is not None else None,
+            'requests': session.requests,
+            'max_requests': session.max_requests,
+            'samples': sum(session.samples.values()),
+            'elapsed': time.time() - session.started,
+            'seconds': session.seconds,
+            'last': self.last,
+        }
+
+    def run(self, action, func, request):
+        """在分析期间执行func(request)，session结束后正在执行的请求不再计入"""
+        session = self.session
+        if session is None or (session.actions is not None and action not in session.actions):
+            return func(request)
+        if session.mode == 'sampling':
+            thread_id = threading.get_ident()
+            session.threads[thread_id] = action
+            try:
+                return func(request)
+            finally:
+                session.threads.pop(thread_id, None)
+                self.count(session, None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 其他线程已占用解释器的分析钩子（Python 3.12起全局只有一个），本次请求不分析
+            return func(request)
+        try:
+            return func(request)
+        finally:
+            profile.disable()
+            self.count(session, profile)
+
+    def count(self, session, profile):
+        with self.lock:
+            if self.session is not session:
+                return
+            if profile is not None:
+                if session.stats is None:
+                    session.stats = pstats.Stats(profile)
+                else:
+                    session.stats.add(profile)
+            session.requests += 1
+            if session.max_requests is not None and session.requests >= session.max_requests:
+                self.finish(session)
+
+    def sample(self, session):
+        own = threading.get_ident()
+        while not session.stopped.wait(session.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            threads = dict(session.threads)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if session.actions is not None and thread_id not in threads:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame.f_code))
+                    frame = frame.f_back
+                # 处理请求的线程以请求类型作为根节点，其他线程以线程名作为根节点
+                stack.append(threads.get(thread_id) or names.get(thread_id, str(thread_id)))
+                stack.reverse()
+                session.samples[';'.join(stack)] += 1
+
+    def finish(self, session):
+        """调用时需持有self.lock"""
+        self.session = None
+        session.stopped.set()
+        session.timer.cancel()
+        if session.sampler is not None and session.sampler is not threading.current_thread():
+            session.sampler.join()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = f"{session.mode}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(session.started))}"
+        if session.mode == 'deterministic':
+            path = os.path.join(self.output_dir, name + '.pstats')
+            top = []
+            if session.stats is not None:
+                session.stats.dump_stats(path)
+                session.stats.sort_stats('cumulative')
+                for func in session.stats.fcn_list[:TOP_FUNCTIONS]:
+                    calls, _, total, cumulative, _ = session.stats.stats[func]
+                    filename, line, function = func
+                    top.append({'function': f'{function} ({os.path.basename(filename)}:{line})',
+                                'calls': calls, 'total': total, 'cumulative': cumulative})
+            else:
+                path = None
+        else:
+            path = os.path.join(self.output_dir, name + '.collapsed')
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, n in session.samples.items():
+                    f.write(f'{stack} {n}\n')
+            leaves = Counter()
+            for stack, n in session.samples.items():
+                leaves[stack.rsplit(';', 1)[-1]] += n
+            top = [{'function': function, 'samples': n} for function, n in leaves.most_common(TOP_FUNCTIONS)]
+
+        self.last = {
+            'mode': session.mode,
+            'file': path,
+            'requests': session.requests,
+            'samples': sum(session.samples.values()),
+            'seconds': time.time() - session.started,
+            'top': top,
+        }
+        return self.last
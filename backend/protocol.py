@@ -0,0 +1,144 @@
+"""TCP通信协议的消息分帧
+
+分帧协议中每条消息由5字节头和UTF-8编码的JSON组成：
+1字节标志位 + 4字节大端消息体长度。请求中可以携带request_id，
+服务器在对应的响应中原样返回，因此同一连接上可以同时有多个未完成的请求，
+响应按完成顺序返回。
+
+旧客户端直接发送JSON（第一个字节是'{'），服务器据此区分两种协议，
+分帧连接的第一个字节是标志位，取值不超过FLAGS_MASK。
+
+请求中带"compress": true时，响应的消息体使用raw deflate压缩并设置FLAG_DEFLATE。
+"""
+import json
+import struct
+import zlib
+
+HEADER = struct.Struct('>BI')
+HEADER_SIZE = HEADER.size
+FLAGS_MASK = 0x07
+FLAG_DEFLATE = 0x01
+DEFLATE_WBITS = -15
+# 单条消息的上限，防止异常的长度字段占满内存
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+
+
+class FrameError(Exception):
+    pass
+
+
+def is_framed(first_byte):
+    return first_byte <= FLAGS_MASK
+
+
+def encode_frame(payload, flags=0):
+    return HEADER.pack(flags, len(payload)) + payload
+
+
+def parse_header(header):
+    flags, length = HEADER.unpack(header)
+    if flags & ~FLAGS_MASK:
+        raise FrameError(f'未知的帧标志: {flags}')
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f'消息过大: {length}字节')
+    return flags, length
+
+
+class EncodedResponse:
+    """预先序列化好的JSON对象响应，多个请求共享同一份字节
+
+    deflated是去掉开头'{'之后的内容的raw deflate压缩结果，
+    返回给每个请求时只需要压缩很短的前缀再拼接。
+    """
+    __slots__ = ('body', 'deflated')
+
+    def __init__(self, body, deflated=None):
+        self.body = body
+        self.deflated = deflated
+
+
+def deflate(data, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, DEFLATE_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def encode_message(message):
+    return encode_frame(json.dumps(message).encode('utf-8'))
+
+
+def _response_prefix(request_id):
+    if request_id is None:
+        return b'{'
+    return b'{"request_id": ' + json.dumps(request_id).encode('utf-8') + b', '
+
+
+def encode_response(response, request_id=None, compress=False):
+    """编码分帧响应，请求带有request_id时在响应中原样返回"""
+    if isinstance(response, EncodedResponse):
+        if compress and response.deflated is not None:
+            # 前缀以同步刷新结束（非最终块、字节对齐），后面可以直接接上缓存的压缩数据
+            compressor = zlib.compressobj(1, zlib.DEFLATED, DEFLATE_WBITS)
+            head = compressor.compress(_response_prefix(request_id)) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            return encode_frame(head + response.deflated, FLAG_DEFLATE)
+        body = _response_prefix(request_id) + response.body[1:] if request_id is not None else response.body
+    else:
+        if request_id is not None:
+            response = dict(response, request_id=request_id)
+        body = json.dumps(response).encode('utf-8')
+    if compress:
+        return encode_frame(deflate(body), FLAG_DEFLATE)
+    return encode_frame(body)
+
+
+def encode_legacy_response(response):
+    """旧协议的响应：不分帧的JSON"""
+    if isinstance(response, EncodedResponse):
+        return response.body
+    return json.dumps(response).encode('utf-8')
+
+
+def decode_payload(flags, payload):
+    if flags & FLAG_DEFLATE:
+        payload = zlib.decompress(payload, DEFLATE_WBITS)
+    return json.loads(payload.decode('utf-8'))
+
+
+class FrameDecoder:
+    """增量解码器：喂入任意切分的字节流，取出完整的帧"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+
+    def frames(self):
+        while len(self.buffer) >= HEADER_SIZE:
+            flags, length = parse_header(bytes(self.buffer[:HEADER_SIZE]))
+            end = HEADER_SIZE + length
+            if len(self.buffer) < end:
+                return
+            payload = bytes(self.buffer[HEADER_SIZE:end])
+            del self.buffer[:end]
+            yield flags, payload
+
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError('连接已关闭')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_message(sock, message):
+    sock.sendall(encode_message(message))
+
+
+def recv_message(sock):
+    """阻塞读取一条分帧消息，供客户端和工具脚本使用"""
+    flags, length = parse_header(recv_exactly(sock, HEADER_SIZE))
+    return decode_payload(flags, recv_exactly(sock, length))
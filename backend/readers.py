@@ -0,0 +1,143 @@
+"""行情读取进程
+
+使用--readers N启动时，主进程另外启动N个读取进程，和主进程用SO_REUSEPORT监听同一个端口，
+由内核把新连接分配到各个进程。读取进程映射主进程的共享内存行情表（market_table.py），
+get_stocks的全量行情以及版本号已是最新的增量轮询直接由读取进程返回：每个版本只序列化一次，
+之后的请求直接发送同一份字节，与主进程的交易线程互不争用。
+
+其他请求（包括需要变化记录的增量行情和行情订阅）通过一条连接转发到主进程只监听在本机的内部端口，
+主进程的响应和推送原样转发回客户端。
+"""
+import asyncio
+import json
+import signal
+import socket
+
+import protocol
+from market_data import SnapshotCache
+from market_table import MarketTableReader
+
+# 与server.py相同的监听队列长度
+LISTEN_BACKLOG = 1024
+
+
+def run_reader(host, port, table_name, upstream_port):
+    """读取进程入口"""
+    # Ctrl+C会发给整个进程组，由主进程结束各读取进程
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(MarketReader(table_name, upstream_port).serve(host, port))
+
+
+class MarketReader:
+    def __init__(self, table_name, upstream_port):
+        self.table = MarketTableReader(table_name)
+        self.upstream_port = upstream_port
+        self.snapshot_cache = SnapshotCache()
+
+    async def serve(self, host, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        sock.listen(LISTEN_BACKLOG)
+        sock.setblocking(False)
+        server = await asyncio.start_server(self.handle_client, sock=sock, backlog=LISTEN_BACKLOG)
+        async with server:
+            await server.serve_forever()
+
+    def local_response(self, request):
+        """可以由共享内存行情表直接返回的响应，其他请求返回None"""
+        if not isinstance(request, dict) or request.get('action') != 'get_stocks':
+            return None
+        version, usable = self.table.version()
+        if not usable:
+            return None
+        since = request.get('since_version')
+        if isinstance(since, int) and request.get('epoch') == self.table.epoch:
+            if since != version:
+                # 需要主进程的变化记录
+                return None
+            return {'success': True, 'stocks': {}, 'removed': [], 'version': version,
+                    'epoch': self.table.epoch, 'full': False}
+        def build():
+            # 读到的可能比version更新，响应中使用实际读到的版本号
+            read_version, stocks = self.table.read()
+            return {'success': True, 'stocks': stocks, 'version': read_version,
+                    'epoch': self.table.epoch, 'full': True}
+        return self.snapshot_cache.get(version, build, compress=request.get('compress', False))
+
+    async def handle_client(self, reader, writer):
+        upstream = None
+        try:
+            data = await reader.read(1024)
+            if data and protocol.is_framed(data[0]):
+                upstream = await self.handle_framed_client(reader, writer, data)
+                return
+
+            # 旧协议：一次read对应一个完整的JSON请求，转发时改用分帧格式
+            while data:
+                try:
+                    request = json.loads(data)
+                except json.JSONDecodeError:
+                    request = None
+                response = self.local_response(request)
+                if response is None:
+                    if request is None:
+                        response = {'error': 'Invalid JSON'}
+                    else:
+                        if upstream is None:
+                            upstream = await asyncio.open_connection('127.0.0.1', self.upstream_port)
+                        upstream[1].write(protocol.encode_message(request))
+                        await upstream[1].drain()
+                        flags, length = protocol.parse_header(await upstream[0].readexactly(protocol.HEADER_SIZE))
+                        response = protocol.decode_payload(flags, await upstream[0].readexactly(length))
+                writer.write(protocol.encode_legacy_response(response))
+                await writer.drain()
+                data = await reader.read(1024)
+        except (OSError, asyncio.IncompleteReadError, protocol.FrameError):
+            pass
+        finally:
+            writer.close()
+            if upstream is not None:
+                upstream[1].close()
+
+    async def handle_framed_client(self, reader, writer, data):
+        """分帧协议：能直接返回的请求立即响应，其余按原样转发，返回到主进程的连接"""
+        decoder = protocol.FrameDecoder()
+        upstream = None
+        relay = None
+        try:
+            while data:
+                decoder.feed(data)
+                for flags, payload in decoder.frames():
+                    try:
+                        request = protocol.decode_payload(flags, payload)
+                    except ValueError:
+                        request = None
+                    response = self.local_response(request)
+                    if response is not None:
+                        writer.write(protocol.encode_response(response, request.get('request_id'),
+                                                              request.get('compress', False)))
+                        continue
+                    if upstream is None:
+                        upstream = await asyncio.open_connection('127.0.0.1', self.upstream_port)
+                        relay = asyncio.create_task(self.relay(upstream[0], writer))
+                    upstream[1].write(protocol.encode_frame(payload, flags))
+                await writer.drain()
+                if upstream is not None:
+                    await upstream[1].drain()
+                data = await reader.read(65536)
+        finally:
+            if relay is not None:
+                relay.cancel()
+        return upstream
+
+    async def relay(self, upstream, writer):
+        """把主进程的响应和推送逐帧转发给客户端，不会与本进程的响应交错"""
+        try:
+            while True:
+                header = await upstream.readexactly(protocol.HEADER_SIZE)
+                _, length = protocol.parse_header(header)
+                writer.write(header + await upstream.readexactly(length))
+                await writer.drain()
+        except (OSError, asyncio.IncompleteReadError, protocol.FrameError):
+            writer.close()
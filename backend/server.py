@@ -1,82 +1,144 @@
 import socket
 import threading
 import json
+import gc
+import hashlib
+import math
+import os
 import sqlite3
 import time
-import random
 import signal
 import sys
+import asyncio
+import argparse
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import migrations
+import pagination
+import protocol
+from accounts import AccountCache
+from auth import (HASH_SCHEME, PASSWORD_ITERATIONS, SessionTable, dummy_hash, hash_password, is_hashed,
+                  needs_rehash, verify_password)
+from candles import RESOLUTIONS, CandleStore
+from locks import LockStripes
+from market_data import MarketDataHub, MarketVersions, SnapshotCache
+from market_sim import MarketSimulator, percent_change
+from market_table import MarketTable
+from metrics import UNKNOWN_ACTION, Metrics
+from order_book import BUY, SELL, Order, MatchingEngine
+from profiling import Profiler
+from readers import run_reader
+from storage import ConnectionPool
+from tick_store import TickStore
+from write_pipeline import GroupCommitWriter
+
+# 监听队列长度，避免大量客户端同时连接时被内核丢弃
+LISTEN_BACKLOG = 1024
+# 不访问数据库、可以直接在事件循环中执行的请求
+INLINE_ACTIONS = {'get_stocks', 'get_kline'}
+# 需要在分帧连接上持续推送的请求，由连接处理代码直接处理
+SUBSCRIPTION_ACTIONS = {'subscribe', 'unsubscribe'}
+# get_users可用的排序列
+USER_SORT_COLUMNS = ('id', 'username', 'balance')
+# 交易记录汇总时最多扫描的记录数，超出时只汇总最新的部分
+MAX_AGGREGATE_ROWS = 1000000
+# 一次批量委托最多包含的笔数
+MAX_BATCH_ORDERS = 100
+# 启动时每次从数据库读取的股票数
+LOAD_BATCH = 1000
+# 不需要股票数据、股票加载完成前就可以处理的请求
+PRELOAD_ACTIONS = {'register', 'login', 'logout', 'get_transactions', 'get_users', 'get_write_stats', 'get_cache_stats',
+                   'get_metrics', 'start_profile', 'stop_profile', 'get_profile_status'}
+# 需要登录令牌的请求，用户ID由令牌确定，不使用请求中的user_id
+USER_ACTIONS = {'get_user_info', 'buy', 'sell', 'batch_orders', 'place_order', 'cancel_order'}
+# 令牌无效时的响应
+LOGIN_REQUIRED = {'success': False, 'message': '未登录或登录已过期'}
+# 共享内存行情表的最小行数，实际容量为加载时股票数的两倍
+MARKET_TABLE_MIN_ROWS = 1024
+# 未知请求的响应，统计指标时据此识别
+UNKNOWN_RESPONSE = {'error': 'Unknown action'}
 
 class StockTradingServer:
-    def __init__(self, host='0.0.0.0', port=10024):
+    def __init__(self, host='0.0.0.0', port=10024, mode='thread', max_workers=32,
+                 db_path='stock_trading.db', commit_batch=256, commit_delay=0.0, tick_interval=30.0,
+                 tick_dir='ticks', account_cache_mb=64, profile_dir='profiles', lazy_load=False,
+                 checkpoint_interval=5.0, session_ttl=3600.0, readers=0):
         self.host = host
         self.port = port
+        self.tick_interval = tick_interval
+        # 内存中的价格每隔checkpoint_interval秒把变化过的股票写回数据库
+        self.checkpoint_interval = checkpoint_interval
+        self.dirty_stocks = set()
+        self.dirty_lock = threading.Lock()
+        self.simulator = MarketSimulator()
+        self.market_hub = MarketDataHub()
+        self.market_versions = MarketVersions()
+        # 分配版本号和写入行情表在同一把锁内，行情表的版本号按顺序递增
+        self.publish_lock = threading.Lock()
+        self.snapshot_cache = SnapshotCache()
+        self.full_snapshot = None  # 当前版本的全量行情响应
+        self.candles = CandleStore()
+        self.ticks = TickStore(tick_dir)
+        # 用户余额和持仓的缓存，由写线程在提交后更新
+        self.accounts = AccountCache(int(account_cache_mb * 1024 * 1024))
+        self.db = ConnectionPool(db_path, size=max_workers)
+        self.metrics = Metrics()
+        self.profiler = Profiler(profile_dir)
+        # 交易写操作统一交给写线程成组提交
+        self.writer = GroupCommitWriter(self.db, max_batch=commit_batch, max_delay=commit_delay,
+                                        latency=self.metrics.commit_latency)
+        self.mode = mode  # 'thread': 每个连接一个线程; 'asyncio': 事件循环多路复用
+        self.max_workers = max_workers
+        self.executor = None
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # 读取进程与本进程监听同一个端口，get_stocks由它们从共享内存行情表返回，
+        # 其他请求经本机的内部端口转发回本进程
+        self.readers = readers
+        self.market_table = None
+        self.internal_socket = None
+        self.reader_processes = []
+        if readers:
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.clients = []
         self.stocks = {}
-        self.orders = []
+        self.orders = MatchingEngine()
+        # 按股票分段的锁，保护订单簿和内存中的行情；余额和持仓的读写由写线程串行执行
+        self.symbol_locks = LockStripes()
         self.connections = []
         self.admin_password = 'admin123'  # 后台管理密码
+        # 登录令牌只保存在内存中，超过session_ttl秒没有使用后失效
+        self.sessions = SessionTable(session_ttl)
+        self.password_iterations = PASSWORD_ITERATIONS
+        self.metrics.gauge('stock_active_connections', '当前的客户端连接数', lambda: len(self.connections))
+        self.metrics.gauge('stock_write_queue_depth', '等待成组提交的写操作数', lambda: self.writer.queue.qsize())
+        self.metrics.gauge('stock_symbols', '股票数', lambda: len(self.stocks))
+        self.metrics.gauge('stock_sessions', '有效的登录令牌数', lambda: len(self.sessions))
+        # 股票和挂单加载完成后设置；lazy_load时在start()绑定端口之后于后台加载
+        self.stocks_loaded = threading.Event()
         self.setup_database()
-        self.load_stocks()
+        self.writer.start()
+        if not lazy_load:
+            # 还没有开始接受连接，GC的设置只影响加载：加载时会创建大量长期存在的对象
+            # （每只股票的行情和各周期K线），暂停GC避免反复扫描，完成后把它们移出GC的扫描范围。
+            # lazy_load时加载与请求处理同时进行，不改变GC的设置
+            gc.disable()
+            try:
+                self.load_universe()
+            finally:
+                gc.enable()
+            gc.freeze()
         self.generate_html_files()
         
     def setup_database(self):
-        conn = sqlite3.connect('stock_trading.db')
-        c = conn.cursor()
-        
-        # 创建用户表
-        c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE,
-            password TEXT,
-            balance REAL DEFAULT 20000
-        )
-        ''')
-        
-        # 创建股票表
-        c.execute('''
-        CREATE TABLE IF NOT EXISTS stocks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            stock_code TEXT UNIQUE,
-            company_name TEXT,
-            price REAL,
-            change REAL
-        )
-        ''')
-        
-        # 创建持仓表
-        c.execute('''
-        CREATE TABLE IF NOT EXISTS holdings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            stock_code TEXT,
-            quantity INTEGER,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-        ''')
-        
-        # 创建交易记录表
-        c.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            stock_code TEXT,
-            type TEXT,
-            price REAL,
-            quantity INTEGER,
-            timestamp TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        """执行尚未执行的数据库结构迁移"""
+        before, after = migrations.migrate(self.db)
+        if before != after:
+            print(f"数据库结构已从版本{before}升级到版本{after}")
     
     def generate_html_files(self):
-        """生成Linux端需要的HTML文件"""
-        import os
+        """生成Linux端需要的HTML文件，内容没有变化的文件不重写"""
+        changed = 0
         
         # 创建linux_frontend/templates目录
         templates_dir = os.path.join('..', 'linux_frontend', 'templates')
@@ -174,8 +236,7 @@ class StockTradingServer:
 </body>
 </html>'''
         
-        with open(os.path.join(templates_dir, 'index.html'), 'w', encoding='utf-8') as f:
-            f.write(index_html)
+        changed += write_if_changed(os.path.join(templates_dir, 'index.html'), index_html)
         
         # 生成stocks.html
         stocks_html = '''<!DOCTYPE html>
@@ -345,7 +406,16 @@ class StockTradingServer:
         <div style="background-color: #fefefe; margin: 15% auto; padding: 20px; border: 1px solid #888; width: 80%; max-width: 1000px; border-radius: 5px;">
             <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 20px;">
                 <h3 id="klineTitle">股票K线图</h3>
-                <button onclick="closeKLine()" style="font-size: 20px; cursor: pointer; background: none; border: none;">&times;</button>
+                <div>
+                    <select id="klineResolution" onchange="loadKLine()">
+                        <option value="1s">1秒</option>
+                        <option value="1m" selected>1分钟</option>
+                        <option value="5m">5分钟</option>
+                        <option value="1h">1小时</option>
+                        <option value="1d">日线</option>
+                    </select>
+                    <button onclick="closeKLine()" style="font-size: 20px; cursor: pointer; background: none; border: none;">&times;</button>
+                </div>
             </div>
             <div id="klineContainer" style="width: 100%; height: 400px;"></div>
         </div>
@@ -354,34 +424,41 @@ class StockTradingServer:
     <!-- 引入ECharts库 -->
     <script src="https://cdn.jsdelivr.net/npm/echarts@5.4.3/dist/echarts.min.js"></script>
     <script>
+        let klineStock = null;
+        let klineChart = null;
+        
         function showKLine(stockCode) {
+            klineStock = stockCode;
             document.getElementById('klineTitle').textContent = stockCode + ' 股票K线图';
             document.getElementById('klineModal').style.display = 'block';
-            
-            // 生成模拟K线数据
-            const data = [];
-            let basePrice = Math.random() * 100 + 10;
-            
-            for (let i = 30; i >= 0; i--) {
-                const open = basePrice;
-                const close = basePrice * (1 + (Math.random() - 0.5) * 0.1);
-                const high = Math.max(open, close) * (1 + Math.random() * 0.05);
-                const low = Math.min(open, close) * (1 - Math.random() * 0.05);
-                basePrice = close;
-                
-                data.push([
-                    new Date(Date.now() - i * 24 * 60 * 60 * 1000).getTime(),
-                    open.toFixed(2),
-                    high.toFixed(2),
-                    low.toFixed(2),
-                    close.toFixed(2)
-                ]);
+            loadKLine();
+        }
+        
+        function loadKLine() {
+            const resolution = document.getElementById('klineResolution').value;
+            fetch('/kline/' + encodeURIComponent(klineStock) + '?resolution=' + resolution)
+            .then(response => response.json())
+            .then(result => {
+                if (!result.success) {
+                    alert(result.message || result.error);
+                    return;
+                }
+                // 服务器返回[起始时间(秒), 开, 高, 低, 收, 成交量]，ECharts需要[时间, 开, 收, 低, 高]
+                const data = result.bars.map(bar => [bar[0] * 1000, bar[1], bar[4], bar[3], bar[2]]);
+                renderKLine(data);
+            });
+        }
+        
+        function renderKLine(data) {
+            // 初始化ECharts实例，切换周期时复用
+            if (!klineChart) {
+                klineChart = echarts.init(document.getElementById('klineContainer'));
+                // 响应式调整
+                window.addEventListener('resize', function() {
+                    klineChart.resize();
+                });
             }
             
-            // 初始化ECharts实例
-            const chartDom = document.getElementById('klineContainer');
-            const myChart = echarts.init(chartDom);
-            
             const option = {
                 tooltip: {
                     trigger: 'axis',
@@ -421,12 +498,7 @@ class StockTradingServer:
                 ]
             };
             
-            myChart.setOption(option);
-            
-            // 响应式调整
-            window.addEventListener('resize', function() {
-                myChart.resize();
-            });
+            klineChart.setOption(option, true);
         }
         
         function closeKLine() {
@@ -493,8 +565,7 @@ class StockTradingServer:
 </body>
 </html>'''
         
-        with open(os.path.join(templates_dir, 'stocks.html'), 'w', encoding='utf-8') as f:
-            f.write(stocks_html)
+        changed += write_if_changed(os.path.join(templates_dir, 'stocks.html'), stocks_html)
         
         # 生成users.html
         users_html = '''<!DOCTYPE html>
@@ -582,6 +653,15 @@ class StockTradingServer:
         .balance {
             font-weight: bold;
         }
+        .filter input, .filter select {
+            padding: 8px;
+            margin-right: 10px;
+            border: 1px solid #ddd;
+            border-radius: 4px;
+        }
+        .error {
+            color: #f44336;
+        }
     </style>
 </head>
 <body>
@@ -595,6 +675,22 @@ class StockTradingServer:
         
         <div class="card">
             <h2>用户列表</h2>
+            <form class="filter" method="get" action="/users">
+                <input type="text" name="username_prefix" placeholder="用户名前缀" value="{{ username_prefix }}">
+                <select name="sort">
+                    <option value="id" {{ 'selected' if sort == 'id' }}>按用户ID</option>
+                    <option value="username" {{ 'selected' if sort == 'username' }}>按用户名</option>
+                    <option value="balance" {{ 'selected' if sort == 'balance' }}>按余额</option>
+                </select>
+                <select name="order">
+                    <option value="asc" {{ 'selected' if order == 'asc' }}>升序</option>
+                    <option value="desc" {{ 'selected' if order == 'desc' }}>降序</option>
+                </select>
+                <button type="submit" class="btn">查询</button>
+            </form>
+            {% if message %}
+            <p class="error">{{ message }}</p>
+            {% endif %}
             <table>
                 <tr>
                     <th>用户ID</th>
@@ -609,28 +705,47 @@ class StockTradingServer:
                 </tr>
                 {% endfor %}
             </table>
+            <a class="btn" href="{{ url_for('users', sort=sort, order=order, username_prefix=username_prefix) }}">第一页</a>
+            {% if next_cursor %}
+            <a class="btn" href="{{ url_for('users', sort=sort, order=order, username_prefix=username_prefix, cursor=next_cursor) }}">下一页</a>
+            {% endif %}
         </div>
     </div>
 </body>
 </html>'''
         
-        with open(os.path.join(templates_dir, 'users.html'), 'w', encoding='utf-8') as f:
-            f.write(users_html)
+        changed += write_if_changed(os.path.join(templates_dir, 'users.html'), users_html)
         
         # 生成app.py
-        app_py = '''from flask import Flask, render_template, request, jsonify
+        app_py = '''from flask import Flask, Response, render_template, request, jsonify
 import socket
+import struct
 import json
 
 app = Flask(__name__)
 
+# 分帧协议的消息头：1字节标志位 + 4字节大端消息长度
+FRAME_HEADER = struct.Struct('>BI')
+
+def recv_exactly(client_socket, size):
+    chunks = []
+    while size > 0:
+        chunk = client_socket.recv(min(size, 65536))
+        if not chunk:
+            raise ConnectionError('连接已关闭')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
 # 连接到后端服务器
 def send_request_to_server(request_data):
     try:
         client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         client_socket.connect(('localhost', 10024))
-        client_socket.send(json.dumps(request_data).encode('utf-8'))
-        response = client_socket.recv(1024).decode('utf-8')
+        payload = json.dumps(request_data).encode('utf-8')
+        client_socket.sendall(FRAME_HEADER.pack(0, len(payload)) + payload)
+        flags, length = FRAME_HEADER.unpack(recv_exactly(client_socket, FRAME_HEADER.size))
+        response = recv_exactly(client_socket, length).decode('utf-8')
         client_socket.close()
         return json.loads(response)
     except Exception as e:
@@ -674,35 +789,100 @@ def delete_stock():
     
     return jsonify(response)
 
+@app.route('/kline/<stock_code>')
+def kline(stock_code):
+    response = send_request_to_server({
+        'action': 'get_kline',
+        'stock_code': stock_code,
+        'resolution': request.args.get('resolution', '1m')
+    })
+    
+    return jsonify(response)
+
 @app.route('/users')
 def users():
-    response = send_request_to_server({
+    # 每次只取一页，用户很多时页面和内存占用都不随用户数增长
+    sort = request.args.get('sort', 'id')
+    order = request.args.get('order', 'asc')
+    username_prefix = request.args.get('username_prefix', '')
+    request_data = {
         'action': 'get_users',
+        'admin_password': 'admin123',
+        'sort': sort,
+        'order': order,
+        'limit': 100
+    }
+    if username_prefix:
+        request_data['username_prefix'] = username_prefix
+    if request.args.get('cursor'):
+        request_data['cursor'] = request.args['cursor']
+    
+    response = send_request_to_server(request_data)
+    users = response.get('users', [])
+    message = response.get('message') or response.get('error')
+    return render_template('users.html', users=users, next_cursor=response.get('next_cursor'),
+                           sort=sort, order=order, username_prefix=username_prefix, message=message)
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus抓取的文本格式指标
+    response = send_request_to_server({
+        'action': 'get_metrics',
+        'format': 'prometheus',
         'admin_password': 'admin123'
     })
-    users = response.get('users', [])
-    return render_template('users.html', users=users)
+    if 'text' not in response:
+        return Response(response.get('message') or response.get('error', ''), status=502, mimetype='text/plain')
+    
+    return Response(response['text'], mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=10027, debug=True)'''
         
         app_py_path = os.path.join('..', 'linux_frontend', 'app.py')
-        with open(app_py_path, 'w', encoding='utf-8') as f:
-            f.write(app_py)
+        changed += write_if_changed(app_py_path, app_py)
         
-        print("HTML文件和Flask应用已生成")
+        if changed:
+            print(f"HTML文件和Flask应用已生成（{changed}个文件有变化）")
+        else:
+            print("HTML文件和Flask应用没有变化")
+    
+    def load_universe(self):
+        """加载股票和挂单，完成后放行等待中的请求"""
+        started = time.perf_counter()
+        self.load_stocks()
+        self.load_orders()
+        if self.readers:
+            self.open_market_table()
+        self.stocks_loaded.set()
+        print(f"已加载{len(self.stocks)}只股票，耗时{time.perf_counter() - started:.2f}s")
     
     def load_stocks(self):
-        conn = sqlite3.connect('stock_trading.db')
-        c = conn.cursor()
-        c.execute('SELECT stock_code, company_name, price, change FROM stocks')
-        for row in c.fetchall():
-            self.stocks[row[0]] = {
-                'company_name': row[1],
-                'price': row[2],
-                'change': row[3]
-            }
-        conn.close()
+        """分批读取股票表，不一次把全部结果读入内存"""
+        with self.db.connection() as conn:
+            c = conn.execute('SELECT stock_code, company_name, price, change FROM stocks')
+            while True:
+                rows = c.fetchmany(LOAD_BATCH)
+                if not rows:
+                    break
+                batch = {}
+                for row in rows:
+                    batch[row[0]] = {
+                        'company_name': row[1],
+                        'price': row[2],
+                        'change': row[3]
+                    }
+                self.stocks.update(batch)
+                # 以启动时的价格开始K线
+                self.candles.record(batch)
+    
+    def load_orders(self):
+        """把未成交的挂单按委托顺序恢复到订单簿"""
+        with self.db.connection() as conn:
+            c = conn.execute('SELECT id, user_id, stock_code, side, price, remaining FROM orders '
+                             "WHERE status = 'open' ORDER BY id")
+            for order_id, user_id, stock_code, side, price, remaining in c.fetchall():
+                self.orders.book(stock_code).rest(Order(order_id, user_id, side, price, remaining))
     
     def start(self):
         # 注册信号处理
@@ -710,24 +890,87 @@ if __name__ == '__main__':
         signal.signal(signal.SIGTERM, self.signal_handler)
         
         self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
-        print(f"服务器启动在 {self.host}:{self.port}")
+        self.server_socket.listen(LISTEN_BACKLOG)
+        print(f"服务器启动在 {self.host}:{self.port} ({self.mode}模式)")
         print("按 Ctrl+C 退出")
         
+        if self.readers:
+            self.internal_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.internal_socket.bind(('127.0.0.1', 0))
+            self.internal_socket.listen(LISTEN_BACKLOG)
+            launcher = threading.Thread(target=self.start_readers, name='readers')
+            launcher.daemon = True
+            launcher.start()
+        
+        # 先开始接受连接，股票在后台加载，需要股票数据的请求等到加载完成
+        if not self.stocks_loaded.is_set():
+            loader = threading.Thread(target=self.load_universe, name='loader')
+            loader.daemon = True
+            loader.start()
+
+        upgrader = threading.Thread(target=self.upgrade_plaintext_passwords, name='password-upgrade')
+        upgrader.daemon = True
+        upgrader.start()
+
+        self.start_market_threads()
+        
+        # 分帧连接上的并发请求也交给线程池执行
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='request')
+        
+        if self.mode == 'asyncio':
+            try:
+                asyncio.run(self.serve_async())
+            except KeyboardInterrupt:
+                self.shutdown()
+            return
+        
+        if self.internal_socket is not None:
+            internal = threading.Thread(target=self.accept_connections, args=(self.internal_socket,),
+                                        name='internal')
+            internal.daemon = True
+            internal.start()
+        try:
+            self.accept_connections(self.server_socket)
+        except KeyboardInterrupt:
+            self.shutdown()
+    
+    def accept_connections(self, server_socket):
+        while True:
+            client_socket, client_address = server_socket.accept()
+            print(f"新连接: {client_address}")
+            client_thread = threading.Thread(target=self.handle_client, args=(client_socket,))
+            client_thread.daemon = True
+            client_thread.start()
+    
+    def open_market_table(self):
+        """把全部行情写入共享内存行情表，之后的变化由publish_market_change同步"""
+        table = MarketTable(max(MARKET_TABLE_MIN_ROWS, 2 * len(self.stocks)), self.market_versions.epoch)
+        with self.publish_lock:
+            table.publish(dict(self.stocks), self.market_versions.version)
+            self.market_table = table
+    
+    def start_readers(self):
+        """股票加载完成、行情表建立之后启动读取进程"""
+        self.stocks_loaded.wait()
+        context = multiprocessing.get_context('spawn')
+        for index in range(self.readers):
+            process = context.Process(target=run_reader, name=f'reader-{index}',
+                                      args=(self.host, self.port, self.market_table.name,
+                                            self.internal_socket.getsockname()[1]))
+            process.daemon = True
+            process.start()
+            self.reader_processes.append(process)
+        print(f"已启动{self.readers}个行情读取进程")
+    
+    def start_market_threads(self):
         # 启动市场模拟线程
         self.market_thread = threading.Thread(target=self.simulate_market)
         self.market_thread.daemon = True
         self.market_thread.start()
         
-        try:
-            while True:
-                client_socket, client_address = self.server_socket.accept()
-                print(f"新连接: {client_address}")
-                client_thread = threading.Thread(target=self.handle_client, args=(client_socket,))
-                client_thread.daemon = True
-                client_thread.start()
-        except KeyboardInterrupt:
-            self.shutdown()
+        self.checkpoint_thread = threading.Thread(target=self.run_checkpoints, name='checkpoint')
+        self.checkpoint_thread.daemon = True
+        self.checkpoint_thread.start()
     
     def signal_handler(self, sig, frame):
         print("\n收到退出信号...")
@@ -736,56 +979,332 @@ if __name__ == '__main__':
     def shutdown(self):
         print("正在保存数据...")
         
-        # 保存所有股票数据
-        for stock_code in self.stocks:
-            stock_info = self.stocks[stock_code]
-            conn = sqlite3.connect('stock_trading.db')
-            c = conn.cursor()
-            c.execute('UPDATE stocks SET price = ?, change = ? WHERE stock_code = ?', 
-                     (stock_info['price'], stock_info['change'], stock_code))
-            conn.commit()
-            conn.close()
+        # 只需写回上次检查点之后价格变化过的股票
+        saved = self.checkpoint()
+        for process in self.reader_processes:
+            process.terminate()
+            process.join()
+        if self.market_table is not None:
+            self.market_table.close()
+            self.market_table = None
+        self.writer.stop()
+        self.db.close()
+        self.ticks.close()
         
-        print("数据保存完成")
+        print(f"数据保存完成（{saved}只股票）")
         print("服务器已关闭")
         sys.exit(0)
     
     def handle_client(self, client_socket):
         self.connections.append(client_socket)
         try:
-            while True:
-                data = client_socket.recv(1024).decode('utf-8')
-                if not data:
-                    break
-                
+            data = client_socket.recv(1024)
+            if data and protocol.is_framed(data[0]):
+                self.handle_framed_client(client_socket, data)
+                return
+            
+            # 旧协议：一次recv对应一个完整的JSON请求
+            while data:
                 try:
                     request = json.loads(data)
                     response = self.process_request(request)
-                    client_socket.send(json.dumps(response).encode('utf-8'))
                 except json.JSONDecodeError:
-                    response = {'error': 'Invalid JSON'}
-                    client_socket.send(json.dumps(response).encode('utf-8'))
+                    request, response = None, {'error': 'Invalid JSON'}
+                client_socket.sendall(self.encode_legacy_reply(request, response))
+                data = client_socket.recv(1024)
         except Exception as e:
             print(f"处理客户端请求时出错: {e}")
         finally:
             client_socket.close()
             self.connections.remove(client_socket)
     
+    def handle_framed_client(self, client_socket, data):
+        """分帧协议：请求并发执行，响应按完成顺序带着request_id返回"""
+        decoder = protocol.FrameDecoder()
+        send_lock = threading.Lock()
+        subscriptions = {}
+        
+        def reply(payload):
+            with send_lock:
+                client_socket.sendall(payload)
+        
+        try:
+            while data:
+                decoder.feed(data)
+                for flags, payload in decoder.frames():
+                    request = self.decode_frame_request(flags, payload)
+                    if request is None:
+                        reply(protocol.encode_response({'error': 'Invalid JSON'}))
+                    elif request.get('action') in SUBSCRIPTION_ACTIONS:
+                        self.handle_subscription(request, subscriptions, reply)
+                    elif request.get('action') in INLINE_ACTIONS:
+                        self.run_framed_request(request, reply)
+                    else:
+                        self.executor.submit(self.run_framed_request, request, reply)
+                data = client_socket.recv(65536)
+        finally:
+            for subscription in subscriptions.values():
+                self.market_hub.unsubscribe(subscription)
+    
+    def decode_frame_request(self, flags, payload):
+        try:
+            request = protocol.decode_payload(flags, payload)
+        except ValueError:
+            return None
+        return request if isinstance(request, dict) else None
+    
+    def run_framed_request(self, request, reply):
+        try:
+            response = self.process_request(request)
+        except Exception as e:
+            print(f"处理客户端请求时出错: {e}")
+            response = {'success': False, 'message': '服务器内部错误'}
+        try:
+            reply(self.encode_reply(request, response))
+        except OSError:
+            pass  # 客户端已断开
+    
+    def open_subscription(self, request, notify):
+        """创建订阅，返回(订阅, 响应)，响应中带有订阅股票的当前行情"""
+        symbols = request.get('symbols')
+        if symbols is not None and not isinstance(symbols, list):
+            return None, {'success': False, 'message': 'symbols必须是股票代码列表'}
+        subscription = self.market_hub.subscribe(symbols, notify)
+        if symbols:
+            snapshot = {code: self.stocks[code] for code in symbols if code in self.stocks}
+        else:
+            snapshot = dict(self.stocks)
+        return subscription, {'success': True, 'subscription_id': subscription.subscription_id, 'stocks': snapshot}
+    
+    def close_subscription(self, request, subscriptions):
+        subscription = subscriptions.pop(request.get('subscription_id'), None)
+        if subscription is None:
+            return {'success': False, 'message': '订阅不存在'}
+        self.market_hub.unsubscribe(subscription)
+        return {'success': True, 'message': '已取消订阅'}
+    
+    def market_update_message(self, subscription, updates, version):
+        return {'type': 'market_update', 'subscription_id': subscription.subscription_id,
+                'stocks': updates, 'version': version, 'epoch': self.market_versions.epoch}
+    
+    def handle_subscription(self, request, subscriptions, reply):
+        if request.get('action') == 'unsubscribe':
+            reply(protocol.encode_response(self.close_subscription(request, subscriptions), request.get('request_id')))
+            return
+        self.stocks_loaded.wait()
+        wakeup = threading.Event()
+        subscription, response = self.open_subscription(request, wakeup.set)
+        reply(protocol.encode_response(response, request.get('request_id')))
+        if subscription is None:
+            return
+        subscriptions[subscription.subscription_id] = subscription
+        pusher = threading.Thread(target=self.push_updates, args=(subscription, wakeup, reply))
+        pusher.daemon = True
+        pusher.start()
+    
+    def push_updates(self, subscription, wakeup, reply):
+        """推送线程：有新行情时把合并后的变化一次发出"""
+        try:
+            while True:
+                wakeup.wait()
+                wakeup.clear()
+                if subscription.closed:
+                    return
+                # 先读版本号再取数据，客户端用这个版本号续传时不会漏掉变化
+                version = self.market_versions.version
+                updates = subscription.drain()
+                if updates:
+                    reply(protocol.encode_message(self.market_update_message(subscription, updates, version)))
+        except OSError:
+            self.market_hub.unsubscribe(subscription)
+    
+    async def serve_async(self):
+        """asyncio模式：所有连接复用一个事件循环，阻塞操作交给有界线程池"""
+        # 限制排队等待线程池的请求数量，线程池饱和时对客户端形成背压
+        self.pending_requests = asyncio.Semaphore(self.max_workers * 4)
+        servers = []
+        for sock in (self.server_socket, self.internal_socket):
+            if sock is not None:
+                sock.setblocking(False)
+                servers.append(await asyncio.start_server(self.handle_client_async, sock=sock,
+                                                          backlog=LISTEN_BACKLOG))
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+    
+    async def handle_client_async(self, reader, writer):
+        self.connections.append(writer)
+        try:
+            data = await reader.read(1024)
+            if data and protocol.is_framed(data[0]):
+                await self.handle_framed_client_async(reader, writer, data)
+                return
+            
+            while data:
+                try:
+                    request = json.loads(data)
+                    response = await self.process_request_async(request)
+                except json.JSONDecodeError:
+                    request, response = None, {'error': 'Invalid JSON'}
+                writer.write(self.encode_legacy_reply(request, response))
+                await writer.drain()
+                data = await reader.read(1024)
+        except Exception as e:
+            print(f"处理客户端请求时出错: {e}")
+        finally:
+            writer.close()
+            self.connections.remove(writer)
+    
+    async def handle_framed_client_async(self, reader, writer, data):
+        decoder = protocol.FrameDecoder()
+        tasks = set()
+        subscriptions = {}
+        try:
+            while data:
+                decoder.feed(data)
+                for flags, payload in decoder.frames():
+                    request = self.decode_frame_request(flags, payload)
+                    if request is not None and request.get('action') in SUBSCRIPTION_ACTIONS:
+                        coroutine = self.handle_subscription_async(request, subscriptions, writer)
+                    else:
+                        coroutine = self.run_framed_request_async(request, writer)
+                    task = asyncio.create_task(coroutine)
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                data = await reader.read(65536)
+        finally:
+            for subscription in subscriptions.values():
+                self.market_hub.unsubscribe(subscription)
+            for task in tasks:
+                task.cancel()
+    
+    async def handle_subscription_async(self, request, subscriptions, writer):
+        if request.get('action') == 'unsubscribe':
+            response = self.close_subscription(request, subscriptions)
+            writer.write(protocol.encode_response(response, request.get('request_id')))
+            return
+        loop = asyncio.get_running_loop()
+        if not self.stocks_loaded.is_set():
+            await loop.run_in_executor(None, self.stocks_loaded.wait)
+        wakeup = asyncio.Event()
+        subscription, response = self.open_subscription(request, lambda: loop.call_soon_threadsafe(wakeup.set))
+        writer.write(protocol.encode_response(response, request.get('request_id')))
+        if subscription is None:
+            return
+        subscriptions[subscription.subscription_id] = subscription
+        try:
+            while True:
+                await wakeup.wait()
+                wakeup.clear()
+                if subscription.closed:
+                    return
+                version = self.market_versions.version
+                updates = subscription.drain()
+                if updates:
+                    writer.write(protocol.encode_message(self.market_update_message(subscription, updates, version)))
+                    # 客户端消费慢时在这里等待，期间的行情在订阅中合并
+                    await writer.drain()
+        except (OSError, ConnectionError):
+            self.market_hub.unsubscribe(subscription)
+    
+    async def run_framed_request_async(self, request, writer):
+        if request is None:
+            writer.write(protocol.encode_response({'error': 'Invalid JSON'}))
+            return
+        try:
+            response = await self.process_request_async(request)
+        except Exception as e:
+            print(f"处理客户端请求时出错: {e}")
+            response = {'success': False, 'message': '服务器内部错误'}
+        writer.write(self.encode_reply(request, response))
+        await writer.drain()
+    
+    def encode_reply(self, request, response):
+        """编码分帧响应"""
+        compress = request.get('compress', False)
+        return protocol.encode_response(self.cached_response(request, response, compress),
+                                        request.get('request_id'), compress)
+    
+    def encode_legacy_reply(self, request, response):
+        return protocol.encode_legacy_response(self.cached_response(request, response, False))
+    
+    def cached_response(self, request, response, compress):
+        """全量行情每个版本只序列化（和压缩）一次，之后的请求直接发送缓存的字节"""
+        if (isinstance(request, dict) and request.get('action') == 'get_stocks'
+                and isinstance(response, dict) and response.get('full') is True):
+            return self.snapshot_cache.get(response['version'], lambda: response, compress=compress)
+        return response
+    
+    async def process_request_async(self, request):
+        # 加载完成前交给线程池等待，不阻塞事件循环
+        if request.get('action') in INLINE_ACTIONS and self.stocks_loaded.is_set():
+            return self.process_request(request)
+        async with self.pending_requests:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self.process_request, request)
+    
     def process_request(self, request):
+        """处理请求并记录请求数、耗时和是否失败"""
+        started = time.perf_counter()
+        response = None
+        try:
+            if not self.stocks_loaded.is_set() and request.get('action') not in PRELOAD_ACTIONS:
+                self.stocks_loaded.wait()
+            if self.profiler.session is None:
+                response = self.dispatch_request(request)
+            else:
+                response = self.profiler.run(request.get('action'), self.dispatch_request, request)
+            return response
+        finally:
+            action = request.get('action')
+            if not isinstance(action, str) or response is UNKNOWN_RESPONSE:
+                action = UNKNOWN_ACTION
+            failed = response is None or isinstance(response, dict) and (
+                'error' in response or response.get('success') is False)
+            self.metrics.observe_request(action, time.perf_counter() - started, failed)
+    
+    def dispatch_request(self, request):
         action = request.get('action')
+        if action in USER_ACTIONS:
+            user_id = self.sessions.get(request.get('token'))
+            if user_id is None:
+                return LOGIN_REQUIRED
+            request = dict(request, user_id=user_id)
         
         if action == 'register':
             return self.register_user(request)
         elif action == 'login':
             return self.login_user(request)
+        elif action == 'logout':
+            if not self.sessions.revoke(request.get('token')):
+                return LOGIN_REQUIRED
+            return {'success': True, 'message': '已退出登录'}
         elif action == 'get_stocks':
-            return self.get_stocks()
+            return self.get_stocks(request)
         elif action == 'get_user_info':
             return self.get_user_info(request)
+        elif action == 'get_transactions':
+            # 管理员可以查询任意用户或全部用户，普通用户只能查询自己的交易记录
+            if request.get('admin_password') != self.admin_password:
+                user_id = self.sessions.get(request.get('token'))
+                if user_id is None:
+                    return LOGIN_REQUIRED
+                request = dict(request, user_id=user_id)
+            return self.get_transactions(request)
         elif action == 'buy':
             return self.buy_stock(request)
         elif action == 'sell':
             return self.sell_stock(request)
+        elif action == 'batch_orders':
+            return self.batch_orders(request)
+        elif action == 'place_order':
+            return self.place_order(request)
+        elif action == 'cancel_order':
+            return self.cancel_order(request)
+        elif action == 'get_depth':
+            return self.get_depth(request)
+        elif action == 'get_kline':
+            return self.get_kline(request)
+        elif action == 'get_ticks':
+            return self.get_ticks(request)
         elif action == 'add_stock':
             # 验证管理员密码
             if request.get('admin_password') != self.admin_password:
@@ -796,63 +1315,164 @@ if __name__ == '__main__':
             if request.get('admin_password') != self.admin_password:
                 return {'success': False, 'message': '管理员密码错误'}
             return self.delete_stock(request)
+        elif action == 'set_volatility':
+            if request.get('admin_password') != self.admin_password:
+                return {'success': False, 'message': '管理员密码错误'}
+            return self.set_volatility(request)
         elif action == 'get_users':
             # 验证管理员密码
             if request.get('admin_password') != self.admin_password:
                 return {'success': False, 'message': '管理员密码错误'}
-            return self.get_users()
+            return self.get_users(request)
+        elif action in SUBSCRIPTION_ACTIONS:
+            return {'success': False, 'message': '订阅行情需要使用分帧协议'}
+        elif action == 'get_write_stats':
+            if request.get('admin_password') != self.admin_password:
+                return {'success': False, 'message': '管理员密码错误'}
+            return {'success': True, 'stats': self.writer.stats()}
+        elif action == 'get_cache_stats':
+            if request.get('admin_password') != self.admin_password:
+                return {'success': False, 'message': '管理员密码错误'}
+            return {'success': True, 'stats': self.snapshot_cache.stats(), 'accounts': self.accounts.stats()}
+        elif action == 'get_metrics':
+            if request.get('admin_password') != self.admin_password:
+                return {'success': False, 'message': '管理员密码错误'}
+            if request.get('format') == 'prometheus':
+                return {'success': True, 'text': self.metrics.prometheus()}
+            return {'success': True, 'metrics': self.metrics.to_dict()}
+        elif action in ('start_profile', 'stop_profile', 'get_profile_status'):
+            if request.get('admin_password') != self.admin_password:
+                return {'success': False, 'message': '管理员密码错误'}
+            return self.profile_action(action, request)
         else:
-            return {'error': 'Unknown action'}
+            return UNKNOWN_RESPONSE
+    
+    def profile_action(self, action, request):
+        if action == 'start_profile':
+            try:
+                status = self.profiler.start(request.get('mode', 'sampling'), request.get('seconds'),
+                                             request.get('requests'), request.get('actions'),
+                                             request.get('interval', 0.005))
+            except ValueError as e:
+                return {'success': False, 'message': str(e)}
+            return {'success': True, 'status': status}
+        if action == 'stop_profile':
+            result = self.profiler.stop()
+            if result is None:
+                return {'success': False, 'message': '没有正在进行的分析'}
+            return {'success': True, 'result': result}
+        return {'success': True, 'status': self.profiler.status()}
     
     def register_user(self, request):
         username = request.get('username')
         password = request.get('password')
+        if not isinstance(username, str) or not username or not isinstance(password, str) or not password:
+            return {'success': False, 'message': '用户名和密码不能为空'}
         
-        conn = sqlite3.connect('stock_trading.db')
-        c = conn.cursor()
-        
+        # 哈希在写事务之外计算
+        password_hash = hash_password(password, self.password_iterations)
         try:
-            c.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, password))
-            conn.commit()
+            with self.db.transaction() as conn:
+                conn.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, password_hash))
             return {'success': True, 'message': '注册成功'}
         except sqlite3.IntegrityError:
             return {'success': False, 'message': '用户名已存在'}
-        finally:
-            conn.close()
     
     def login_user(self, request):
+        """校验密码并发放登录令牌，之后的请求凭令牌确定用户"""
         username = request.get('username')
         password = request.get('password')
         
-        conn = sqlite3.connect('stock_trading.db')
-        c = conn.cursor()
-        c.execute('SELECT id, balance FROM users WHERE username = ? AND password = ?', (username, password))
-        user = c.fetchone()
-        conn.close()
+        with self.db.connection() as conn:
+            c = conn.execute('SELECT id, balance, password FROM users WHERE username = ?', (username,))
+            user = c.fetchone()
         
-        if user:
-            return {'success': True, 'user_id': user[0], 'balance': user[1]}
-        else:
+        if not user:
+            # 与用户存在时一样计算一次哈希，响应时间不暴露用户名是否存在
+            dummy_hash(password, self.password_iterations)
+            return {'success': False, 'message': '用户名或密码错误'}
+        if not verify_password(user[2], password, self.password_iterations):
             return {'success': False, 'message': '用户名或密码错误'}
+        user_id, balance, stored = user
+        if needs_rehash(stored, self.password_iterations):
+            # 明文密码或旧的哈希在登录成功时升级
+            self.writer.submit(self.execute_password_upgrade, user_id, stored,
+                               hash_password(password, self.password_iterations))
+        token = self.sessions.create(user_id)
+        return {'success': True, 'user_id': user_id, 'balance': balance, 'token': token,
+                'expires_in': self.sessions.ttl}
+    
+    def execute_password_upgrade(self, c, user_id, old, new):
+        """在写线程中替换密码哈希，密码已被其他请求修改时不覆盖"""
+        c.execute('UPDATE users SET password = ? WHERE id = ? AND password = ?', (new, user_id, old))
+    
+    def upgrade_plaintext_passwords(self):
+        """后台把旧版本留下的明文密码分批换成哈希，不必等到用户下次登录"""
+        last_id = 0
+        upgraded = 0
+        while True:
+            with self.db.connection() as conn:
+                rows = conn.execute('SELECT id, password FROM users WHERE id > ? AND password IS NOT NULL '
+                                    'AND substr(password, 1, ?) != ? ORDER BY id LIMIT ?',
+                                    (last_id, len(HASH_SCHEME) + 1, HASH_SCHEME + '$', LOAD_BATCH)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            # 哈希在写线程之外计算，每批一个写操作
+            updates = [(hash_password(stored, self.password_iterations), user_id, stored)
+                       for user_id, stored in rows if isinstance(stored, str) and not is_hashed(stored)]
+            if updates:
+                self.writer.submit(self.execute_password_upgrades, updates)
+                upgraded += len(updates)
+        if upgraded:
+            print(f"已把{upgraded}个明文密码换成哈希")
     
-    def get_stocks(self):
-        return {'success': True, 'stocks': self.stocks}
+    def execute_password_upgrades(self, c, updates):
+        c.executemany('UPDATE users SET password = ? WHERE id = ? AND password = ?', updates)
+    
+    def get_stocks(self, request=None):
+        """返回全部行情；带since_version和epoch时只返回该版本之后变化的股票"""
+        request = request or {}
+        versions = self.market_versions
+        version = versions.version
+        since = request.get('since_version')
+        changed = None
+        if isinstance(since, int) and request.get('epoch') == versions.epoch:
+            changed = versions.changed_since(since)
+        if changed is None:
+            # 同一版本的请求共用一个响应字典（调用方不应修改），发送时按版本复用序列化好的字节
+            snapshot = self.full_snapshot
+            if snapshot is None or snapshot['version'] != version:
+                snapshot = self.full_snapshot = {
+                    'success': True,
+                    'stocks': dict(self.stocks),
+                    'version': version,
+                    'epoch': versions.epoch,
+                    'full': True
+                }
+            return snapshot
+        
+        stocks = {}
+        removed = []
+        for stock_code in changed:
+            stock_info = self.stocks.get(stock_code)
+            if stock_info is None:
+                removed.append(stock_code)
+            else:
+                stocks[stock_code] = stock_info
+        return {'success': True, 'stocks': stocks, 'removed': removed, 'version': version,
+                'epoch': versions.epoch, 'full': False}
     
     def get_user_info(self, request):
         user_id = request.get('user_id')
         
-        conn = sqlite3.connect('stock_trading.db')
-        c = conn.cursor()
+        account = self.accounts.get(user_id, lambda: self.load_account(user_id))
+        if account is None:
+            return {'success': False, 'message': '用户不存在'}
+        balance, rows = account
         
-        # 获取用户余额
-        c.execute('SELECT balance FROM users WHERE id = ?', (user_id,))
-        balance = c.fetchone()[0]
-        
-        # 获取用户持仓
-        c.execute('SELECT stock_code, quantity FROM holdings WHERE user_id = ?', (user_id,))
         holdings = []
-        for row in c.fetchall():
-            stock_code, quantity = row
+        for stock_code, quantity in rows:
             stock_info = self.stocks.get(stock_code, {})
             if stock_info:
                 holdings.append({
@@ -863,9 +1483,104 @@ if __name__ == '__main__':
                     'value': quantity * stock_info['price']
                 })
         
-        conn.close()
         return {'success': True, 'balance': balance, 'holdings': holdings}
     
+    def load_account(self, user_id):
+        """从数据库读取余额和持仓，用户不存在时返回None"""
+        with self.db.connection() as conn:
+            c = conn.cursor()
+            
+            # 获取用户余额
+            c.execute('SELECT balance FROM users WHERE id = ?', (user_id,))
+            user = c.fetchone()
+            if not user:
+                return None
+            
+            # 获取用户持仓
+            c.execute('SELECT stock_code, quantity FROM holdings WHERE user_id = ?', (user_id,))
+            return user[0], c.fetchall()
+    
+    def get_transactions(self, request):
+        """按用户、股票、时间范围查询交易记录，aggregate为真时返回每只股票的成交量和成交均价"""
+        user_id = request.get('user_id')
+        stock_code = request.get('stock_code')
+        start = request.get('start')
+        end = request.get('end')
+        aggregate = request.get('aggregate', False)
+        limit = request.get('limit', 100)
+        cursor = request.get('cursor')
+        if not aggregate and (not isinstance(limit, int) or not 0 < limit <= pagination.MAX_PAGE_SIZE):
+            return {'success': False, 'message': f'每页数量应在1到{pagination.MAX_PAGE_SIZE}之间'}
+        
+        conditions = []
+        params = []
+        if user_id is not None:
+            conditions.append('user_id = ?')
+            params.append(user_id)
+        if stock_code is not None:
+            conditions.append('stock_code = ?')
+            params.append(stock_code)
+        # 时间按本地时间的'YYYY-MM-DD HH:MM:SS'保存，直接按字符串比较，可以使用时间索引
+        for value, operator in ((start, '>='), (end, '<=')):
+            if value is None:
+                continue
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                try:
+                    value = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(value))
+                except (OverflowError, OSError, ValueError):
+                    return {'success': False, 'message': '时间范围错误'}
+            elif not isinstance(value, str):
+                return {'success': False, 'message': '时间范围错误'}
+            conditions.append(f'timestamp {operator} ?')
+            params.append(value)
+        if cursor and not aggregate:
+            position = pagination.decode_cursor(cursor, 'id', 'desc')
+            if not position or not isinstance(position[0], int):
+                return {'success': False, 'message': '分页游标无效'}
+            conditions.append('id < ?')
+            params.append(position[0])
+        
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        with self.db.connection() as conn:
+            
+            if aggregate:
+                # 从最新的记录开始最多扫描MAX_AGGREGATE_ROWS条，耗时有上限
+                rows = conn.execute(
+                    'SELECT stock_code, SUM(quantity), SUM(price * quantity), COUNT(*), '
+                    "SUM(CASE WHEN type = 'buy' THEN quantity ELSE 0 END) FROM ("
+                    f'SELECT stock_code, type, price, quantity FROM transactions{where} ORDER BY id DESC LIMIT ?'
+                    ') GROUP BY stock_code ORDER BY stock_code', params + [MAX_AGGREGATE_ROWS]).fetchall()
+                symbols = [{
+                    'stock_code': code,
+                    'volume': volume,
+                    'buy_volume': buy_volume,
+                    'sell_volume': volume - buy_volume,
+                    'amount': amount,
+                    'vwap': round(amount / volume, 4) if volume else None,
+                    'trades': trades
+                } for code, volume, amount, trades, buy_volume in rows]
+                return {'success': True, 'symbols': symbols,
+                        'complete': sum(symbol['trades'] for symbol in symbols) < MAX_AGGREGATE_ROWS}
+            
+            rows = conn.execute(
+                'SELECT id, user_id, stock_code, type, price, quantity, timestamp '
+                f'FROM transactions{where} ORDER BY id DESC LIMIT ?', params + [limit + 1]).fetchall()
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = pagination.encode_cursor('id', 'desc', rows[-1][0])
+        transactions = [{
+            'id': row[0],
+            'user_id': row[1],
+            'stock_code': row[2],
+            'type': row[3],
+            'price': row[4],
+            'quantity': row[5],
+            'timestamp': row[6]
+        } for row in rows]
+        return {'success': True, 'transactions': transactions, 'next_cursor': next_cursor}
+    
     def buy_stock(self, request):
         user_id = request.get('user_id')
         stock_code = request.get('stock_code')
@@ -875,44 +1590,34 @@ if __name__ == '__main__':
             return {'success': False, 'message': '股票不存在'}
         
         stock_price = self.stocks[stock_code]['price']
+        return self.writer.submit(self.execute_buy, user_id, stock_code, quantity, stock_price)
+    
+    def execute_buy(self, c, user_id, stock_code, quantity, stock_price):
+        """在写线程中执行买入"""
         total_cost = stock_price * quantity
         
-        conn = sqlite3.connect('stock_trading.db')
-        c = conn.cursor()
-        
         # 检查用户余额
         c.execute('SELECT balance FROM users WHERE id = ?', (user_id,))
-        balance = c.fetchone()[0]
+        user = c.fetchone()
+        if not user:
+            return {'success': False, 'message': '用户不存在'}
+        balance = user[0]
         
         if balance < total_cost:
-            conn.close()
             return {'success': False, 'message': '余额不足'}
         
         # 更新用户余额
         new_balance = balance - total_cost
-        c.execute('UPDATE users SET balance = ? WHERE id = ?', (new_balance, user_id))
-        
-        # 检查是否已有持仓
-        c.execute('SELECT quantity FROM holdings WHERE user_id = ? AND stock_code = ?', (user_id, stock_code))
-        existing = c.fetchone()
+        self.change_balance(c, user_id, -total_cost)
         
-        if existing:
-            # 更新持仓
-            new_quantity = existing[0] + quantity
-            c.execute('UPDATE holdings SET quantity = ? WHERE user_id = ? AND stock_code = ?', 
-                     (new_quantity, user_id, stock_code))
-        else:
-            # 新建持仓
-            c.execute('INSERT INTO holdings (user_id, stock_code, quantity) VALUES (?, ?, ?)', 
-                     (user_id, stock_code, quantity))
+        # 新建或增加持仓
+        self.change_holding(c, user_id, stock_code, quantity)
         
         # 记录交易
         timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
         c.execute('INSERT INTO transactions (user_id, stock_code, type, price, quantity, timestamp) VALUES (?, ?, ?, ?, ?, ?)', 
                  (user_id, stock_code, 'buy', stock_price, quantity, timestamp))
-        
-        conn.commit()
-        conn.close()
+        self.writer.on_commit(self.notify_trades, stock_code, [(stock_price, quantity)])
         
         return {'success': True, 'message': '购买成功', 'new_balance': new_balance}
     
@@ -925,127 +1630,643 @@ if __name__ == '__main__':
             return {'success': False, 'message': '股票不存在'}
         
         stock_price = self.stocks[stock_code]['price']
+        return self.writer.submit(self.execute_sell, user_id, stock_code, quantity, stock_price)
+    
+    def execute_sell(self, c, user_id, stock_code, quantity, stock_price):
+        """在写线程中执行卖出"""
         total_revenue = stock_price * quantity
         
-        conn = sqlite3.connect('stock_trading.db')
-        c = conn.cursor()
-        
-        # 检查用户持仓
-        c.execute('SELECT quantity FROM holdings WHERE user_id = ? AND stock_code = ?', (user_id, stock_code))
-        existing = c.fetchone()
-        
-        if not existing or existing[0] < quantity:
-            conn.close()
+        # 检查并扣减持仓
+        if not self.reduce_holding(c, user_id, stock_code, quantity):
             return {'success': False, 'message': '持仓不足'}
         
         # 更新用户余额
         c.execute('SELECT balance FROM users WHERE id = ?', (user_id,))
         balance = c.fetchone()[0]
         new_balance = balance + total_revenue
-        c.execute('UPDATE users SET balance = ? WHERE id = ?', (new_balance, user_id))
-        
-        # 更新持仓
-        new_quantity = existing[0] - quantity
-        if new_quantity > 0:
-            c.execute('UPDATE holdings SET quantity = ? WHERE user_id = ? AND stock_code = ?', 
-                     (new_quantity, user_id, stock_code))
-        else:
-            c.execute('DELETE FROM holdings WHERE user_id = ? AND stock_code = ?', (user_id, stock_code))
+        self.change_balance(c, user_id, total_revenue)
         
         # 记录交易
         timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
         c.execute('INSERT INTO transactions (user_id, stock_code, type, price, quantity, timestamp) VALUES (?, ?, ?, ?, ?, ?)', 
                  (user_id, stock_code, 'sell', stock_price, quantity, timestamp))
-        
-        conn.commit()
-        conn.close()
+        self.writer.on_commit(self.notify_trades, stock_code, [(stock_price, quantity)])
         
         return {'success': True, 'message': '卖出成功', 'new_balance': new_balance}
     
+    def batch_orders(self, request):
+        """一次提交多笔按现价成交的买卖，在同一个事务中执行"""
+        user_id = request.get('user_id')
+        orders = request.get('orders')
+        mode = request.get('mode', 'atomic')
+        
+        if mode not in ('atomic', 'best_effort'):
+            return {'success': False, 'message': '批量模式错误'}
+        if not isinstance(orders, list) or not orders:
+            return {'success': False, 'message': '委托列表为空'}
+        if len(orders) > MAX_BATCH_ORDERS:
+            return {'success': False, 'message': f'一次最多提交{MAX_BATCH_ORDERS}笔委托'}
+        
+        # 先检查每笔的格式，并按提交时的现价成交
+        legs = []
+        for order in orders:
+            order = order if isinstance(order, dict) else {}
+            side = order.get('side')
+            stock_code = order.get('stock_code')
+            quantity = order.get('quantity')
+            if side not in (BUY, SELL):
+                error = '买卖方向错误'
+            elif stock_code not in self.stocks:
+                error = '股票不存在'
+            elif not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+                error = '委托数量错误'
+            else:
+                error = None
+            price = self.stocks[stock_code]['price'] if error is None else None
+            legs.append((side, stock_code, quantity, price, error))
+        
+        return self.writer.submit(self.execute_batch, user_id, legs, mode == 'atomic')
+    
+    def execute_batch(self, c, user_id, legs, atomic):
+        """在写线程中按顺序核对余额和持仓，再一次写入所有可以成交的委托"""
+        c.execute('SELECT balance FROM users WHERE id = ?', (user_id,))
+        user = c.fetchone()
+        if not user:
+            return {'success': False, 'message': '用户不存在'}
+        balance = user[0]
+        c.execute('SELECT stock_code, quantity FROM holdings WHERE user_id = ?', (user_id,))
+        holdings = dict(c.fetchall())
+        
+        # 前面的委托成交后的余额和持仓作为后面委托的检查条件
+        results = []
+        executed = []
+        for i, (side, stock_code, quantity, price, error) in enumerate(legs):
+            if error is None:
+                if side == BUY and balance < price * quantity:
+                    error = '余额不足'
+                elif side == SELL and holdings.get(stock_code, 0) < quantity:
+                    error = '持仓不足'
+            result = {'index': i, 'side': side, 'stock_code': stock_code, 'quantity': quantity}
+            if error is not None:
+                result.update({'success': False, 'message': error})
+                results.append(result)
+                continue
+            if side == BUY:
+                balance -= price * quantity
+                holdings[stock_code] = holdings.get(stock_code, 0) + quantity
+            else:
+                balance += price * quantity
+                holdings[stock_code] -= quantity
+            result.update({'success': True, 'message': '购买成功' if side == BUY else '卖出成功', 'price': price})
+            results.append(result)
+            executed.append((side, stock_code, quantity, price))
+        
+        failed = len(results) - len(executed)
+        if atomic and failed:
+            first = next(result for result in results if not result['success'])
+            for result in results:
+                if result['success']:
+                    # 没有成交，不返回成交价
+                    del result['price']
+                    result.update({'success': False, 'message': '未执行'})
+            return {'success': False, 'message': f"第{first['index'] + 1}笔委托{first['message']}，全部未执行",
+                    'results': results}
+        
+        # 余额和每只股票的持仓各只更新一次
+        delta = 0.0
+        net = {}
+        trades = {}
+        for side, stock_code, quantity, price in executed:
+            sign = 1 if side == BUY else -1
+            delta -= sign * price * quantity
+            net[stock_code] = net.get(stock_code, 0) + sign * quantity
+            trades.setdefault(stock_code, []).append((price, quantity))
+        if executed:
+            self.change_balance(c, user_id, delta)
+            for stock_code, quantity in net.items():
+                if quantity > 0:
+                    self.change_holding(c, user_id, stock_code, quantity)
+                elif quantity < 0 and not self.reduce_holding(c, user_id, stock_code, -quantity):
+                    # 上面已按数据库中的持仓核对过，不应发生；抛出异常回滚整批
+                    raise RuntimeError('批量委托持仓不足')
+            timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+            c.executemany('INSERT INTO transactions (user_id, stock_code, type, price, quantity, timestamp) '
+                          'VALUES (?, ?, ?, ?, ?, ?)',
+                          [(user_id, stock_code, side, price, quantity, timestamp)
+                           for side, stock_code, quantity, price in executed])
+            for stock_code, stock_trades in trades.items():
+                self.writer.on_commit(self.notify_trades, stock_code, stock_trades)
+        
+        return {'success': True, 'message': f'成交{len(executed)}笔，失败{failed}笔', 'results': results,
+                'new_balance': balance}
+    
     def add_stock(self, request):
         stock_code = request.get('stock_code')
         company_name = request.get('company_name')
         price = request.get('price')
         
-        conn = sqlite3.connect('stock_trading.db')
-        c = conn.cursor()
-        
         try:
-            c.execute('INSERT INTO stocks (stock_code, company_name, price, change) VALUES (?, ?, ?, ?)', 
-                     (stock_code, company_name, price, 0))
-            conn.commit()
+            with self.db.transaction() as conn:
+                conn.execute('INSERT INTO stocks (stock_code, company_name, price, change) VALUES (?, ?, ?, ?)', 
+                             (stock_code, company_name, price, 0))
+        except sqlite3.IntegrityError:
+            return {'success': False, 'message': '股票代码已存在'}
+        
+        with self.symbol_locks.holding(stock_code):
             self.stocks[stock_code] = {
                 'company_name': company_name,
                 'price': price,
                 'change': 0
             }
-            conn.close()
-            return {'success': True, 'message': '股票添加成功'}
-        except sqlite3.IntegrityError:
-            conn.close()
-            return {'success': False, 'message': '股票代码已存在'}
+            self.notify_market_change({stock_code: dict(self.stocks[stock_code])})
+        return {'success': True, 'message': '股票添加成功'}
     
     def delete_stock(self, request):
         stock_code = request.get('stock_code')
         
-        conn = sqlite3.connect('stock_trading.db')
-        c = conn.cursor()
-        
-        # 检查是否有用户持有该股票
-        c.execute('SELECT COUNT(*) FROM holdings WHERE stock_code = ?', (stock_code,))
-        if c.fetchone()[0] > 0:
-            conn.close()
-            return {'success': False, 'message': '有用户持有该股票，无法删除'}
-        
-        c.execute('DELETE FROM stocks WHERE stock_code = ?', (stock_code,))
-        if c.rowcount > 0:
-            conn.commit()
-            if stock_code in self.stocks:
-                del self.stocks[stock_code]
-            conn.close()
+        with self.db.transaction() as conn:
+            c = conn.cursor()
+            
+            # 检查是否有用户持有该股票
+            c.execute('SELECT COUNT(*) FROM holdings WHERE stock_code = ?', (stock_code,))
+            if c.fetchone()[0] > 0:
+                return {'success': False, 'message': '有用户持有该股票，无法删除'}
+            
+            c.execute("SELECT COUNT(*) FROM orders WHERE stock_code = ? AND status = 'open'", (stock_code,))
+            if c.fetchone()[0] > 0:
+                return {'success': False, 'message': '该股票还有未成交的委托，无法删除'}
+            
+            c.execute('DELETE FROM stocks WHERE stock_code = ?', (stock_code,))
+            deleted = c.rowcount > 0
+        
+        if deleted:
+            with self.symbol_locks.holding(stock_code):
+                self.stocks.pop(stock_code, None)
+                self.orders.remove(stock_code)
+                self.ticks.remove(stock_code)
+                self.simulator.set_volatility(stock_code, None)
+                self.notify_market_change({stock_code: None})
             return {'success': True, 'message': '股票删除成功'}
         else:
-            conn.close()
             return {'success': False, 'message': '股票不存在'}
     
-    def get_users(self):
-        conn = sqlite3.connect('stock_trading.db')
-        c = conn.cursor()
-        c.execute('SELECT id, username, balance FROM users')
-        users = []
-        for row in c.fetchall():
-            users.append({
-                'id': row[0],
-                'username': row[1],
-                'balance': row[2]
-            })
-        conn.close()
-        return {'success': True, 'users': users}
+    def set_volatility(self, request):
+        """设置一只股票在行情模拟中的波动率，不保存到数据库"""
+        stock_code = request.get('stock_code')
+        volatility = request.get('volatility')
+        if stock_code not in self.stocks:
+            return {'success': False, 'message': '股票不存在'}
+        if volatility is not None and (not isinstance(volatility, (int, float)) or isinstance(volatility, bool)
+                                       or not math.isfinite(volatility) or volatility < 0):
+            return {'success': False, 'message': '波动率错误'}
+        self.simulator.set_volatility(stock_code, volatility)
+        return {'success': True, 'message': '波动率已设置'}
+    
+    def get_users(self, request=None):
+        """分页返回用户列表，next_cursor不为空时用它请求下一页"""
+        request = request or {}
+        sort = request.get('sort', 'id')
+        order = request.get('order', 'asc')
+        limit = request.get('limit', 100)
+        cursor = request.get('cursor')
+        username_prefix = request.get('username_prefix')
+        if sort not in USER_SORT_COLUMNS or order not in ('asc', 'desc'):
+            return {'success': False, 'message': '排序方式错误'}
+        if not isinstance(limit, int) or not 0 < limit <= pagination.MAX_PAGE_SIZE:
+            return {'success': False, 'message': f'每页数量应在1到{pagination.MAX_PAGE_SIZE}之间'}
+        if username_prefix is not None and not isinstance(username_prefix, str):
+            return {'success': False, 'message': '用户名前缀错误'}
+        
+        columns = ['id'] if sort == 'id' else [sort, 'id']
+        conditions = []
+        params = []
+        if username_prefix:
+            low, high = pagination.prefix_range(username_prefix)
+            conditions.append('username >= ?')
+            params.append(low)
+            if high is not None:
+                conditions.append('username < ?')
+                params.append(high)
+        for key, operator in (('min_balance', '>='), ('max_balance', '<=')):
+            value = request.get(key)
+            if value is not None:
+                if not isinstance(value, (int, float)):
+                    return {'success': False, 'message': '余额范围错误'}
+                conditions.append(f'balance {operator} ?')
+                params.append(value)
+        if cursor:
+            position = pagination.decode_cursor(cursor, sort, order)
+            if position is None or len(position) != len(columns):
+                return {'success': False, 'message': '分页游标无效'}
+            condition, values = pagination.keyset_condition(columns, order, position)
+            conditions.append(condition)
+            params.extend(values)
+        
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        sql = (f'SELECT id, username, balance FROM users{where} '
+               f'ORDER BY {pagination.order_clause(columns, order)} LIMIT ?')
+        with self.db.connection() as conn:
+            # 多取一行判断是否还有下一页
+            rows = conn.execute(sql, params + [limit + 1]).fetchall()
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = {'id': rows[-1][0], 'username': rows[-1][1], 'balance': rows[-1][2]}
+            next_cursor = pagination.encode_cursor(sort, order, *(last[column] for column in columns))
+        users = [{'id': row[0], 'username': row[1], 'balance': row[2]} for row in rows]
+        return {'success': True, 'users': users, 'next_cursor': next_cursor}
+    
+    def change_balance(self, c, user_id, delta):
+        """调整余额，提交后同步到账户缓存"""
+        c.execute('UPDATE users SET balance = balance + ? WHERE id = ?', (delta, user_id))
+        self.change_account(self.accounts.change_balance, user_id, delta)
+    
+    def change_holding(self, c, user_id, stock_code, delta):
+        """增加持仓数量，没有持仓时新建记录"""
+        c.execute('INSERT INTO holdings (user_id, stock_code, quantity) VALUES (?, ?, ?) '
+                  'ON CONFLICT (user_id, stock_code) DO UPDATE SET quantity = quantity + excluded.quantity',
+                  (user_id, stock_code, delta))
+        self.change_account(self.accounts.change_holding, user_id, stock_code, delta)
+    
+    def reduce_holding(self, c, user_id, stock_code, quantity):
+        """扣减持仓数量，持仓不足时返回False，数量归零时删除持仓记录"""
+        c.execute('UPDATE holdings SET quantity = quantity - ? WHERE user_id = ? AND stock_code = ? AND quantity >= ?',
+                  (quantity, user_id, stock_code, quantity))
+        if c.rowcount == 0:
+            return False
+        c.execute('DELETE FROM holdings WHERE user_id = ? AND stock_code = ? AND quantity = 0', (user_id, stock_code))
+        self.change_account(self.accounts.change_holding, user_id, stock_code, -quantity)
+        return True
+    
+    def change_account(self, apply, user_id, *args):
+        """提交前标记账户缓存中的用户，提交后用apply更新缓存，回滚时取消标记"""
+        self.accounts.begin_change(user_id)
+        self.writer.on_rollback(self.accounts.abort_change, user_id)
+        self.writer.on_commit(apply, user_id, *args)
+    
+    def place_order(self, request):
+        user_id = request.get('user_id')
+        stock_code = request.get('stock_code')
+        side = request.get('side')
+        order_type = request.get('order_type', 'limit')
+        quantity = request.get('quantity')
+        price = request.get('price')
+        
+        if stock_code not in self.stocks:
+            return {'success': False, 'message': '股票不存在'}
+        if side not in (BUY, SELL):
+            return {'success': False, 'message': '买卖方向错误'}
+        if order_type not in ('limit', 'market'):
+            return {'success': False, 'message': '委托类型错误'}
+        if not isinstance(quantity, int) or quantity <= 0:
+            return {'success': False, 'message': '委托数量错误'}
+        if order_type == 'limit':
+            if not isinstance(price, (int, float)) or not math.isfinite(price):
+                return {'success': False, 'message': '委托价格错误'}
+            # 先按挂单精度取整再检查，0.004这样的价格取整后为0
+            price = round(float(price), 2)
+            if price <= 0:
+                return {'success': False, 'message': '委托价格错误'}
+        else:
+            price = None
+        
+        return self.writer.submit(self.execute_order, user_id, stock_code, side, order_type, price, quantity)
+    
+    def execute_order(self, c, user_id, stock_code, side, order_type, price, quantity):
+        """在写线程中执行委托，成交在提交后更新行情"""
+        changes = []
+        self.writer.on_rollback(self.undo_book, stock_code, changes)
+        # 修改订单簿期间持有该股票的锁，查询盘口时看到的是完整的状态
+        with self.symbol_locks.holding(stock_code):
+            response = self.match_order(c, user_id, stock_code, side, order_type, price, quantity, changes)
+        if response.get('fills'):
+            self.writer.on_commit(self.apply_fills, stock_code,
+                                  [(fill['price'], fill['quantity']) for fill in response['fills']])
+        return response
+    
+    def match_order(self, c, user_id, stock_code, side, order_type, price, quantity, changes):
+        """冻结资金或股票、撮合并结算成交"""
+        book = self.orders.book(stock_code)
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        
+        # 冻结资金或股票
+        if side == BUY:
+            c.execute('SELECT balance FROM users WHERE id = ?', (user_id,))
+            user = c.fetchone()
+            if not user:
+                return {'success': False, 'message': '用户不存在'}
+            if price is None:
+                quantity, frozen = book.sweep(BUY, quantity, budget=user[0], user_id=user_id)
+                if quantity == 0:
+                    return {'success': False, 'message': '没有可成交的卖单或余额不足'}
+            else:
+                frozen = price * quantity
+                if user[0] < frozen:
+                    return {'success': False, 'message': '余额不足'}
+            self.change_balance(c, user_id, -frozen)
+        else:
+            if price is None and book.sweep(SELL, quantity, user_id=user_id)[0] == 0:
+                return {'success': False, 'message': '没有可成交的买单'}
+            if not self.reduce_holding(c, user_id, stock_code, quantity):
+                return {'success': False, 'message': '持仓不足'}
+        
+        c.execute('INSERT INTO orders (user_id, stock_code, side, order_type, price, quantity, remaining, status, timestamp) '
+                  'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                  (user_id, stock_code, side, order_type, price, quantity, quantity, 'open', timestamp))
+        order = Order(c.lastrowid, user_id, side, price, quantity)
+        fills = book.submit(order, changes)
+        
+        # 结算成交：成交价为挂单价，买方按委托价冻结的多余资金退回
+        cost = 0.0
+        for maker, fill_price, fill_quantity in fills:
+            amount = fill_price * fill_quantity
+            cost += amount
+            buyer, seller = (user_id, maker.user_id) if side == BUY else (maker.user_id, user_id)
+            self.change_holding(c, buyer, stock_code, fill_quantity)
+            self.change_balance(c, seller, amount)
+            c.execute("UPDATE orders SET remaining = ?, status = CASE WHEN ? = 0 THEN 'filled' ELSE status END "
+                      'WHERE id = ?', (maker.remaining, maker.remaining, maker.order_id))
+            c.executemany('INSERT INTO transactions (user_id, stock_code, type, price, quantity, timestamp) VALUES (?, ?, ?, ?, ?, ?)',
+                          [(buyer, stock_code, 'buy', fill_price, fill_quantity, timestamp),
+                           (seller, stock_code, 'sell', fill_price, fill_quantity, timestamp)])
+        
+        filled = quantity - order.remaining
+        # 市价单以及遇到自己挂单的限价单不会挂在簿上，未成交部分撤销
+        resting = order.remaining > 0 and order.order_id in book.orders
+        if side == BUY:
+            # 挂单只退还已成交部分的差价，未成交部分继续冻结；撤销时退还全部未用的冻结资金
+            unfrozen = (price * filled if resting else frozen) - cost
+            if unfrozen > 0:
+                self.change_balance(c, user_id, unfrozen)
+        elif order.remaining > 0 and not resting:
+            self.change_holding(c, user_id, stock_code, order.remaining)
+        
+        if order.remaining == 0:
+            status = 'filled'
+        elif resting:
+            status = 'open'
+        else:
+            status = 'cancelled'
+        c.execute('UPDATE orders SET remaining = ?, status = ? WHERE id = ?',
+                  (order.remaining if status == 'open' else 0, status, order.order_id))
+        
+        return {
+            'success': True,
+            'order_id': order.order_id,
+            'status': status,
+            'filled': filled,
+            'remaining': order.remaining if status == 'open' else 0,
+            'fills': [{'price': fill_price, 'quantity': fill_quantity} for _, fill_price, fill_quantity in fills]
+        }
+    
+    def cancel_order(self, request):
+        user_id = request.get('user_id')
+        order_id = request.get('order_id')
+        
+        stock_code = self.open_order_symbol(order_id, user_id)
+        if stock_code is None:
+            return {'success': False, 'message': '委托不存在或已成交'}
+        
+        return self.writer.submit(self.execute_cancel, user_id, stock_code, order_id)
+    
+    def open_order_symbol(self, order_id, user_id):
+        """用户未成交委托的股票代码，委托不存在或已成交时返回None"""
+        with self.db.connection() as conn:
+            c = conn.execute("SELECT stock_code FROM orders WHERE id = ? AND user_id = ? AND status = 'open'",
+                             (order_id, user_id))
+            row = c.fetchone()
+        return row[0] if row else None
+    
+    def execute_cancel(self, c, user_id, stock_code, order_id):
+        """在写线程中撤单并解冻未成交部分"""
+        changes = []
+        self.writer.on_rollback(self.undo_book, stock_code, changes)
+        with self.symbol_locks.holding(stock_code):
+            order = self.orders.book(stock_code).cancel(order_id, changes)
+        if order is None:
+            return {'success': False, 'message': '委托不存在或已成交'}
+        if order.side == BUY:
+            self.change_balance(c, user_id, order.price * order.remaining)
+        else:
+            self.change_holding(c, user_id, stock_code, order.remaining)
+        c.execute("UPDATE orders SET status = 'cancelled' WHERE id = ?", (order_id,))
+        return {'success': True, 'message': '撤单成功', 'cancelled': order.remaining}
+    
+    def undo_book(self, stock_code, changes):
+        """委托或撤单所在的操作回滚时恢复订单簿"""
+        if changes:
+            with self.symbol_locks.holding(stock_code):
+                self.orders.book(stock_code).undo(changes)
+    
+    def get_depth(self, request):
+        stock_code = request.get('stock_code')
+        if stock_code not in self.stocks:
+            return {'success': False, 'message': '股票不存在'}
+        levels = request.get('levels', 5)
+        with self.symbol_locks.holding(stock_code):
+            depth = self.orders.book(stock_code).depth(levels)
+        return {'success': True, 'stock_code': stock_code, 'bids': depth['bids'], 'asks': depth['asks']}
+    
+    def get_kline(self, request):
+        stock_code = request.get('stock_code')
+        resolution = request.get('resolution', '1m')
+        start = request.get('start')
+        end = request.get('end')
+        limit = request.get('limit', 500)
+        if stock_code not in self.stocks:
+            return {'success': False, 'message': '股票不存在'}
+        if resolution not in RESOLUTIONS:
+            return {'success': False, 'message': 'K线周期错误'}
+        for value in (start, end):
+            if value is not None and not isinstance(value, (int, float)):
+                return {'success': False, 'message': '时间范围错误'}
+        if not isinstance(limit, int) or limit <= 0:
+            return {'success': False, 'message': 'K线数量错误'}
+        bars = self.candles.bars(stock_code, resolution, start, end, limit) or []
+        return {'success': True, 'stock_code': stock_code, 'resolution': resolution, 'bars': bars}
+    
+    def get_ticks(self, request):
+        stock_code = request.get('stock_code')
+        start = request.get('start')
+        end = request.get('end')
+        limit = request.get('limit', 1000)
+        if stock_code not in self.stocks:
+            return {'success': False, 'message': '股票不存在'}
+        for value in (start, end):
+            if value is not None and not isinstance(value, (int, float)):
+                return {'success': False, 'message': '时间范围错误'}
+        if not isinstance(limit, int) or limit <= 0:
+            return {'success': False, 'message': '记录数量错误'}
+        ticks = self.ticks.ticks(stock_code, start, end, limit)
+        return {'success': True, 'stock_code': stock_code, 'ticks': ticks}
     
     def simulate_market(self):
+        self.stocks_loaded.wait()
         while True:
-            # 模拟股票价格波动
-            for stock_code in self.stocks:
-                change = random.uniform(-0.05, 0.05)  # 价格波动范围 -5% 到 +5%
-                old_price = self.stocks[stock_code]['price']
-                new_price = old_price * (1 + change)
-                new_price = round(new_price, 2)
-                
-                # 更新股票价格和涨幅
-                self.stocks[stock_code]['price'] = new_price
-                self.stocks[stock_code]['change'] = round(change * 100, 2)
-                
-                # 更新数据库
-                conn = sqlite3.connect('stock_trading.db')
-                c = conn.cursor()
-                c.execute('UPDATE stocks SET price = ?, change = ? WHERE stock_code = ?', 
-                         (new_price, self.stocks[stock_code]['change'], stock_code))
-                conn.commit()
-                conn.close()
+            started = time.monotonic()
+            try:
+                self.market_tick()
+            except Exception as e:
+                # 一次tick出错不能让行情线程退出
+                print(f"行情模拟出错: {e}")
+            self.metrics.tick_latency.observe(time.monotonic() - started)
+            # 扣除本次tick的耗时，保持固定的更新间隔
+            time.sleep(max(0.0, self.tick_interval - (time.monotonic() - started)))
+    
+    def market_tick(self):
+        """整个股票池一次生成新价格，价格由检查点写回数据库"""
+        # 持有全部股票的锁，生成新价格期间的成交价不会被旧价格算出的结果覆盖
+        with self.symbol_locks.holding_all():
+            items = list(self.stocks.items())
+            if not items:
+                return
+            codes = [stock_code for stock_code, _ in items]
+            prices, changes = self.simulator.step(codes, [stock_info['price'] for _, stock_info in items],
+                                                  self.tick_interval)
             
-            # 每30秒更新一次
-            time.sleep(30)
+            updates = {}
+            ticks = []
+            for (stock_code, stock_info), price, change in zip(items, prices, changes):
+                stock_info['price'] = price
+                stock_info['change'] = change
+                updates[stock_code] = {'price': price, 'change': change}
+                ticks.append((stock_code, price, 0))
+            # 先发布行情，逐笔行情写入失败时价格也已经推送并会写回数据库
+            self.notify_market_change(updates)
+            self.ticks.append_many(ticks)
+    
+    def notify_market_change(self, changes):
+        """行情发生变化后调用，changes为{股票代码: 变化的字段}，值为None表示股票已删除"""
+        with self.dirty_lock:
+            for stock_code, stock_info in changes.items():
+                if stock_info is None:
+                    self.dirty_stocks.discard(stock_code)
+                elif 'price' in stock_info:
+                    self.dirty_stocks.add(stock_code)
+        self.candles.record(changes)
+        self.publish_market_change(changes)
+    
+    def publish_market_change(self, changes):
+        """记录行情版本，推送给订阅者，并同步到共享内存行情表"""
+        # 行情线程和写线程（成交）同时发布，版本号必须与写入行情表的顺序一致，
+        # 否则读取进程可能先看到V+1而V还没有写入，按V+1缓存的快照会漏掉V的变化
+        with self.publish_lock:
+            version = self.market_versions.record(changes)
+            self.market_hub.publish(changes)
+            if self.market_table is not None:
+                self.market_table.publish(changes, version)
+    
+    def apply_fills(self, stock_code, trades):
+        """委托成交提交后在写线程中调用，最新成交价作为股票现价，涨跌幅与行情模拟一样相对上一个价格计算"""
+        with self.symbol_locks.holding(stock_code):
+            stock_info = self.stocks.get(stock_code)
+            if stock_info is None:
+                return
+            self.notify_trades(stock_code, trades)
+            price = trades[-1][0]
+            stock_info['change'] = percent_change(stock_info['price'], price)
+            stock_info['price'] = price
+            self.notify_market_change({stock_code: {'price': stock_info['price'], 'change': stock_info['change']}})
+    
+    def notify_trades(self, stock_code, trades):
+        """成交后调用，trades为[(成交价, 成交数量)]"""
+        self.candles.record_trades(stock_code, trades)
+        self.ticks.append_many([(stock_code, price, quantity) for price, quantity in trades])
+    
+    def run_checkpoints(self):
+        while True:
+            time.sleep(self.checkpoint_interval)
+            try:
+                self.checkpoint()
+            except Exception as e:
+                print(f"写回行情出错: {e}")
+    
+    def checkpoint(self):
+        """把上次检查点之后价格变化过的股票在一个事务中写回数据库，返回写回的股票数"""
+        with self.dirty_lock:
+            dirty, self.dirty_stocks = self.dirty_stocks, set()
+        rows = []
+        for stock_code in dirty:
+            stock_info = self.stocks.get(stock_code)
+            if stock_info is not None:
+                rows.append((stock_info['price'], stock_info['change'], stock_code))
+        if not rows:
+            return 0
+        try:
+            # 写线程结算委托时要获取股票锁，这里不持有任何股票锁
+            self.writer.submit(self.execute_price_updates, rows)
+        except Exception:
+            # 写入失败时保留这些股票，下次检查点重试
+            with self.dirty_lock:
+                self.dirty_stocks.update(dirty)
+            raise
+        return len(rows)
+    
+    def execute_price_updates(self, c, rows):
+        c.executemany('UPDATE stocks SET price = ?, change = ? WHERE stock_code = ?', rows)
+
+def write_if_changed(path, content):
+    """内容的哈希与现有文件不同时才写入，返回是否写入"""
+    digest = hashlib.sha256(content.encode('utf-8')).digest()
+    try:
+        with open(path, encoding='utf-8') as f:
+            if hashlib.sha256(f.read().encode('utf-8')).digest() == digest:
+                return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return True
+
+def raise_fd_limit():
+    """把文件描述符软限制提高到硬限制，以便保持上万个空闲连接和逐笔行情段的映射"""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
 
 if __name__ == '__main__':
-    server = StockTradingServer()
+    parser = argparse.ArgumentParser(description='股票交易系统后端服务器')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=10024)
+    parser.add_argument('--mode', choices=['thread', 'asyncio'], default='thread',
+                        help='thread: 每个连接一个线程; asyncio: 事件循环处理所有连接')
+    parser.add_argument('--workers', type=int, default=32,
+                        help='执行数据库操作的线程池大小，同时也是数据库连接池大小')
+    parser.add_argument('--db', default='stock_trading.db', help='SQLite数据库文件')
+    parser.add_argument('--commit-batch', type=int, default=256, help='每次成组提交最多包含的交易数')
+    parser.add_argument('--commit-delay', type=float, default=0.0,
+                        help='成组提交时等待更多交易的最长时间（毫秒）')
+    parser.add_argument('--tick-interval', type=float, default=30.0,
+                        help='行情模拟的更新间隔（秒），可以小于1')
+    parser.add_argument('--tick-dir', default='ticks', help='逐笔行情历史的存放目录')
+    parser.add_argument('--account-cache-mb', type=float, default=64,
+                        help='用户余额和持仓缓存的内存上限（MB），0表示不缓存')
+    parser.add_argument('--profile-dir', default='profiles', help='性能分析结果的保存目录')
+    parser.add_argument('--checkpoint-interval', type=float, default=5.0,
+                        help='把变化过的价格写回数据库的间隔（秒）')
+    parser.add_argument('--session-ttl', type=float, default=3600.0,
+                        help='登录令牌在没有使用多少秒后失效')
+    parser.add_argument('--readers', type=int, default=0,
+                        help='与本进程监听同一端口、从共享内存返回行情的读取进程数')
+    parser.add_argument('--lazy-load', action='store_true',
+                        help='启动后立即接受连接，股票在后台加载，需要股票数据的请求等到加载完成')
+    args = parser.parse_args()
+    
+    # 在创建服务器之前提高，逐笔行情存储按提高后的限制确定映射数上限
+    raise_fd_limit()
+    server = StockTradingServer(args.host, args.port, mode=args.mode, max_workers=args.workers,
+                                db_path=args.db, commit_batch=args.commit_batch,
+                                commit_delay=args.commit_delay / 1000, tick_interval=args.tick_interval,
+                                tick_dir=args.tick_dir, account_cache_mb=args.account_cache_mb,
+                                profile_dir=args.profile_dir, lazy_load=args.lazy_load,
+                                checkpoint_interval=args.checkpoint_interval, session_ttl=args.session_ttl,
+                                readers=args.readers)
     server.start()
\ No newline at end of file
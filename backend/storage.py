@@ -0,0 +1,89 @@
+"""SQLite连接池
+
+请求处理线程从池中借用长连接，用完归还，避免每次请求都重新打开数据库。
+连接使用WAL日志，读操作不会被写操作阻塞；sqlite3模块在每个连接上
+缓存预编译语句，连接复用后相同的SQL不再重复编译。
+"""
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    def __init__(self, path='stock_trading.db', size=16, timeout=30,
+                 cache_size_kb=16000, cached_statements=256):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.cache_size_kb = cache_size_kb
+        self.cached_statements = cached_statements
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """创建一个配置好的新连接，不归入连接池"""
+        # isolation_level=None: 由transaction()显式管理事务
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                               isolation_level=None, cached_statements=self.cached_statements)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # WAL模式下NORMAL只在检查点时fsync，崩溃不会损坏数据库
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{self.cache_size_kb}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    def _acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.size:
+                self.created += 1
+                try:
+                    return self.connect()
+                except Exception:
+                    self.created -= 1
+                    raise
+        # 连接数已达上限，等待其他线程归还
+        return self.idle.get(timeout=self.timeout)
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        self.idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """借用一个连接，用于只读查询"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """借用一个连接并开启写事务，正常退出时提交，异常时回滚"""
+        with self.connection() as conn:
+            # IMMEDIATE: 事务开始时就拿到写锁，读-改-写之间不会被其他写者插入
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self.lock:
+                self.created -= 1
@@ -0,0 +1,297 @@
+"""逐笔行情存储
+
+每只股票一个目录，按追加顺序写入固定容量的段文件。段文件通过mmap映射，
+按列存放时间戳、价格和成交量三个定长数组：
+
+    16字节头（魔数、容量、已写入条数） | 时间戳float64[容量] | 价格float64[容量] | 成交量int64[容量]
+
+写入只是在映射的内存中追加一条记录并更新头部的条数，不经过SQLite。
+读取时在时间戳列上二分查找，返回指向映射内存的memoryview，不复制数据。
+
+段写满后新建下一个段，每只股票最多保留max_segments个段，超出后删除最早的段，
+磁盘占用有上限。同时映射的段数量也有上限，超出后关闭最久未使用的映射。
+每个映射占用一个文件描述符（Python 3.13之前mmap会保留描述符的副本），
+默认上限取RLIMIT_NOFILE软限制的四分之一，其余留给连接和数据库。
+
+股票数超过映射上限时，每次行情更新都按相同顺序写入所有股票，逐条打开段会使映射全部失效。
+因此映射已满时，段没有映射的股票先把记录缓存在内存中，总数达到max_pending后每只股票打开一次段批量写入，
+已映射的段保持映射。缓存的记录在读取该股票或关闭时写入，进程异常退出时会丢失。
+"""
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+HEADER = struct.Struct('<4sIQ')
+MAGIC = b'TICK'
+COUNT_OFFSET = 8
+SEGMENT_SUFFIX = '.seg'
+# 可以直接用作目录名的股票代码，其他代码转成十六进制
+SAFE_CODE = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9._-]*$')
+MAX_OPEN = 4096
+# 映射建立后不再需要文件描述符，Python 3.13起可以让mmap不保留副本
+MMAP_OPTIONS = {'trackfd': False} if sys.version_info >= (3, 13) else {}
+
+
+def default_max_open():
+    """按文件描述符软限制确定同时映射的段数上限"""
+    try:
+        import resource
+    except ImportError:
+        return MAX_OPEN
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return MAX_OPEN
+    return max(16, min(MAX_OPEN, soft // 4))
+
+
+class Segment:
+    """一个映射到内存的段文件"""
+
+    def __init__(self, path, capacity=None):
+        if capacity is not None:
+            # 新建段：文件按容量预留空间（稀疏文件，实际写入时才占用磁盘）
+            with open(path, 'xb') as f:
+                f.truncate(HEADER.size + capacity * 24)
+                f.write(HEADER.pack(MAGIC, capacity, 0))
+        with open(path, 'r+b') as f:
+            self.map = mmap.mmap(f.fileno(), 0, **MMAP_OPTIONS)
+        magic, capacity, count = HEADER.unpack_from(self.map)
+        if magic != MAGIC or len(self.map) != HEADER.size + capacity * 24:
+            self.map.close()
+            raise ValueError(f'无效的行情段文件: {path}')
+        self.capacity = capacity
+        self.count = min(count, capacity)
+        view = memoryview(self.map)
+        size = capacity * 8
+        offset = HEADER.size
+        self.timestamps = view[offset:offset + size].cast('d')
+        self.prices = view[offset + size:offset + 2 * size].cast('d')
+        self.volumes = view[offset + 2 * size:offset + 3 * size].cast('q')
+        view.release()
+
+    def append(self, timestamp, price, volume):
+        i = self.count
+        self.timestamps[i] = timestamp
+        self.prices[i] = price
+        self.volumes[i] = volume
+        # 先写数据再更新条数，进程中途退出时不会读到写了一半的记录
+        self.count = i + 1
+        struct.pack_into('<Q', self.map, COUNT_OFFSET, self.count)
+
+    def full(self):
+        return self.count >= self.capacity
+
+    def first_timestamp(self):
+        return self.timestamps[0] if self.count else None
+
+    def last_timestamp(self):
+        return self.timestamps[self.count - 1] if self.count else None
+
+    def slice(self, start=None, end=None):
+        """返回时间在[start, end]内的(时间戳, 价格, 成交量)三个memoryview"""
+        timestamps = self.timestamps[:self.count]
+        lo = 0 if start is None else bisect_left(timestamps, start)
+        hi = self.count if end is None else bisect_right(timestamps, end)
+        return self.timestamps[lo:hi], self.prices[lo:hi], self.volumes[lo:hi]
+
+    def close(self):
+        for column in (self.timestamps, self.prices, self.volumes):
+            column.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # 读取方还持有切片，映射在切片释放后由垃圾回收关闭
+            pass
+
+
+class SymbolHistory:
+    """一只股票的段列表"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.sequences = []  # 段序号，从旧到新
+        self.first_timestamps = []  # 每个段第一条记录的时间，空段为None
+        self.last_timestamp = None
+
+
+class TickStore:
+    def __init__(self, root, segment_ticks=16384, max_segments=64, max_open=None, max_pending=1 << 20):
+        self.root = root
+        self.segment_ticks = segment_ticks  # 每个段的记录数
+        self.max_segments = max_segments  # 每只股票最多保留的段数
+        self.max_open = max_open if max_open is not None else default_max_open()  # 同时映射的段数上限
+        self.max_pending = max_pending  # 段没有映射时在内存中缓存的记录数上限
+        self.lock = threading.Lock()
+        self.histories = {}
+        self.open_segments = OrderedDict()  # (股票代码, 段序号) -> Segment，按最近使用排序
+        self.pending = {}  # 股票代码 -> [时间戳, 价格, 成交量, ...]
+        self.pending_count = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _directory(self, stock_code):
+        name = stock_code if SAFE_CODE.match(stock_code) else '_' + stock_code.encode('utf-8').hex()
+        return os.path.join(self.root, name)
+
+    def _history(self, stock_code):
+        history = self.histories.get(stock_code)
+        if history is None:
+            history = SymbolHistory(self._directory(stock_code))
+            if os.path.isdir(history.directory):
+                history.sequences = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(history.directory)
+                                           if name.endswith(SEGMENT_SUFFIX))
+                for sequence in history.sequences:
+                    history.first_timestamps.append(self._segment(stock_code, history, sequence).first_timestamp())
+                if history.sequences:
+                    history.last_timestamp = self._segment(stock_code, history, history.sequences[-1]).last_timestamp()
+            self.histories[stock_code] = history
+        return history
+
+    def _segment(self, stock_code, history, sequence, capacity=None):
+        key = (stock_code, sequence)
+        segment = self.open_segments.get(key)
+        if segment is not None:
+            self.open_segments.move_to_end(key)
+            return segment
+        segment = Segment(os.path.join(history.directory, f'{sequence:08d}{SEGMENT_SUFFIX}'), capacity)
+        self.open_segments[key] = segment
+        while len(self.open_segments) > self.max_open:
+            _, evicted = self.open_segments.popitem(last=False)
+            evicted.close()
+        return segment
+
+    def _append(self, stock_code, timestamp, price, volume):
+        history = self._history(stock_code)
+        # 时间戳保持单调，二分查找依赖这一点
+        if history.last_timestamp is not None and timestamp < history.last_timestamp:
+            timestamp = history.last_timestamp
+        history.last_timestamp = timestamp
+        pending = self.pending.get(stock_code)
+        if pending is None:
+            # 段已映射或者还有空余的映射名额时直接写入，只有需要关闭其他映射时才缓存
+            if len(self.open_segments) < self.max_open or (
+                    history.sequences and (stock_code, history.sequences[-1]) in self.open_segments):
+                self._write(stock_code, history, timestamp, price, volume)
+                return
+            pending = self.pending[stock_code] = []
+        pending.extend((timestamp, price, volume))
+        self.pending_count += 1
+        if self.pending_count >= self.max_pending:
+            for code in list(self.pending):
+                self._flush(code, self.histories[code])
+
+    def _flush(self, stock_code, history):
+        """写入一只股票缓存的记录"""
+        pending = self.pending.pop(stock_code, None)
+        if not pending:
+            return
+        self.pending_count -= len(pending) // 3
+        for i in range(0, len(pending), 3):
+            self._write(stock_code, history, pending[i], pending[i + 1], pending[i + 2])
+
+    def _write(self, stock_code, history, timestamp, price, volume):
+        segment = None
+        if history.sequences:
+            segment = self._segment(stock_code, history, history.sequences[-1])
+            if segment.full():
+                segment = None
+        if segment is None:
+            segment = self._rotate(stock_code, history)
+        if segment.count == 0:
+            history.first_timestamps[-1] = timestamp
+        segment.append(timestamp, price, volume)
+
+    def _rotate(self, stock_code, history):
+        os.makedirs(history.directory, exist_ok=True)
+        sequence = history.sequences[-1] + 1 if history.sequences else 1
+        segment = self._segment(stock_code, history, sequence, capacity=self.segment_ticks)
+        history.sequences.append(sequence)
+        history.first_timestamps.append(None)
+        while len(history.sequences) > self.max_segments:
+            oldest = history.sequences.pop(0)
+            history.first_timestamps.pop(0)
+            evicted = self.open_segments.pop((stock_code, oldest), None)
+            if evicted is not None:
+                evicted.close()
+            os.remove(os.path.join(history.directory, f'{oldest:08d}{SEGMENT_SUFFIX}'))
+        return segment
+
+    def append(self, stock_code, price, volume=0, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            self._append(stock_code, timestamp, price, volume)
+
+    def append_many(self, ticks, timestamp=None):
+        """一次追加多只股票的行情，ticks为[(股票代码, 价格, 成交量)]"""
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            for stock_code, price, volume in ticks:
+                self._append(stock_code, timestamp, price, volume)
+
+    def read(self, stock_code, start=None, end=None):
+        """返回时间在[start, end]内的记录，按时间顺序每个段一组(时间戳, 价格, 成交量)memoryview
+
+        memoryview直接指向映射的文件内容，调用方用完后应尽快释放。
+        """
+        with self.lock:
+            history = self._history(stock_code)
+            self._flush(stock_code, history)
+            firsts = history.first_timestamps
+            # 第一个可能包含start的段：下一个段的起始时间晚于start
+            lo = 0
+            if start is not None:
+                while lo + 1 < len(firsts) and firsts[lo + 1] is not None and firsts[lo + 1] <= start:
+                    lo += 1
+            slices = []
+            for i in range(lo, len(history.sequences)):
+                if end is not None and firsts[i] is not None and firsts[i] > end:
+                    break
+                columns = self._segment(stock_code, history, history.sequences[i]).slice(start, end)
+                if len(columns[0]):
+                    slices.append(columns)
+            return slices
+
+    def ticks(self, stock_code, start=None, end=None, limit=None):
+        """返回[[时间戳, 价格, 成交量]]，超过limit时保留最新的limit条"""
+        result = []
+        for timestamps, prices, volumes in reversed(self.read(stock_code, start, end)):
+            if limit is not None:
+                skip = max(0, len(timestamps) - (limit - len(result)))
+                timestamps, prices, volumes = timestamps[skip:], prices[skip:], volumes[skip:]
+            result[:0] = [list(tick) for tick in zip(timestamps.tolist(), prices.tolist(), volumes.tolist())]
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+    def remove(self, stock_code):
+        """删除一只股票的全部历史"""
+        with self.lock:
+            history = self._history(stock_code)
+            pending = self.pending.pop(stock_code, None)
+            if pending:
+                self.pending_count -= len(pending) // 3
+            for sequence in history.sequences:
+                segment = self.open_segments.pop((stock_code, sequence), None)
+                if segment is not None:
+                    segment.close()
+                os.remove(os.path.join(history.directory, f'{sequence:08d}{SEGMENT_SUFFIX}'))
+            del self.histories[stock_code]
+            if os.path.isdir(history.directory):
+                os.rmdir(history.directory)
+
+    def close(self):
+        with self.lock:
+            for stock_code in list(self.pending):
+                self._flush(stock_code, self.histories[stock_code])
+            for segment in self.open_segments.values():
+                segment.map.flush()
+                segment.close()
+            self.open_segments.clear()
+            self.histories.clear()
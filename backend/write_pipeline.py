@@ -0,0 +1,179 @@
+"""成组提交的写入管道
+
+所有交易写操作由一个专用写线程执行。处理线程调用submit()把操作放入队列，
+写线程把队列中的多个操作合并到同一个事务中提交，一次fsync确认一批交易。
+每个操作在独立的保存点中执行，单个操作失败只回滚它自己；
+调用方在所在批次提交成功后才得到结果。
+
+操作中可以用on_commit()登记回调（例如更新内存缓存），批次提交后在写线程中
+按登记顺序执行，操作或批次回滚时丢弃。
+已经提前修改的内存状态（例如订单簿）用on_rollback()登记撤销回调，
+操作或批次回滚时按登记的相反顺序执行，提交后丢弃。
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class GroupCommitWriter:
+    def __init__(self, pool, max_batch=256, max_delay=0.0, latency=None):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay  # 收到第一个操作后最多再等待多久凑批，单位秒
+        self.latency = latency  # 可选的直方图，记录每次提交的耗时
+        self.queue = queue.Queue()
+        self.thread = None
+        self.thread_id = None
+        self.callbacks = None  # 当前操作登记的提交后回调
+        self.rollbacks = None  # 当前操作登记的回滚回调
+        self.stats_lock = threading.Lock()
+        self.batches = 0
+        self.operations = 0
+        self.failed = 0
+        self.max_batch_size = 0
+        self.commit_time = 0.0
+        self.max_commit_time = 0.0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='group-commit', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """处理完队列中剩余的操作后退出"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, func, *args):
+        """在写线程中执行func(cursor, *args)，等到所在批次提交后返回func的结果"""
+        future = Future()
+        self.queue.put((func, args, future))
+        return future.result()
+
+    def on_commit(self, callback, *args):
+        """在写操作中调用：所在批次提交后执行callback(*args)；不在写线程中调用时立即执行"""
+        if threading.get_ident() != self.thread_id:
+            callback(*args)
+            return
+        self.callbacks.append((callback, args))
+    
+    def on_rollback(self, callback, *args):
+        """在写操作中调用：操作或所在批次回滚时执行callback(*args)；不在写线程中调用时忽略"""
+        if threading.get_ident() == self.thread_id:
+            self.rollbacks.append((callback, args))
+    
+    def run_rollbacks(self, rollbacks):
+        for callback, args in reversed(rollbacks):
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"回滚回调出错: {e}")
+    
+    def run(self):
+        self.thread_id = threading.get_ident()
+        conn = self.pool.connect()
+        # 调用方在提交后才得到确认，写连接需要每次提交都落盘
+        conn.execute('PRAGMA synchronous=FULL')
+        try:
+            while True:
+                batch = self.collect_batch()
+                self.commit_batch(conn, batch)
+                if batch[-1] is None:
+                    break
+        finally:
+            conn.close()
+
+    def collect_batch(self):
+        item = self.queue.get()
+        batch = [item]
+        if item is None:
+            return batch
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                timeout = deadline - time.monotonic()
+                item = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            if item is None:
+                break
+        return batch
+
+    def commit_batch(self, conn, batch):
+        operations = [item for item in batch if item is not None]
+        if not operations:
+            return
+        start = time.perf_counter()
+        results = []
+        callbacks = []
+        rollbacks = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for func, args, future in operations:
+                conn.execute('SAVEPOINT operation')
+                self.callbacks = []
+                self.rollbacks = []
+                try:
+                    result = func(conn.cursor(), *args)
+                except Exception as e:
+                    self.run_rollbacks(self.rollbacks)
+                    conn.execute('ROLLBACK TO operation')
+                    results.append((future, None, e))
+                else:
+                    results.append((future, result, None))
+                    callbacks.extend(self.callbacks)
+                    rollbacks.extend(self.rollbacks)
+                conn.execute('RELEASE operation')
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            self.run_rollbacks(rollbacks)
+            for _, _, future in operations:
+                future.set_exception(e)
+            with self.stats_lock:
+                self.failed += len(operations)
+            return
+        finally:
+            self.callbacks = None
+            self.rollbacks = None
+        elapsed = time.perf_counter() - start
+        if self.latency is not None:
+            self.latency.observe(elapsed)
+        
+        # 先执行回调再返回结果，调用方拿到结果时缓存已经更新
+        for callback, args in callbacks:
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"提交后回调出错: {e}")
+
+        with self.stats_lock:
+            self.batches += 1
+            self.operations += len(operations)
+            self.failed += sum(1 for _, _, error in results if error is not None)
+            self.max_batch_size = max(self.max_batch_size, len(operations))
+            self.commit_time += elapsed
+            self.max_commit_time = max(self.max_commit_time, elapsed)
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def stats(self):
+        with self.stats_lock:
+            batches = self.batches
+            return {
+                'batches': batches,
+                'operations': self.operations,
+                'failed': self.failed,
+                'queued': self.queue.qsize(),
+                'avg_batch_size': self.operations / batches if batches else 0,
+                'max_batch_size': self.max_batch_size,
+                'avg_commit_ms': self.commit_time / batches * 1000 if batches else 0,
+                'max_commit_ms': self.max_commit_time * 1000,
+            }